@@ -199,152 +199,45 @@ systemd_enable() {
   sudo ln -sf "../${unit_file}" "${wants_dir}/${unit_alias}"
 }
 
-# Generate a ls-like listing of a directory tree.
-# The ugly printf is used to predictable time format and size in bytes.
+# Generate a ls-like listing of a directory tree, in the same format as
+#   find -printf '%M %2n %-7u %-7g %7s %TY-%Tm-%Td %TH:%TM ./%P -> %l\n'
+# with times in UTC, and optionally the sha256 of every regular file.
+# Usage: write_contents /image/root contents.txt [contents_sha256.txt]
 write_contents() {
-    info "Writing ${2##*/}"
-    pushd "$1" >/dev/null
-    sudo TZ=UTC find -printf \
-        '%M %2n %-7u %-7g %7s %TY-%Tm-%Td %TH:%TM ./%P -> %l\n' \
-        | sed -e 's/ -> $//' > "$2"
-    popd >/dev/null
-}
-
-# "equery list" a potentially uninstalled board package
-query_available_package() {
-    local pkg="$1"
-    local format="${2:-\$cpv::\$repo}"
-    # Ignore masked versions. Assumes that sort --version-sort uses the
-    # same ordering as Portage.
-    equery-${BOARD} --no-color list -po --format "\$mask|$format" "$pkg" | \
-            grep -E '^ +\|' | \
-            cut -f2- -d\| | \
-            sort --version-sort | \
-            tail -n 1
-}
-
-# Generate a list of packages installed in an image.
-# Usage: image_packages /image/root
-image_packages() {
-    local profile="${BUILD_DIR}/configroot/etc/portage/profile"    
-    ROOT="$1" PORTAGE_CONFIGROOT="${BUILD_DIR}"/configroot \
-        equery --no-color list --format '$cpv::$repo' '*'
-
-    # We also want to list packages that only exist in the initramfs.
-    # Approximate this by listing build dependencies of coreos-kernel that
-    # are specified with the "=" slot operator, excluding those already
-    # reported above.
-    local kernel_pkg=$(ROOT="$1" PORTAGE_CONFIGROOT="${BUILD_DIR}"/configroot \
-        equery --no-color list --format '$cpv' sys-kernel/coreos-kernel)
-    # OEM ACIs have no kernel package.
-    if [[ -n "${kernel_pkg}" ]]; then
-        local depend_path="$1/var/db/pkg/$kernel_pkg/DEPEND"
-        local pkg
-        for pkg in $(awk 'BEGIN {RS=" "} /=$/ {print}' "$depend_path"); do
-            if ! ROOT="$1" PORTAGE_CONFIGROOT="${BUILD_DIR}"/configroot \
-                    equery -q list "$pkg" >/dev/null ; then
-                query_available_package "$pkg"
-            fi
-        done
-    fi
-
-    # In production images GCC libraries are extracted manually.
-    if [[ -f "${profile}/package.provided" ]]; then
-        local pkg
-        while read pkg; do
-            query_available_package "${pkg}"
-        done < "${profile}/package.provided"
+    local hash_args=()
+    if [[ -n "$3" ]]; then
+        info "Writing ${2##*/} and ${3##*/}"
+        hash_args=( --hashes="$3" )
+    else
+        info "Writing ${2##*/}"
     fi
-
-    # Include source packages of all torcx images installed on disk.
-    [ -z "${FLAGS_torcx_manifest}" ] ||
-    torcx_manifest::sources_on_disk "${FLAGS_torcx_manifest}" |
-    while read pkg ; do query_available_package "${pkg}" ; done
+    sudo "${BUILD_LIBRARY_DIR}/contents_manifest.py" write \
+        "${hash_args[@]}" "$1" > "$2"
 }
 
 # Generate a list of installed packages in the format:
 #   sys-apps/systemd-212-r8::coreos
-write_packages() {
-    info "Writing ${2##*/}"
-    image_packages "$1" | sort > "$2"
-}
-
-# Generate a list of packages w/ their licenses in the format:
+# and a list of packages w/ their licenses in the format:
 #   [
 #     {
 #       "project": "sys-apps/systemd-212-r8::coreos",
-#       "license": ["GPL-2", "LGPL-2.1", "MIT", "public-domain"]
+#       "licenses": ["GPL-2", "LGPL-2.1", "MIT", "public-domain"]
 #     }
 #   ]
-write_licenses() {
-    info "Writing ${2##*/}"
-    echo -n "[" > "$2"
-
-    local pkg pkg_sep
-    for pkg in $(image_packages "$1" | sort); do
-        # Ignore virtual packages since they aren't licensed
-        if [[ "${pkg%%/*}" == "virtual" ]]; then
-            continue
-        fi
-
-        local path="$1/var/db/pkg/${pkg%%:*}/LICENSE"
-        local lic_str
-        if [[ -f "$path" ]]; then
-            lic_str="$(< $path)"
-        else
-            # The package is not installed in $1 so get the license from
-            # its ebuild
-            lic_str=$(portageq-${BOARD} metadata "${BOARD_ROOT}" ebuild \
-                        "${pkg%%:*}" LICENSE 2>/dev/null ||:)
-            if [[ -z "$lic_str" ]]; then
-                warn "No license found for ${pkg}"
-                continue
-            fi
-        fi
-
-        [[ -n $pkg_sep ]] && echo ","
-        [[ -z $pkg_sep ]] && echo
-        pkg_sep="true"
-
-        # Build a list of the required licenses vs the one-of licenses
-        # For example:
-        #   GPL-3+ LGPL-3+ || ( GPL-3+ libgcc libstdc++ ) FDL-1.3+
-        #   required: GPL-3+ LGPL-3+ FDL-1.3+
-        #   one-of: GPL-3+ libgcc libstdc++
-        local req_lics=($(sed 's/|| ([^)]*)//' <<< $lic_str))
-        local opt_lics=($(sed 's/.*|| (\([^)]*\)).*/\1/' <<< $lic_str))
-
-        # Pick one of the one-of licenses, preferring a GPL license. Otherwise,
-        # pick the first.
-        local opt_lic=""
-        local lic
-        for lic in ${opt_lics[*]}; do
-            if [[ $lic =~ "GPL" ]]; then
-                opt_lic=$lic;
-                break
-            fi;
-        done
-        if [[ -z $opt_lic ]]; then
-            opt_lic=${opt_lics[0]}
-        fi
-
-        # Remove duplicate licenses
-        local lics=$(tr ' ' '\n' <<< "${req_lics[*]} ${opt_lic}" | sort --unique | tr '\n' ' ')
-
-        echo -n "  {\"project\": \"${pkg}\", \"licenses\": ["
-
-        local lic_sep=""
-        for lic in ${lics[*]}; do
-            [[ -n $lic_sep ]] && echo -n ", "
-            lic_sep="true"
-
-            echo -n "\"${lic}\""
-        done
-
-        echo -n "]}"
-    done >> "$2"
-
-    echo -e "\n]" >> "$2"
+# Usage: write_packages_and_licenses /image/root packages.txt licenses.json
+write_packages_and_licenses() {
+    info "Writing ${2##*/} and ${3##*/}"
+    local torcx_args=()
+    if [[ -n "${FLAGS_torcx_manifest}" ]]; then
+        torcx_args=( --torcx_manifest "${FLAGS_torcx_manifest}" )
+    fi
+    "${BUILD_LIBRARY_DIR}/package_manifests.py" \
+        --root "$1" \
+        --configroot "${BUILD_DIR}/configroot" \
+        --board_root "${BOARD_ROOT}" \
+        "${torcx_args[@]}" \
+        --packages "$2" \
+        --licenses "$3"
 }
 
 # Add an entry to the image's package.provided
@@ -501,7 +394,8 @@ EOF
         "${BUILD_DIR}/${image_kconfig}"
   fi
 
-  write_contents "${root_fs_dir}" "${BUILD_DIR}/${image_contents}"
+  write_contents "${root_fs_dir}" "${BUILD_DIR}/${image_contents}" \
+      "${BUILD_DIR}/${image_contents%.txt}_sha256.txt"
 
   # Zero all fs free space to make it more compressible so auto-update
   # payloads become smaller, not fatal since it won't work on linux < 3.2
@@ -549,13 +443,6 @@ EOF
         "${BUILD_DIR}/${image_kernel}"
   fi
 
-  if [[ -n "${pcr_policy}" ]]; then
-    mkdir -p "${BUILD_DIR}/pcrs"
-    ${BUILD_LIBRARY_DIR}/generate_kernel_hash.sh \
-        "${root_fs_dir}/boot/coreos/vmlinuz-a" ${COREOS_VERSION} \
-        >"${BUILD_DIR}/pcrs/kernel.config"
-  fi
-
   rm -rf "${BUILD_DIR}"/configroot
   cleanup_mounts "${root_fs_dir}"
   trap - EXIT
@@ -586,8 +473,10 @@ EOF
   fi
 
   if [[ -n "${pcr_policy}" ]]; then
-    ${BUILD_LIBRARY_DIR}/generate_grub_hashes.py \
-        "${disk_img}" /usr/lib/grub/ "${BUILD_DIR}/pcrs" ${COREOS_VERSION}
+    # Reads the kernel and GRUB from the finished image, no mount needed.
+    mkdir -p "${BUILD_DIR}/pcrs"
+    ${BUILD_LIBRARY_DIR}/generate_pcr_configs.py \
+        "${disk_img}" "${BUILD_DIR}/pcrs" ${COREOS_VERSION}
 
     info "Generating $pcr_policy"
     pushd "${BUILD_DIR}" >/dev/null
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Write and compare ls-like listings of image root filesystems.
+
+The listing is identical to the output of:
+  TZ=UTC find -printf '%M %2n %-7u %-7g %7s %TY-%Tm-%Td %TH:%TM ./%P -> %l\\n'
+with the trailing ' -> ' removed from everything but symlinks.  Directories
+are listed in parallel but entries are written in the same order as find.
+
+Optionally the sha256 of every regular file is written to a second file in
+the sha256sum format.  Hardlinked files are only read once.
+
+The diff action compares the listings, and hashes if given, of two images
+and prints added (+), removed (-) and changed (~) paths.
+"""
+
+import argparse
+import grp
+import multiprocessing
+import multiprocessing.pool
+import os
+import pwd
+import stat
+import sys
+import time
+
+import digests
+import parallel
+
+HASH_TYPE = 'sha256'
+
+_FILE_TYPES = (
+    (stat.S_ISDIR, 'd'),
+    (stat.S_ISCHR, 'c'),
+    (stat.S_ISBLK, 'b'),
+    (stat.S_ISREG, '-'),
+    (stat.S_ISFIFO, 'p'),
+    (stat.S_ISLNK, 'l'),
+    (stat.S_ISSOCK, 's'),
+)
+
+
+def FileMode(mode):
+  """Formats a st_mode the same way as ls -l, e.g. drwxr-xr-x."""
+  chars = ['?']
+  for test, char in _FILE_TYPES:
+    if test(mode):
+      chars[0] = char
+      break
+
+  for who, special, special_char in (('USR', stat.S_ISUID, 's'),
+                                     ('GRP', stat.S_ISGID, 's'),
+                                     ('OTH', stat.S_ISVTX, 't')):
+    chars.append('r' if mode & getattr(stat, 'S_IR' + who) else '-')
+    chars.append('w' if mode & getattr(stat, 'S_IW' + who) else '-')
+    execute = mode & getattr(stat, 'S_IX' + who)
+    if mode & special:
+      chars.append(special_char if execute else special_char.upper())
+    else:
+      chars.append('x' if execute else '-')
+  return ''.join(chars)
+
+
+class _Names(object):
+  """Caches user and group names, falling back to the numeric id."""
+
+  def __init__(self, lookup):
+    self._lookup = lookup
+    self._cache = {}
+
+  def __call__(self, id_num):
+    if id_num not in self._cache:
+      try:
+        self._cache[id_num] = self._lookup(id_num)[0]
+      except KeyError:
+        self._cache[id_num] = str(id_num)
+    return self._cache[id_num]
+
+
+def ScanDir(path):
+  """Lists a directory.
+
+  Returns:
+    List of (name, lstat result, symlink target or None) tuples in the
+    order the entries are returned by the filesystem.
+  """
+  entries = []
+  for name in os.listdir(path):
+    full = os.path.join(path, name)
+    st = os.lstat(full)
+    target = os.readlink(full) if stat.S_ISLNK(st.st_mode) else None
+    entries.append((name, st, target))
+  return entries
+
+
+def Walk(root, pool):
+  """Walks a tree, listing directories in parallel.
+
+  Subdirectories are queued as soon as their parent has been listed so
+  the pool keeps working ahead of the caller.
+
+  Args:
+    root: directory to walk
+    pool: a ThreadPool to list directories with
+  Yields:
+    (path relative to root, lstat result, symlink target or None) tuples
+    in the same order as find, starting with ('', lstat(root), None).
+  """
+  listings = {}
+
+  def Queue(rel):
+    listings[rel] = pool.apply_async(ScanDir, (os.path.join(root, rel),))
+
+  def Visit(rel):
+    entries = listings.pop(rel).get(parallel.WAIT_TIMEOUT)
+    for name, st, _ in entries:
+      if stat.S_ISDIR(st.st_mode):
+        Queue(os.path.join(rel, name))
+    for name, st, target in entries:
+      path = os.path.join(rel, name)
+      yield path, st, target
+      if stat.S_ISDIR(st.st_mode):
+        for entry in Visit(path):
+          yield entry
+
+  yield '', os.lstat(root), None
+  Queue('')
+  for entry in Visit(''):
+    yield entry
+
+
+def _HandToSudoUser(path):
+  """Gives a file written under sudo to the user that ran sudo."""
+  if os.getuid() == 0 and 'SUDO_UID' in os.environ:
+    os.chown(path, int(os.environ['SUDO_UID']),
+             int(os.environ.get('SUDO_GID', -1)))
+
+
+def WriteContents(root, out, hashes=None, jobs=None):
+  """Writes the listing of a directory tree.
+
+  Args:
+    root: directory to list
+    out: file object to write the listing to
+    hashes: optional path to write the sha256 of each regular file to
+    jobs: number of threads, defaults to the number of CPUs
+  """
+  if not jobs:
+    jobs = multiprocessing.cpu_count()
+  user = _Names(pwd.getpwuid)
+  group = _Names(grp.getgrgid)
+  # Files already being hashed, keyed by (st_dev, st_ino).
+  inodes = {}
+  files = []
+
+  pool = multiprocessing.pool.ThreadPool(jobs)
+  try:
+    for path, st, target in Walk(root, pool):
+      line = '%s %2d %-7s %-7s %7d %s ./%s' % (
+          FileMode(st.st_mode), st.st_nlink, user(st.st_uid),
+          group(st.st_gid), st.st_size,
+          time.strftime('%Y-%m-%d %H:%M', time.gmtime(st.st_mtime)), path)
+      if target is not None:
+        line += ' -> ' + target
+      out.write(line + '\n')
+
+      if hashes and stat.S_ISREG(st.st_mode):
+        key = (st.st_dev, st.st_ino)
+        if key not in inodes:
+          inodes[key] = pool.apply_async(
+              digests.HashFile, (os.path.join(root, path), [HASH_TYPE]))
+        files.append((path, inodes[key]))
+
+    if hashes:
+      with open(hashes, 'w') as f:
+        for path, result in files:
+          digest = result.get(parallel.WAIT_TIMEOUT)[0]
+          f.write(digests.FormatLine(digest, './' + path))
+      _HandToSudoUser(hashes)
+  finally:
+    pool.terminate()
+
+
+def ParseContentsLine(line):
+  """Parses a line written by WriteContents.
+
+  Returns:
+    A (path, entry) tuple where entry is a dict of the mode, user, group,
+    size and link target.  The link count and mtime are not kept since
+    they differ between every build.
+  """
+  fields = line.rstrip('\n').split(None, 7)
+  if len(fields) != 8 or not fields[7].startswith('./'):
+    raise ValueError('Invalid contents line: %r' % line)
+  mode, _, user, group, size, _, _, path = fields
+  target = None
+  if mode.startswith('l'):
+    path, _, target = path.partition(' -> ')
+  if mode.startswith('d'):
+    # Directory sizes depend on the filesystem, not on the contents.
+    size = None
+  return path, {'mode': mode, 'user': user, 'group': group,
+                'size': size, 'target': target}
+
+
+def ReadContents(contents, hashes=None):
+  """Reads a listing and optionally its sha256 file.
+
+  Returns:
+    A dict mapping each path to its entry from ParseContentsLine, with the
+    file's sha256 added if hashes was given.
+  """
+  entries = {}
+  with open(contents) as f:
+    for line in f:
+      if line.strip():
+        path, entry = ParseContentsLine(line)
+        entries[path] = entry
+  if hashes:
+    with open(hashes) as f:
+      for line in f:
+        if line.strip():
+          digest, path = digests.ParseLine(line)
+          if path in entries:
+            entries[path][HASH_TYPE] = digest
+  return entries
+
+
+def DiffContents(old, new):
+  """Compares two dicts returned by ReadContents.
+
+  Hashes are only compared when both sides have one.
+
+  Returns:
+    A sorted list of (path, status, changed fields) tuples where status is
+    '+' for added, '-' for removed and '~' for changed paths.
+  """
+  changes = []
+  for path in sorted(set(old) | set(new)):
+    if path not in old:
+      changes.append((path, '+', []))
+    elif path not in new:
+      changes.append((path, '-', []))
+    else:
+      changed = []
+      for field in ('mode', 'user', 'group', 'size', 'target', HASH_TYPE):
+        if (field in old[path] and field in new[path] and
+            old[path][field] != new[path][field]):
+          changed.append((field, old[path][field], new[path][field]))
+      if changed:
+        changes.append((path, '~', changed))
+  return changes
+
+
+def PrintDiff(changes, out=sys.stdout):
+  """Prints the result of DiffContents, one path per line."""
+  for path, status, changed in changes:
+    if not changed:
+      out.write('%s %s\n' % (status, path))
+      continue
+    details = []
+    for field, old_value, new_value in changed:
+      if field == HASH_TYPE:
+        details.append(field)
+      else:
+        details.append('%s %s -> %s' % (field, old_value, new_value))
+    out.write('%s %s: %s\n' % (status, path, ', '.join(details)))
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__,
+          formatter_class=argparse.RawDescriptionHelpFormatter)
+  actions = parser.add_subparsers(title='actions', dest='action')
+
+  a = actions.add_parser('write', help='write the listing of a directory')
+  a.add_argument('--output', '-o',
+          help='path to write the listing to, defaults to stdout')
+  a.add_argument('--hashes',
+          help='path to also write the sha256 of each regular file to')
+  a.add_argument('--jobs', '-j', type=int, default=0,
+          help='number of threads, 0 for one per cpu')
+  a.add_argument('root', help='directory to list')
+
+  a = actions.add_parser('diff', help='compare the listings of two images')
+  a.add_argument('--old_hashes', help='sha256 file of the old image')
+  a.add_argument('--new_hashes', help='sha256 file of the new image')
+  a.add_argument('old', help='listing of the old image')
+  a.add_argument('new', help='listing of the new image')
+
+  options = parser.parse_args(argv[1:])
+
+  if options.action == 'write':
+    if options.output:
+      with open(options.output, 'w') as out:
+        WriteContents(options.root, out, options.hashes, options.jobs)
+      _HandToSudoUser(options.output)
+    else:
+      WriteContents(options.root, sys.stdout, options.hashes, options.jobs)
+  else:
+    changes = DiffContents(ReadContents(options.old, options.old_hashes),
+                           ReadContents(options.new, options.new_hashes))
+    PrintDiff(changes)
+    # Exit like diff(1) does.
+    if changes:
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for contents_manifest."""
+
+import hashlib
+import io
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+import contents_manifest
+
+
+class FileModeTest(unittest.TestCase):
+  """Test class for FileMode."""
+
+  def testFileMode(self):
+    """Test modes against what ls -l prints."""
+    for mode, expected in (
+        (stat.S_IFDIR | 0o755, 'drwxr-xr-x'),
+        (stat.S_IFREG | 0o644, '-rw-r--r--'),
+        (stat.S_IFLNK | 0o777, 'lrwxrwxrwx'),
+        (stat.S_IFREG | 0o4755, '-rwsr-xr-x'),
+        (stat.S_IFREG | 0o2644, '-rw-r-Sr--'),
+        (stat.S_IFDIR | 0o1777, 'drwxrwxrwt'),
+        (stat.S_IFDIR | 0o1770, 'drwxrwx--T'),
+        (stat.S_IFCHR | 0o600, 'crw-------'),
+        (stat.S_IFBLK | 0o660, 'brw-rw----'),
+        (stat.S_IFIFO | 0o644, 'prw-r--r--'),
+        (stat.S_IFSOCK | 0o755, 'srwxr-xr-x'),
+        (0o644, '?rw-r--r--')):
+      self.assertEqual(contents_manifest.FileMode(mode), expected)
+
+
+class ContentsTest(unittest.TestCase):
+  """Test class for parsing and comparing listings."""
+
+  def testParseRegular(self):
+    """Test that link counts and mtimes are dropped."""
+    path, entry = contents_manifest.ParseContentsLine(
+        '-rw-r--r--  1 root    root       1234 2018-01-02 03:04 ./etc/a b\n')
+    self.assertEqual(path, './etc/a b')
+    self.assertEqual(entry, {'mode': '-rw-r--r--', 'user': 'root',
+                             'group': 'root', 'size': '1234',
+                             'target': None})
+
+  def testParseSymlink(self):
+    """Test that the symlink target is split from the path."""
+    path, entry = contents_manifest.ParseContentsLine(
+        'lrwxrwxrwx  1 root    root          7 2018-01-02 03:04 ./lib -> usr/lib')
+    self.assertEqual(path, './lib')
+    self.assertEqual(entry['target'], 'usr/lib')
+
+  def testParseDirectory(self):
+    """Test that directory sizes are ignored."""
+    _, entry = contents_manifest.ParseContentsLine(
+        'drwxr-xr-x  2 root    root       4096 2018-01-02 03:04 ./etc')
+    self.assertEqual(entry['size'], None)
+
+  def testParseInvalid(self):
+    """Test that lines which are not listings are rejected."""
+    self.assertRaises(ValueError, contents_manifest.ParseContentsLine,
+                      'not a listing\n')
+    self.assertRaises(ValueError, contents_manifest.ParseContentsLine,
+                      '-rw-r--r-- 1 root root 1 2018-01-02 03:04 etc/a')
+
+  def testDiffContents(self):
+    """Test added, removed and changed paths."""
+    old = {
+        './a': {'mode': '-rw-r--r--', 'size': '1', 'sha256': 'x'},
+        './b': {'mode': '-rw-r--r--', 'size': '1'},
+        './c': {'mode': '-rw-r--r--', 'size': '1', 'sha256': 'x'},
+        './d': {'mode': '-rw-r--r--', 'size': '1', 'sha256': 'x'},
+    }
+    new = {
+        './a': {'mode': '-rwxr-xr-x', 'size': '1', 'sha256': 'x'},
+        './c': {'mode': '-rw-r--r--', 'size': '1', 'sha256': 'y'},
+        './d': {'mode': '-rw-r--r--', 'size': '1'},
+        './e': {'mode': '-rw-r--r--', 'size': '1'},
+    }
+    self.assertEqual(contents_manifest.DiffContents(old, new), [
+        ('./a', '~', [('mode', '-rw-r--r--', '-rwxr-xr-x')]),
+        ('./b', '-', []),
+        ('./c', '~', [('sha256', 'x', 'y')]),
+        ('./e', '+', []),
+    ])
+    self.assertEqual(contents_manifest.DiffContents(old, old), [])
+
+
+class WriteContentsTest(unittest.TestCase):
+  """Test class for WriteContents."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.root = os.path.join(self.tempdir, 'root')
+    for d in ('etc', 'usr/lib', 'usr/bin', 'var'):
+      os.makedirs(os.path.join(self.root, d))
+    for name, data in (('etc/os-release', b'ID=coreos\n'),
+                       ('usr/bin/tool', b'#!/bin/sh\n'),
+                       ('usr/lib/a', b''),
+                       ('usr/lib/b', b'b' * 5000)):
+      with open(os.path.join(self.root, name), 'wb') as f:
+        f.write(data)
+    os.link(os.path.join(self.root, 'usr/lib/b'),
+            os.path.join(self.root, 'usr/bin/b'))
+    os.symlink('usr/lib', os.path.join(self.root, 'lib'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testMatchesFind(self):
+    """Test that the listing is the same as the find pipeline it replaced."""
+    find = subprocess.check_output(
+        ['find', '-printf',
+         '%M %2n %-7u %-7g %7s %TY-%Tm-%Td %TH:%TM ./%P -> %l\\n'],
+        cwd=self.root, env=dict(os.environ, TZ='UTC'))
+    expected = [l[:-4] if l.endswith(' -> ') else l
+                for l in find.decode('utf-8').splitlines()]
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    contents_manifest.WriteContents(self.root, out, jobs=3)
+    self.assertEqual(out.getvalue().splitlines(), expected)
+
+  def testHashes(self):
+    """Test the hash file lists every regular file including hardlinks."""
+    hashes = os.path.join(self.tempdir, 'hashes')
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    contents_manifest.WriteContents(self.root, out, hashes, jobs=2)
+    entries = contents_manifest.ReadContents(self._Save(out), hashes)
+    b_hash = hashlib.sha256(b'b' * 5000).hexdigest()
+    self.assertEqual(entries['./usr/lib/b']['sha256'], b_hash)
+    self.assertEqual(entries['./usr/bin/b']['sha256'], b_hash)
+    self.assertEqual(entries['./usr/lib/a']['sha256'],
+                     hashlib.sha256(b'').hexdigest())
+    self.assertNotIn('sha256', entries['./lib'])
+    self.assertNotIn('sha256', entries['./etc'])
+
+  def _Save(self, out):
+    path = os.path.join(self.tempdir, 'contents')
+    with open(path, 'w') as f:
+      f.write(out.getvalue())
+    return path
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -77,8 +77,8 @@ create_dev_container() {
   emerge_to_image "${root_fs_dir}" @system ${base_pkg}
   run_ldconfig "${root_fs_dir}"
   run_localedef "${root_fs_dir}"
-  write_packages "${root_fs_dir}" "${BUILD_DIR}/${image_packages}"
-  write_licenses "${root_fs_dir}" "${BUILD_DIR}/${image_licenses}"
+  write_packages_and_licenses "${root_fs_dir}" \
+      "${BUILD_DIR}/${image_packages}" "${BUILD_DIR}/${image_licenses}"
 
   # Setup portage for emerge and gmerge
   configure_dev_portage "${root_fs_dir}"
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Generate and verify Gentoo style DIGESTS files.
+
+Each file is read only once, in large chunks, with every requested hash
+algorithm fed from the same buffer.  Files are hashed in parallel, hashlib
+releases the GIL while hashing so threads are enough to use several cores.
+The output is identical to running md5sum, sha1sum, etc. on each file.
+
+The compress action also feeds each image through a compressor such as
+lbzip2, hashing the compressed stream as it is written instead of reading
+the compressed file back afterwards.
+"""
+
+import argparse
+import errno
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+
+import parallel
+
+DEFAULT_TYPES = ('md5', 'sha1', 'sha512')
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def NewHashes(hash_types):
+  """Returns a list of new hash objects, one per type name."""
+  return [hashlib.new(hash_type) for hash_type in hash_types]
+
+
+def HashFile(path, hash_types, chunk_size=CHUNK_SIZE):
+  """Reads a file once, computing several digests of it.
+
+  Args:
+    path: file to read
+    hash_types: list of hashlib algorithm names
+    chunk_size: number of bytes to read at a time
+  Returns:
+    List of hex digests in the same order as hash_types
+  """
+  hashes = NewHashes(hash_types)
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      for h in hashes:
+        h.update(chunk)
+  return [h.hexdigest() for h in hashes]
+
+
+def HashFiles(paths, hash_types, jobs=None):
+  """Hashes many files in parallel.
+
+  Args:
+    paths: list of files to read
+    hash_types: list of hashlib algorithm names
+    jobs: number of files to hash at once, defaults to the number of CPUs
+  Returns:
+    List of digest lists, in the same order as paths
+  """
+  return parallel.Map(lambda p: HashFile(p, hash_types), paths, jobs)
+
+
+def CompressFile(path, zipper, zipext, hash_types, raw_hash_types=()):
+  """Compresses a file, hashing the compressed and raw data on the way.
+
+  The input is read once and the compressed output is hashed as it is
+  written, giving the same file and digests as running the compressor and
+  then hashing its output.  The output keeps the input's mode and times
+  like lbzip2 --keep does.
+
+  Args:
+    path: file to compress
+    zipper: compression command, must write stdin compressed to stdout
+    zipext: extension added to path for the compressed file
+    hash_types: list of hashlib algorithm names for the compressed file
+    raw_hash_types: list of hashlib algorithm names for the input file
+  Returns:
+    A (output path, compressed digests, raw digests) tuple
+  """
+  output = path + zipext
+  hashes = NewHashes(hash_types)
+  raw_hashes = NewHashes(raw_hash_types)
+  drain_error = []
+  write_error = []
+
+  def Drain(pipe, out):
+    try:
+      for chunk in iter(lambda: pipe.read(CHUNK_SIZE), b''):
+        for h in hashes:
+          h.update(chunk)
+        out.write(chunk)
+    except Exception as e:
+      drain_error.append(e)
+      # Unblock the compressor so the writer sees the failure too.
+      pipe.close()
+
+  try:
+    with open(output, 'wb') as out:
+      proc = subprocess.Popen(shlex.split(zipper), stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, close_fds=True)
+      drain = threading.Thread(target=Drain, args=(proc.stdout, out))
+      drain.start()
+      try:
+        with open(path, 'rb') as f:
+          for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for h in raw_hashes:
+              h.update(chunk)
+            proc.stdin.write(chunk)
+      except IOError as e:
+        # The compressor exited early, report its status instead.
+        if e.errno != errno.EPIPE:
+          raise
+        write_error.append(e)
+      finally:
+        try:
+          proc.stdin.close()
+        finally:
+          drain.join()
+          proc.stdout.close()
+          returncode = proc.wait()
+    if drain_error:
+      raise drain_error[0]
+    if returncode:
+      raise subprocess.CalledProcessError(returncode, zipper)
+    if write_error:
+      raise write_error[0]
+    shutil.copystat(path, output)
+  except BaseException:
+    if os.path.exists(output):
+      os.unlink(output)
+    raise
+
+  return (output, [h.hexdigest() for h in hashes],
+          [h.hexdigest() for h in raw_hashes])
+
+
+def FormatLine(digest, filename):
+  """Formats a line the same way as the coreutils *sum tools.
+
+  Names containing a backslash or newline are escaped and the line
+  is prefixed with a backslash to mark that.
+  """
+  if '\\' in filename or '\n' in filename:
+    filename = filename.replace('\\', '\\\\').replace('\n', '\\n')
+    return '\\%s  %s\n' % (digest, filename)
+  return '%s  %s\n' % (digest, filename)
+
+
+def ParseLine(line):
+  """Parses a line written by FormatLine.
+
+  Returns:
+    A (digest, filename) tuple
+  """
+  line = line.rstrip('\n')
+  escaped = line.startswith('\\')
+  if escaped:
+    line = line[1:]
+  digest, sep, filename = line.partition(' ')
+  if not sep:
+    raise ValueError('Invalid digest line: %r' % line)
+  # Text mode uses two spaces, binary mode uses a space and '*'.
+  if filename[:1] in (' ', '*'):
+    filename = filename[1:]
+  if escaped:
+    filename = filename.replace('\\\\', '\0').replace('\\n', '\n')
+    filename = filename.replace('\0', '\\')
+  return digest.lower(), filename
+
+
+def WriteDigests(digests, paths, results, hash_types):
+  """Writes a DIGESTS file from already computed digests.
+
+  Args:
+    digests: path of the DIGESTS file to write
+    paths: list of files that were hashed, only their base names are recorded
+    results: list of digest lists, in the same order as paths
+    hash_types: list of hashlib algorithm names
+  """
+  with open(digests, 'w') as out:
+    for path, values in zip(paths, results):
+      for hash_type, value in zip(hash_types, values):
+        out.write('# %s HASH\n' % hash_type.upper())
+        out.write(FormatLine(value, os.path.basename(path)))
+
+
+def MakeDigests(digests, paths, hash_types=DEFAULT_TYPES, jobs=None):
+  """Writes a DIGESTS file for a list of files.
+
+  Args:
+    digests: path of the DIGESTS file to write
+    paths: list of files to hash, only their base names are recorded
+    hash_types: list of hashlib algorithm names
+    jobs: number of files to hash at once
+  """
+  WriteDigests(digests, paths, HashFiles(paths, hash_types, jobs), hash_types)
+
+
+def CompressAndMakeDigests(digests, paths, zipper, zipext, pattern='',
+                           hash_types=DEFAULT_TYPES, raw_digests=None,
+                           jobs=None):
+  """Compresses files matching a pattern and writes a DIGESTS file.
+
+  The DIGESTS file lists the compressed file in place of each input that
+  was compressed, the rest are listed as they are.
+
+  Args:
+    digests: path of the DIGESTS file to write
+    paths: list of files to compress or hash
+    zipper: compression command, must write stdin compressed to stdout
+    zipext: extension added to compressed files
+    pattern: regex of paths to compress, default is to compress all
+    hash_types: list of hashlib algorithm names
+    raw_digests: optional path to write digests of the uncompressed files
+    jobs: number of uncompressed files to hash at once
+  Returns:
+    List of output paths, in the same order as paths
+  """
+  raw_hash_types = hash_types if raw_digests else ()
+  plain = [p for p in paths if not re.search(pattern, p)]
+  plain_results = dict(zip(plain, HashFiles(plain, hash_types, jobs)))
+
+  # The compressor is already parallel so images are done one at a time.
+  outputs, results, raw_results = [], [], []
+  for path in paths:
+    if path in plain_results:
+      output, values = path, plain_results[path]
+      raw_values = values
+    else:
+      output, values, raw_values = CompressFile(
+          path, zipper, zipext, hash_types, raw_hash_types)
+    outputs.append(output)
+    results.append(values)
+    raw_results.append(raw_values)
+
+  WriteDigests(digests, outputs, results, hash_types)
+  if raw_digests:
+    WriteDigests(raw_digests, paths, raw_results, hash_types)
+  return outputs
+
+
+def ReadDigests(digests):
+  """Parses a DIGESTS file.
+
+  Returns:
+    A dict mapping (hash type, filename) to the list of recorded digests
+  """
+  entries = {}
+  hash_type = None
+  with open(digests) as f:
+    for line in f:
+      if line.startswith('#'):
+        fields = line.split()
+        if len(fields) == 3 and fields[2].upper() == 'HASH':
+          hash_type = fields[1].lower()
+        else:
+          hash_type = None
+      elif hash_type and line.strip():
+        digest, filename = ParseLine(line)
+        entries.setdefault((hash_type, filename), []).append(digest)
+  return entries
+
+
+def VerifyDigests(digests, paths, hash_types=DEFAULT_TYPES, jobs=None):
+  """Checks files against a DIGESTS file.
+
+  Every file must have an entry for every hash type and all must match.
+
+  Args:
+    digests: path of the DIGESTS file to read
+    paths: list of files to check
+    hash_types: list of hashlib algorithm names
+    jobs: number of files to hash at once
+  Returns:
+    True if all files are valid
+  """
+  entries = ReadDigests(digests)
+  ok = True
+
+  # Don't bother hashing anything if an entry is missing.
+  for path in paths:
+    filename = os.path.basename(path)
+    for hash_type in hash_types:
+      if (hash_type, filename) not in entries:
+        sys.stderr.write('%s: no %s digest found in %s\n' %
+                         (filename, hash_type, digests))
+        ok = False
+  if not ok:
+    return False
+
+  results = HashFiles(paths, hash_types, jobs)
+  for path, values in zip(paths, results):
+    filename = os.path.basename(path)
+    for hash_type, value in zip(hash_types, values):
+      if all(d == value for d in entries[(hash_type, filename)]):
+        print('%s: %s OK' % (filename, hash_type))
+      else:
+        print('%s: %s FAILED' % (filename, hash_type))
+        ok = False
+  return ok
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+          formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument('--types', default=' '.join(DEFAULT_TYPES),
+          help='space separated list of hash algorithms')
+  parser.add_argument('--jobs', '-j', type=int, default=0,
+          help='files to hash in parallel, 0 for one per cpu')
+  actions = parser.add_subparsers(title='actions', dest='action')
+
+  a = actions.add_parser('make', help='write a DIGESTS file')
+  a.add_argument('--digests', '-d', required=True,
+          help='path to the DIGESTS file to write')
+  a.add_argument('files', nargs='+', help='files to hash')
+
+  a = actions.add_parser('compress',
+          help='compress files while writing their DIGESTS file')
+  a.add_argument('--digests', '-d', required=True,
+          help='path to the DIGESTS file to write')
+  a.add_argument('--raw_digests',
+          help='path to also write digests of the uncompressed files')
+  a.add_argument('--zipper', required=True,
+          help='compression command, reading stdin and writing stdout')
+  a.add_argument('--zipext', required=True,
+          help='extension to add to compressed files')
+  a.add_argument('--pattern', default='',
+          help='regex of files to compress, others are only hashed')
+  a.add_argument('files', nargs='+', help='files to compress or hash')
+
+  a = actions.add_parser('verify', help='check files against a DIGESTS file')
+  a.add_argument('--digests', '-d',
+          help='path to the DIGESTS file, defaults to FILE.DIGESTS')
+  a.add_argument('files', nargs='+', help='files to check')
+
+  options = parser.parse_args(argv[1:])
+  hash_types = options.types.lower().split()
+  for hash_type in hash_types:
+    try:
+      hashlib.new(hash_type)
+    except ValueError:
+      parser.error('unsupported hash type: %s' % hash_type)
+
+  if options.action == 'make':
+    MakeDigests(options.digests, options.files, hash_types, options.jobs)
+  elif options.action == 'compress':
+    CompressAndMakeDigests(options.digests, options.files, options.zipper,
+                           options.zipext, options.pattern, hash_types,
+                           options.raw_digests, options.jobs)
+  else:
+    digests = options.digests or options.files[0] + '.DIGESTS'
+    if not VerifyDigests(digests, options.files, hash_types, options.jobs):
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for digests."""
+
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import digests
+
+
+class DigestsTest(unittest.TestCase):
+  """Test class for digests."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.paths = []
+    for i in range(5):
+      path = os.path.join(self.tempdir, 'file%d' % i)
+      with open(path, 'wb') as f:
+        f.write(os.urandom(1000 * i))
+      self.paths.append(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Expected(self, path, hash_types):
+    with open(path, 'rb') as f:
+      data = f.read()
+    return [hashlib.new(t, data).hexdigest() for t in hash_types]
+
+  def testHashFileSmallChunks(self):
+    """Test that chunked reads give the same digests as one read."""
+    self.assertEqual(digests.HashFile(self.paths[4], ['md5', 'sha1'], 7),
+                     self._Expected(self.paths[4], ['md5', 'sha1']))
+
+  def testHashFilesOneJob(self):
+    """Test hashing files one after another."""
+    self.assertEqual(digests.HashFiles(self.paths, digests.DEFAULT_TYPES, 1),
+                     [self._Expected(p, digests.DEFAULT_TYPES)
+                      for p in self.paths])
+
+  def testHashFilesJobs(self):
+    """Test hashing files on a thread pool keeps the order of paths."""
+    self.assertEqual(digests.HashFiles(self.paths, digests.DEFAULT_TYPES, 3),
+                     [self._Expected(p, digests.DEFAULT_TYPES)
+                      for p in self.paths])
+
+  def testHashFilesEmpty(self):
+    """Test that no paths give no results."""
+    self.assertEqual(digests.HashFiles([], digests.DEFAULT_TYPES, 4), [])
+
+  def testFormatParseLine(self):
+    """Test that odd names are escaped like coreutils and parse back."""
+    for name in ('plain', 'back\\slash', 'new\nline', 'both\\\n'):
+      line = digests.FormatLine('abc', name)
+      self.assertEqual(line.startswith('\\'), name != 'plain')
+      self.assertEqual(digests.ParseLine(line), ('abc', name))
+    self.assertEqual(digests.ParseLine('ABC *binary\n'), ('abc', 'binary'))
+    self.assertRaises(ValueError, digests.ParseLine, 'nospace\n')
+
+  def _Verify(self, path):
+    """Runs VerifyDigests, returning its result and what it printed."""
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if str is not bytes else io.BytesIO()
+    try:
+      ok = digests.VerifyDigests(path, self.paths, jobs=2)
+      return ok, sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+
+  def testMakeVerifyDigests(self):
+    """Test that a DIGESTS file verifies and catches a changed file."""
+    path = os.path.join(self.tempdir, 'test.DIGESTS')
+    digests.MakeDigests(path, self.paths, jobs=2)
+    lines = ['file%d: %s OK\n' % (i, t)
+             for i in range(5) for t in digests.DEFAULT_TYPES]
+    self.assertEqual(self._Verify(path), (True, ''.join(lines)))
+    with open(self.paths[1], 'ab') as f:
+      f.write(b'x')
+    for i, t in enumerate(digests.DEFAULT_TYPES, 3):
+      lines[i] = 'file1: %s FAILED\n' % t
+    self.assertEqual(self._Verify(path), (False, ''.join(lines)))
+
+
+
+class CompressTest(unittest.TestCase):
+  """Test class for compressing while hashing."""
+
+  ZIPPER = 'gzip -n -c'
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'image.bin')
+    with open(self.image, 'wb') as f:
+      f.write(os.urandom(100 * 1000) + b'\0' * (5 * 1024 * 1024))
+    os.chmod(self.image, 0o640)
+    os.utime(self.image, (1000000000, 1200000000))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Zip(self, path):
+    """Returns what the zipper writes when run on its own."""
+    with open(path, 'rb') as f:
+      return subprocess.check_output(self.ZIPPER.split(), stdin=f)
+
+  def _Hashes(self, data, hash_types=digests.DEFAULT_TYPES):
+    return [hashlib.new(t, data).hexdigest() for t in hash_types]
+
+  def testCompressFile(self):
+    """Test that the output and digests match compressing then hashing."""
+    output, values, raw_values = digests.CompressFile(
+        self.image, self.ZIPPER, '.gz', digests.DEFAULT_TYPES, ['sha256'])
+    self.assertEqual(output, self.image + '.gz')
+    with open(output, 'rb') as f:
+      compressed = f.read()
+    self.assertEqual(compressed, self._Zip(self.image))
+    self.assertEqual(values, self._Hashes(compressed))
+    with open(self.image, 'rb') as f:
+      self.assertEqual(raw_values, self._Hashes(f.read(), ['sha256']))
+
+  def testCompressFileNoRawHashes(self):
+    """Test that raw digests are only computed when asked for."""
+    _, _, raw_values = digests.CompressFile(
+        self.image, self.ZIPPER, '.gz', ['md5'])
+    self.assertEqual(raw_values, [])
+
+  def testCopyStat(self):
+    """Test that the output keeps the input's mode and times."""
+    output, _, _ = digests.CompressFile(self.image, self.ZIPPER, '.gz', [])
+    st = os.stat(output)
+    self.assertEqual(st.st_mode & 0o777, 0o640)
+    self.assertEqual(int(st.st_mtime), 1200000000)
+
+  def _AssertFails(self, zipper, exception):
+    self.assertRaises(exception, digests.CompressFile, self.image, zipper,
+                      '.gz', ['md5'])
+    self.assertFalse(os.path.exists(self.image + '.gz'))
+
+  def testZipperFails(self):
+    """Test that a failing compressor removes its partial output."""
+    self._AssertFails("sh -c 'head -c 100; exit 3'",
+                      subprocess.CalledProcessError)
+    self._AssertFails('false', subprocess.CalledProcessError)
+
+  def testZipperStopsReading(self):
+    """Test that a compressor exiting before the end of input is an error."""
+    self._AssertFails('head -c 100', EnvironmentError)
+
+  def testCompressAndMakeDigests(self):
+    """Test that only files matching the pattern are compressed."""
+    text = os.path.join(self.tempdir, 'version.txt')
+    with open(text, 'wb') as f:
+      f.write(b'COREOS_VERSION=1.2.3\n')
+    path = os.path.join(self.tempdir, 'image.DIGESTS')
+    raw_path = os.path.join(self.tempdir, 'raw.DIGESTS')
+    outputs = digests.CompressAndMakeDigests(
+        path, [self.image, text], self.ZIPPER, '.gz', pattern=r'\.bin$',
+        raw_digests=raw_path, jobs=2)
+    self.assertEqual(outputs, [self.image + '.gz', text])
+    self.assertFalse(os.path.exists(text + '.gz'))
+
+    with open(self.image, 'rb') as f:
+      image = f.read()
+    with open(text, 'rb') as f:
+      version = f.read()
+    entries = digests.ReadDigests(path)
+    raw_entries = digests.ReadDigests(raw_path)
+    for hash_type, compressed, raw, version_hash in zip(
+        digests.DEFAULT_TYPES, self._Hashes(self._Zip(self.image)),
+        self._Hashes(image), self._Hashes(version)):
+      self.assertEqual(entries[(hash_type, 'image.bin.gz')], [compressed])
+      self.assertEqual(entries[(hash_type, 'version.txt')], [version_hash])
+      self.assertEqual(raw_entries[(hash_type, 'image.bin')], [raw])
+      self.assertEqual(raw_entries[(hash_type, 'version.txt')],
+                       [version_hash])
+    self.assertEqual(len(entries), 6)
+    self.assertEqual(len(raw_entries), 6)
+
+
+if __name__ == '__main__':
+  unittest.main()
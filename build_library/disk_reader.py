@@ -0,0 +1,780 @@
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Read-only access to filesystems inside disk images.
+
+Filesystems are read directly from a byte range of an image file, so no
+loop devices, mounts or root access are needed.  Only the structures the
+build scripts need are parsed.
+"""
+
+import calendar
+import collections
+import errno
+import mmap
+import stat
+import struct
+import uuid
+
+
+class UnsupportedFilesystem(Exception):
+  pass
+class InvalidPartitionTable(Exception):
+  pass
+class DirtyFilesystem(Exception):
+  pass
+
+
+GptPartition = collections.namedtuple('GptPartition', (
+    'num', 'type', 'uuid', 'first_block', 'blocks', 'attributes', 'label'))
+
+# A directory entry, start is filesystem specific.  The target is only set
+# for symlinks.
+FileEntry = collections.namedtuple('FileEntry', (
+    'name', 'is_dir', 'size', 'start', 'mode', 'uid', 'gid', 'mtime',
+    'target'))
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ImageRange(object):
+  """A byte range of an image file, usually one partition.
+
+  The whole file is mapped read-only and shared between ranges created
+  with Slice.
+  """
+
+  def __init__(self, image, offset=0, size=None, _mapping=None):
+    if _mapping is None:
+      with open(image, 'rb') as f:
+        _mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if size is None:
+      size = len(_mapping) - offset
+    if offset < 0 or offset + size > len(_mapping):
+      raise ValueError('Range %d+%d is outside of %s' % (offset, size, image))
+    self.image = image
+    self.offset = offset
+    self.size = size
+    self._mapping = _mapping
+
+  def Slice(self, offset, size):
+    """Returns a sub-range, offset is relative to this range."""
+    return ImageRange(self.image, self.offset + offset, size, self._mapping)
+
+  def Read(self, offset, length):
+    """Reads bytes, offset is relative to the start of the range."""
+    if offset < 0 or offset + length > self.size:
+      raise ValueError('Read %d+%d is outside of the range' % (offset, length))
+    start = self.offset + offset
+    return self._mapping[start:start + length]
+
+  def Unpack(self, fmt, offset):
+    """Unpacks a struct at offset, relative to the start of the range."""
+    return struct.unpack(fmt, self.Read(offset, struct.calcsize(fmt)))
+
+  def Close(self):
+    self._mapping.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.Close()
+
+
+def ReadGpt(image_range, block_size=512):
+  """Reads the primary GPT of a disk image.
+
+  Args:
+    image_range: ImageRange covering the whole disk
+    block_size: logical block size of the disk
+  Returns:
+    List of GptPartition for every used entry, ordered by number
+  """
+  header = image_range.Read(block_size, 92)
+  if header[:8] != b'EFI PART':
+    raise InvalidPartitionTable('No GPT header found in %s' %
+                                image_range.image)
+  entries_block, entry_count, entry_size = struct.unpack_from(
+      '<QII', header, 72)
+  table = image_range.Read(entries_block * block_size,
+                           entry_count * entry_size)
+
+  partitions = []
+  for index in range(entry_count):
+    entry = table[index * entry_size:(index + 1) * entry_size]
+    type_guid = uuid.UUID(bytes_le=bytes(entry[0:16]))
+    if type_guid.int == 0:
+      continue
+    first, last, attributes = struct.unpack_from('<QQQ', entry, 32)
+    label = bytes(entry[56:128]).decode('utf-16-le').split(u'\0', 1)[0]
+    partitions.append(GptPartition(
+        index + 1, str(type_guid), str(uuid.UUID(bytes_le=bytes(entry[16:32]))),
+        first, last - first + 1, attributes, label))
+  return partitions
+
+
+def _Name(raw):
+  """Returns a file name as a native string."""
+  if str is bytes:
+    return raw
+  return raw.decode('utf-8', 'surrogateescape')
+
+
+def _Zeros(length, chunk_size=CHUNK_SIZE):
+  while length > 0:
+    count = min(length, chunk_size)
+    yield b'\0' * count
+    length -= count
+
+
+class _Filesystem(object):
+  """Path lookups shared by the filesystem classes."""
+
+  def Lookup(self, path):
+    """Finds a file or directory by path.
+
+    Symlinks are not followed.
+
+    Returns:
+      A FileEntry, or None for the root directory
+    """
+    entry = None
+    for name in path.strip('/').split('/'):
+      if not name or name == '.':
+        continue
+      if entry is not None and not entry.is_dir:
+        raise IOError(errno.ENOTDIR, 'Not a directory', path)
+      for child in self.ListDir(entry):
+        if self._SameName(child.name, name):
+          entry = child
+          break
+      else:
+        raise IOError(errno.ENOENT, 'No such file or directory', path)
+    return entry
+
+  def _SameName(self, a, b):
+    return a == b
+
+
+def _Runs(bitmap, count, start=0):
+  """Finds runs of clear bits in a little endian bitmap.
+
+  Args:
+    bitmap: a bytearray
+    count: number of bits to look at
+    start: value added to every bit number returned
+  Yields:
+    (first bit, number of bits) tuples for each run of clear bits
+  """
+  run_start = None
+  for index, byte in enumerate(bitmap[:(count + 7) // 8]):
+    # Whole bytes are by far the common case, only split the others.
+    if byte == 0:
+      if run_start is None:
+        run_start = index * 8
+      continue
+    elif byte == 0xff:
+      bits = ((index * 8, True),)
+    else:
+      bits = ((index * 8 + i, byte & (1 << i)) for i in range(8))
+    for bit, used in bits:
+      if bit >= count:
+        break
+      elif not used and run_start is None:
+        run_start = bit
+      elif used and run_start is not None:
+        yield start + run_start, bit - run_start
+        run_start = None
+  if run_start is not None and run_start < count:
+    yield start + run_start, count - run_start
+
+
+class ExtFilesystem(_Filesystem):
+  """An ext2, ext3 or ext4 filesystem.
+
+  Files may use extents or the old block map.  Indexed directories are read
+  like linear ones, the index blocks look like unused entries to a linear
+  reader and are skipped.
+  """
+
+  MAGIC = 0xef53
+  SUPERBLOCK_OFFSET = 1024
+
+  ROOT_INODE = 2
+  EXTENT_MAGIC = 0xf30a
+  # Longer symlink targets are stored in a data block.
+  FAST_SYMLINK_MAX = 60
+
+  # Superblock state and feature flags.
+  STATE_VALID_FS = 0x1
+  STATE_ERROR_FS = 0x2
+  COMPAT_HAS_JOURNAL = 0x4
+  INCOMPAT_FILETYPE = 0x2
+  INCOMPAT_RECOVER = 0x4
+  INCOMPAT_META_BG = 0x10
+  INCOMPAT_EXTENTS = 0x40
+  INCOMPAT_64BIT = 0x80
+  INCOMPAT_FLEX_BG = 0x200
+  RO_COMPAT_BIGALLOC = 0x200
+
+  # Block group descriptor flags.
+  BG_BLOCK_UNINIT = 0x2
+
+  # Inode flags.
+  EXTENTS_FL = 0x80000
+  INLINE_DATA_FL = 0x10000000
+
+  def __init__(self, image_range):
+    self.range = image_range
+    sb = image_range.Read(self.SUPERBLOCK_OFFSET, 1024)
+    (self.inodes_count, blocks_lo, _, free_blocks_lo, self.free_inodes,
+     self.first_data_block, log_block_size, _, self.blocks_per_group, _,
+     self.inodes_per_group) = struct.unpack_from('<11I', sb, 0)
+    magic, self.state = struct.unpack_from('<HH', sb, 56)
+    if magic != self.MAGIC:
+      raise UnsupportedFilesystem('No ext2/3/4 superblock found')
+    self.rev_level, = struct.unpack_from('<I', sb, 76)
+    self.first_ino, self.inode_size = struct.unpack_from('<IH', sb, 84)
+    if self.rev_level == 0:
+      self.first_ino, self.inode_size = 11, 128
+    self.feature_compat, self.feature_incompat, self.feature_ro_compat = (
+        struct.unpack_from('<3I', sb, 92))
+    self.uuid = bytes(sb[104:120])
+    self.label = bytes(sb[120:136]).rstrip(b'\0').decode('utf-8', 'replace')
+    desc_size, = struct.unpack_from('<H', sb, 254)
+    blocks_hi, _, free_blocks_hi = struct.unpack_from('<3I', sb, 336)
+    if (log_block_size > 6 or not self.blocks_per_group or
+        not self.inodes_per_group):
+      raise UnsupportedFilesystem('Invalid ext2/3/4 superblock')
+
+    self.block_size = 1024 << log_block_size
+    self.blocks_count = blocks_lo
+    self.free_blocks = free_blocks_lo
+    self.desc_size = 32
+    if self.feature_incompat & self.INCOMPAT_64BIT:
+      self.blocks_count |= blocks_hi << 32
+      self.free_blocks |= free_blocks_hi << 32
+      self.desc_size = desc_size
+    if self.size > image_range.size:
+      raise UnsupportedFilesystem('ext2/3/4 filesystem is larger than %d bytes'
+                                  % image_range.size)
+    self.group_count = ((self.blocks_count - self.first_data_block +
+                         self.blocks_per_group - 1) // self.blocks_per_group)
+    self._groups = None
+
+  @property
+  def fs_type(self):
+    """The type blkid would report for this filesystem."""
+    if self.feature_incompat & (self.INCOMPAT_EXTENTS | self.INCOMPAT_64BIT |
+                                self.INCOMPAT_FLEX_BG):
+      return 'ext4'
+    if self.feature_compat & self.COMPAT_HAS_JOURNAL:
+      return 'ext3'
+    return 'ext2'
+
+  @property
+  def size(self):
+    return self.blocks_count * self.block_size
+
+  def ReadBlock(self, block, count=1):
+    return self.range.Read(block * self.block_size, count * self.block_size)
+
+  def GroupDescriptors(self):
+    """Yields (block bitmap, inode bitmap, inode table, flags) per group."""
+    if self.feature_incompat & self.INCOMPAT_META_BG:
+      raise UnsupportedFilesystem('ext4 meta_bg is not supported')
+    table_blocks = ((self.group_count * self.desc_size + self.block_size - 1)
+                    // self.block_size)
+    table = self.ReadBlock(self.first_data_block + 1, table_blocks)
+    for group in range(self.group_count):
+      desc = group * self.desc_size
+      block_bitmap, inode_bitmap, inode_table = struct.unpack_from(
+          '<3I', table, desc)
+      flags, = struct.unpack_from('<H', table, desc + 18)
+      if self.desc_size >= 64:
+        hi = struct.unpack_from('<3I', table, desc + 32)
+        block_bitmap |= hi[0] << 32
+        inode_bitmap |= hi[1] << 32
+        inode_table |= hi[2] << 32
+      yield block_bitmap, inode_bitmap, inode_table, flags
+
+  def ReadInode(self, ino):
+    """Returns the raw on-disk inode."""
+    if self._groups is None:
+      self._groups = list(self.GroupDescriptors())
+    group, index = divmod(ino - 1, self.inodes_per_group)
+    if ino < 1 or group >= len(self._groups):
+      raise IOError(errno.EIO, 'Invalid inode number %d' % ino)
+    inode_table = self._groups[group][2]
+    return self.range.Read(inode_table * self.block_size +
+                           index * self.inode_size, self.inode_size)
+
+  def Entry(self, name, ino):
+    """Builds a FileEntry from an inode."""
+    raw = self.ReadInode(ino)
+    mode, uid, size, _, _, mtime, _, gid = struct.unpack_from(
+        '<HHIIIIIH', raw, 0)
+    flags, = struct.unpack_from('<I', raw, 32)
+    size_hi, = struct.unpack_from('<I', raw, 108)
+    uid_hi, gid_hi = struct.unpack_from('<HH', raw, 120)
+    if stat.S_ISREG(mode):
+      size |= size_hi << 32
+
+    target = None
+    if stat.S_ISLNK(mode):
+      if (size < self.FAST_SYMLINK_MAX and
+          not flags & (self.EXTENTS_FL | self.INLINE_DATA_FL)):
+        target = bytes(raw[40:40 + size])
+      else:
+        target = b''.join(self._ReadData(ino, size))
+      target = _Name(target)
+
+    return FileEntry(name, stat.S_ISDIR(mode), size, ino, mode,
+                     uid_hi << 16 | uid, gid_hi << 16 | gid, mtime, target)
+
+  def _ExtentTree(self, node):
+    """Yields (logical block, physical block, count) from an extent node.
+
+    Uninitialized extents read as zeros, their physical block is None.
+    """
+    magic, count, _, depth = struct.unpack_from('<HHHH', node, 0)
+    if magic != self.EXTENT_MAGIC:
+      raise IOError(errno.EIO, 'Invalid extent header in %s' % self.range.image)
+    for i in range(count):
+      offset = 12 + i * 12
+      if depth == 0:
+        logical, length, start_hi, start_lo = struct.unpack_from(
+            '<IHHI', node, offset)
+        if length > 32768:
+          yield logical, None, length - 32768
+        else:
+          yield logical, start_hi << 32 | start_lo, length
+      else:
+        logical, leaf_lo, leaf_hi = struct.unpack_from('<IIH', node, offset)
+        for extent in self._ExtentTree(self.ReadBlock(leaf_hi << 32 | leaf_lo)):
+          yield extent
+
+  def _BlockMap(self, i_block):
+    """Yields (logical block, physical block, 1) from an ext2 block map."""
+    pointers = struct.unpack_from('<15I', i_block)
+    per_block = self.block_size // 4
+
+    def Indirect(block, level, logical):
+      if not block:
+        return
+      children = struct.unpack('<%dI' % per_block, self.ReadBlock(block))
+      span = per_block ** level
+      for i, child in enumerate(children):
+        if level == 0:
+          if child:
+            yield logical + i, child, 1
+        else:
+          for mapping in Indirect(child, level - 1, logical + i * span):
+            yield mapping
+
+    for i in range(12):
+      if pointers[i]:
+        yield i, pointers[i], 1
+    logical = 12
+    for level, block in enumerate(pointers[12:]):
+      for mapping in Indirect(block, level, logical):
+        yield mapping
+      logical += per_block ** (level + 1)
+
+  def _Mappings(self, ino):
+    """Yields merged (logical block, physical block, count) of a file."""
+    raw = self.ReadInode(ino)
+    flags, = struct.unpack_from('<I', raw, 32)
+    i_block = raw[40:100]
+    if flags & self.INLINE_DATA_FL:
+      raise UnsupportedFilesystem('ext4 inline data is not supported')
+    elif flags & self.EXTENTS_FL:
+      mappings = self._ExtentTree(i_block)
+    else:
+      mappings = self._BlockMap(i_block)
+
+    current = None
+    for logical, physical, count in mappings:
+      if (current and physical is not None and current[1] is not None and
+          current[0] + current[2] == logical and
+          current[1] + current[2] == physical):
+        current[2] += count
+        continue
+      if current:
+        yield tuple(current)
+      current = [logical, physical, count]
+    if current:
+      yield tuple(current)
+
+  def _ReadData(self, ino, size, chunk_size=CHUNK_SIZE):
+    position = 0
+    for logical, physical, count in self._Mappings(ino):
+      start = logical * self.block_size
+      if start >= size:
+        break
+      # Holes between mappings read as zeros.
+      for chunk in _Zeros(start - position, chunk_size):
+        yield chunk
+      length = min(count * self.block_size, size - start)
+      if physical is None:
+        for chunk in _Zeros(length, chunk_size):
+          yield chunk
+      else:
+        offset = physical * self.block_size
+        for chunk_start in range(0, length, chunk_size):
+          yield self.range.Read(offset + chunk_start,
+                                min(chunk_size, length - chunk_start))
+      position = start + length
+    for chunk in _Zeros(size - position, chunk_size):
+      yield chunk
+
+  def ReadFile(self, entry, chunk_size=CHUNK_SIZE):
+    """Yields the contents of a file in chunks."""
+    return self._ReadData(entry.start, entry.size, chunk_size)
+
+  def ListDir(self, entry=None):
+    """Lists a directory, the root directory if entry is None.
+
+    Returns:
+      List of FileEntry, without the . and .. entries
+    """
+    ino = self.ROOT_INODE if entry is None else entry.start
+    raw = self.ReadInode(ino)
+    mode, _, size = struct.unpack_from('<HHI', raw, 0)
+    if not stat.S_ISDIR(mode):
+      raise IOError(errno.ENOTDIR, 'Not a directory')
+
+    data = b''.join(self._ReadData(ino, size))
+    has_filetype = self.feature_incompat & self.INCOMPAT_FILETYPE
+    entries = []
+    offset = 0
+    while offset + 8 <= len(data):
+      child, rec_len, name_len = struct.unpack_from('<IHH', data, offset)
+      if has_filetype:
+        name_len &= 0xff
+      if rec_len < 8 or offset + rec_len > len(data):
+        raise IOError(errno.EIO, 'Corrupt directory in %s' % self.range.image)
+      name = data[offset + 8:offset + 8 + name_len]
+      offset += rec_len
+      # Unused entries, including index blocks and checksum tails.
+      if not child or name in (b'.', b'..'):
+        continue
+      entries.append(self.Entry(_Name(bytes(name)), child))
+    return entries
+
+  def CheckClean(self):
+    """Raises DirtyFilesystem unless the filesystem was cleanly unmounted.
+
+    A mounted or crashed filesystem may have allocations that are only in
+    its journal, or have errors, so the bitmaps cannot be trusted.
+    """
+    if self.feature_incompat & self.INCOMPAT_RECOVER:
+      raise DirtyFilesystem('journal needs recovery, filesystem is mounted '
+                            'or was not cleanly unmounted')
+    if not self.state & self.STATE_VALID_FS:
+      raise DirtyFilesystem('filesystem is mounted or was not cleanly '
+                            'unmounted')
+    if self.state & self.STATE_ERROR_FS:
+      raise DirtyFilesystem('filesystem has errors')
+
+  def FreeRanges(self):
+    """Finds unallocated blocks using the block bitmaps.
+
+    Groups whose bitmap was never initialized are skipped, no block in them
+    has ever been allocated so there is no stale data to find.
+
+    Yields:
+      (byte offset, byte length) tuples relative to the filesystem start
+    Raises:
+      DirtyFilesystem if the bitmaps cannot be trusted
+    """
+    if self.feature_ro_compat & self.RO_COMPAT_BIGALLOC:
+      raise UnsupportedFilesystem('ext4 bigalloc is not supported')
+    self.CheckClean()
+
+    for group, desc in enumerate(self.GroupDescriptors()):
+      block_bitmap, _, _, flags = desc
+      if flags & self.BG_BLOCK_UNINIT:
+        continue
+      first = self.first_data_block + group * self.blocks_per_group
+      count = min(self.blocks_per_group, self.blocks_count - first)
+      bitmap = bytearray(self.ReadBlock(block_bitmap))
+      for block, length in _Runs(bitmap, count, first):
+        yield block * self.block_size, length * self.block_size
+
+
+class FatFilesystem(_Filesystem):
+  """A FAT12, FAT16 or FAT32 filesystem.
+
+  Only filesystems with an extended boot record, as written by mkfs.vfat,
+  are recognized.  Unlike ext there is no magic number, so the BIOS
+  parameter block is sanity checked and the FAT type string must agree
+  with the cluster count to avoid mistaking other data for a FAT.
+  """
+
+  def __init__(self, image_range):
+    self.range = image_range
+    boot = image_range.Read(0, 512)
+    if boot[510:512] != b'\x55\xaa':
+      raise UnsupportedFilesystem('No FAT boot sector found')
+    (self.sector_size, self.cluster_sectors, self.reserved_sectors,
+     self.fat_count, self.root_entries, total_sectors16, media,
+     fat_sectors16) = struct.unpack_from('<HBHBHHBH', boot, 11)
+    total_sectors32, = struct.unpack_from('<I', boot, 32)
+    fat_sectors32, = struct.unpack_from('<I', boot, 36)
+    if (self.sector_size not in (512, 1024, 2048, 4096) or
+        self.cluster_sectors not in (1, 2, 4, 8, 16, 32, 64, 128) or
+        not self.reserved_sectors or self.fat_count not in (1, 2) or
+        (media != 0xf0 and media < 0xf8)):
+      raise UnsupportedFilesystem('Invalid FAT boot sector')
+
+    self.total_sectors = total_sectors16 or total_sectors32
+    self.fat_sectors = fat_sectors16 or fat_sectors32
+    root_sectors = ((self.root_entries * 32 + self.sector_size - 1) //
+                    self.sector_size)
+    self.root_dir_sector = (self.reserved_sectors +
+                            self.fat_count * self.fat_sectors)
+    self.data_sector = self.root_dir_sector + root_sectors
+    self.cluster_size = self.cluster_sectors * self.sector_size
+    if (not self.total_sectors or not self.fat_sectors or
+        self.data_sector >= self.total_sectors):
+      raise UnsupportedFilesystem('Invalid FAT boot sector')
+    if self.size > image_range.size:
+      raise UnsupportedFilesystem('FAT filesystem is larger than %d bytes' %
+                                  image_range.size)
+    self.cluster_count = ((self.total_sectors - self.data_sector) //
+                          self.cluster_sectors)
+
+    # The FAT type is defined only by the number of clusters.
+    if self.cluster_count < 4085:
+      self.fat_bits = 12
+    elif self.cluster_count < 65525:
+      self.fat_bits = 16
+    else:
+      self.fat_bits = 32
+      self.root_cluster, = struct.unpack_from('<I', boot, 44)
+    type_offset = 82 if self.fat_bits == 32 else 54
+    if boot[type_offset:type_offset + 8] != b'FAT%d   ' % self.fat_bits:
+      raise UnsupportedFilesystem('No FAT%d type string found' % self.fat_bits)
+    if (self.fat_sectors * self.sector_size <
+        ((self.cluster_count + 2) * self.fat_bits + 7) // 8):
+      raise UnsupportedFilesystem('FAT is too small for %d clusters' %
+                                  self.cluster_count)
+    state_offset = 65 if self.fat_bits == 32 else 37
+    self.state = bytearray(boot[state_offset:state_offset + 1])[0]
+    label_offset = 71 if self.fat_bits == 32 else 43
+    self.label = bytes(boot[label_offset:label_offset + 11]).rstrip(
+        b' \0').decode('ascii', 'replace')
+
+    self._fat = None
+
+  fs_type = 'vfat'
+
+  # Set in the boot sector by Linux while mounted.
+  STATE_DIRTY = 0x01
+  # Clean shutdown and no disk errors bits of the second FAT entry, cleared
+  # by other systems while mounted or after an I/O error.  FAT12 has none.
+  FAT_CLEAN_BITS = {12: 0, 16: 0xc000, 32: 0x0c000000}
+
+  # Directory entry attributes.
+  ATTR_VOLUME_ID = 0x08
+  ATTR_DIRECTORY = 0x10
+  ATTR_LONG_NAME = 0x0f
+
+  @property
+  def size(self):
+    return self.total_sectors * self.sector_size
+
+  def ReadFat(self):
+    """Returns the first FAT as a list of cluster entries."""
+    fat = self.range.Read(self.reserved_sectors * self.sector_size,
+                          self.fat_sectors * self.sector_size)
+    entries = self.cluster_count + 2
+    if self.fat_bits == 32:
+      return [e & 0x0fffffff for e in
+              struct.unpack_from('<%dI' % entries, fat)]
+    elif self.fat_bits == 16:
+      return list(struct.unpack_from('<%dH' % entries, fat))
+    fat = bytearray(fat)
+    table = []
+    for n in range(entries):
+      pair, = struct.unpack_from('<H', fat, n * 3 // 2)
+      table.append(pair >> 4 if n & 1 else pair & 0xfff)
+    return table
+
+  def ClusterOffset(self, cluster):
+    """Returns the byte offset of a data cluster."""
+    return (self.data_sector * self.sector_size +
+            (cluster - 2) * self.cluster_size)
+
+  @staticmethod
+  def _Time(date, time):
+    """Converts a FAT date and time, taken to be UTC, to a timestamp."""
+    if not date:
+      return 0
+    return calendar.timegm((1980 + (date >> 9), (date >> 5) & 0xf, date & 0x1f,
+                            time >> 11, (time >> 5) & 0x3f, (time & 0x1f) * 2,
+                            0, 0, 0))
+
+  def Chain(self, cluster):
+    """Lists the clusters of a file, following the FAT from its first."""
+    if self._fat is None:
+      self._fat = self.ReadFat()
+    chain = []
+    while 2 <= cluster < len(self._fat):
+      if len(chain) > self.cluster_count:
+        raise IOError(errno.ELOOP, 'Loop in FAT chain', self.range.image)
+      chain.append(cluster)
+      cluster = self._fat[cluster]
+    return chain
+
+  def _Extents(self, cluster):
+    """Yields (offset, length) byte ranges of a chain, merging neighbours."""
+    start, count = None, 0
+    for c in self.Chain(cluster):
+      if start is not None and c == start + count:
+        count += 1
+        continue
+      if start is not None:
+        yield self.ClusterOffset(start), count * self.cluster_size
+      start, count = c, 1
+    if start is not None:
+      yield self.ClusterOffset(start), count * self.cluster_size
+
+  def _DirData(self, entry):
+    if entry is None and self.fat_bits != 32:
+      return self.range.Read(self.root_dir_sector * self.sector_size,
+                             self.root_entries * 32)
+    cluster = self.root_cluster if entry is None else entry.start
+    return b''.join(self.range.Read(offset, length)
+                    for offset, length in self._Extents(cluster))
+
+  def ListDir(self, entry=None):
+    """Lists a directory, the root directory if entry is None.
+
+    Returns:
+      List of FileEntry, without the . and .. entries
+    """
+    data = self._DirData(entry)
+    entries = []
+    long_name = {}
+    for offset in range(0, len(data) - 31, 32):
+      raw = bytearray(data[offset:offset + 32])
+      if raw[0] == 0:
+        break
+      elif raw[0] == 0xe5:
+        long_name = {}
+        continue
+
+      attr = raw[11]
+      if attr & 0x3f == self.ATTR_LONG_NAME:
+        # Pieces of the long name come in reverse order before the entry.
+        chars = raw[1:11] + raw[14:26] + raw[28:32]
+        long_name[raw[0] & 0x1f] = bytes(chars).decode('utf-16-le')
+        continue
+      elif attr & self.ATTR_VOLUME_ID:
+        long_name = {}
+        continue
+
+      if long_name:
+        name = u''.join(long_name[i] for i in sorted(long_name))
+        name = name.split(u'\0', 1)[0]
+      else:
+        base = bytes(raw[0:8]).rstrip(b' ').decode('latin-1')
+        ext = bytes(raw[8:11]).rstrip(b' ').decode('latin-1')
+        # Windows NT stores all lower case names as flags.
+        if raw[12] & 0x08:
+          base = base.lower()
+        if raw[12] & 0x10:
+          ext = ext.lower()
+        name = base + (u'.' + ext if ext else u'')
+      long_name = {}
+      if name in (u'.', u'..'):
+        continue
+
+      cluster_hi, mtime, mdate, cluster_lo, size = struct.unpack_from(
+          '<HHHHI', raw, 20)
+      is_dir = bool(attr & self.ATTR_DIRECTORY)
+      # There is no owner or mode, use what mounting with umask 022 shows.
+      mode = (stat.S_IFDIR if is_dir else stat.S_IFREG) | 0o755
+      entries.append(FileEntry(name, is_dir, size,
+                               cluster_hi << 16 | cluster_lo, mode, 0, 0,
+                               self._Time(mdate, mtime), None))
+    return entries
+
+  def _SameName(self, a, b):
+    # FAT names are case insensitive.
+    return a.lower() == b.lower()
+
+  def ReadFile(self, entry, chunk_size=CHUNK_SIZE):
+    """Yields the contents of a file in chunks."""
+    remaining = entry.size
+    for offset, length in self._Extents(entry.start):
+      while length and remaining:
+        count = min(length, remaining, chunk_size)
+        yield self.range.Read(offset, count)
+        offset += count
+        length -= count
+        remaining -= count
+
+  def CheckClean(self, fat=None):
+    """Raises DirtyFilesystem if the volume is marked as not cleanly unmounted.
+
+    Args:
+      fat: the result of ReadFat, read if not given
+    """
+    if self.state & self.STATE_DIRTY:
+      raise DirtyFilesystem('dirty bit is set, filesystem is mounted or was '
+                            'not cleanly unmounted')
+    if fat is None:
+      fat = self.ReadFat()
+    clean_bits = self.FAT_CLEAN_BITS[self.fat_bits]
+    if fat[1] & clean_bits != clean_bits:
+      raise DirtyFilesystem('FAT is marked as not cleanly unmounted or as '
+                            'having had disk errors')
+
+  def FreeRanges(self):
+    """Finds unallocated clusters using the FAT.
+
+    Yields:
+      (byte offset, byte length) tuples relative to the filesystem start
+    Raises:
+      DirtyFilesystem if the FAT cannot be trusted
+    """
+    fat = self.ReadFat()
+    self.CheckClean(fat)
+    run_start = None
+    for cluster in range(2, len(fat) + 1):
+      free = cluster < len(fat) and fat[cluster] == 0
+      if free and run_start is None:
+        run_start = cluster
+      elif not free and run_start is not None:
+        yield (self.ClusterOffset(run_start),
+               (cluster - run_start) * self.cluster_size)
+        run_start = None
+
+
+_BTRFS_MAGIC_OFFSET = 0x10040
+_BTRFS_MAGIC = b'_BHRfS_M'
+
+
+def Open(image_range):
+  """Opens the filesystem in a range of an image.
+
+  Returns:
+    An ExtFilesystem or FatFilesystem
+  Raises:
+    UnsupportedFilesystem if no supported filesystem is found
+  """
+  if image_range.size >= _BTRFS_MAGIC_OFFSET + len(_BTRFS_MAGIC):
+    if image_range.Read(_BTRFS_MAGIC_OFFSET,
+                        len(_BTRFS_MAGIC)) == _BTRFS_MAGIC:
+      raise UnsupportedFilesystem('btrfs is not supported')
+  for fs_class in (ExtFilesystem, FatFilesystem):
+    try:
+      return fs_class(image_range)
+    except (UnsupportedFilesystem, ValueError, struct.error):
+      continue
+  raise UnsupportedFilesystem('No supported filesystem found')
@@ -0,0 +1,561 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for disk_reader."""
+
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+import uuid
+
+import disk_reader
+
+# FAT16 test images use 512 byte sectors and one sector per cluster.  FAT16
+# needs at least 4085 clusters, smaller counts are FAT12.
+FAT_SECTOR = 512
+FAT_CLUSTERS = 4200
+FAT_ROOT_ENTRIES = 512
+FAT_SECTORS = ((FAT_CLUSTERS + 2) * 2 + FAT_SECTOR - 1) // FAT_SECTOR
+FAT_DATA_SECTOR = 1 + 2 * FAT_SECTORS + FAT_ROOT_ENTRIES * 32 // FAT_SECTOR
+FAT_TOTAL_SECTORS = FAT_DATA_SECTOR + FAT_CLUSTERS
+# 2018-01-02 03:04:06 in FAT date and time format.
+FAT_DATE = (38 << 9) | (1 << 5) | 2
+FAT_TIME = (3 << 11) | (4 << 5) | 3
+
+LINUX_DATA_GUID = '0fc63daf-8483-4772-8e79-3d69d8477de4'
+
+
+def _FatNames(name, alias_num):
+  """Returns the 11 byte short name and any long name entries for a name."""
+  base, _, ext = name.partition('.')
+  if (name == name.upper() and 0 < len(base) <= 8 and len(ext) <= 3 and
+      '.' not in ext):
+    return (base.ljust(8) + ext.ljust(3)).encode('ascii'), []
+
+  short = ('LONG~%d' % alias_num).ljust(8).encode('ascii') + b'   '
+  chars = name.encode('utf-16-le')
+  if len(name) % 13:
+    chars += b'\0\0'
+  chars = chars.ljust(-(-len(chars) // 26) * 26, b'\xff')
+  pieces = [chars[i:i + 26] for i in range(0, len(chars), 26)]
+  checksum = 0
+  for c in bytearray(short):
+    checksum = (((checksum & 1) << 7) + (checksum >> 1) + c) & 0xff
+  entries = []
+  for seq, piece in enumerate(pieces, 1):
+    flag = 0x40 if seq == len(pieces) else 0
+    entries.append(struct.pack('<B10sBBB12sH4s', seq | flag, piece[:10], 0x0f,
+                               0, checksum, piece[10:22], 0, piece[22:26]))
+  # Long name pieces are stored last first.
+  return short, list(reversed(entries))
+
+
+def _FatEntry(short, attr, cluster, size):
+  return struct.pack('<11sBBBHHHHHHHI', short, attr, 0, 0, FAT_TIME, FAT_DATE,
+                     FAT_DATE, cluster >> 16, FAT_TIME, FAT_DATE,
+                     cluster & 0xffff, size)
+
+
+def MakeFat(tree, deleted=b''):
+  """Builds a small FAT16 filesystem.
+
+  Args:
+    tree: dict of names to file contents, or to dicts for directories
+    deleted: contents of a file that is written and then deleted, so its
+      clusters hold stale data but are free
+  Returns:
+    The filesystem as a bytearray
+  """
+  image = bytearray(FAT_TOTAL_SECTORS * FAT_SECTOR)
+  fat = [0xfff8, 0xffff]
+
+  def Allocate(data, link=True):
+    clusters = max(1, -(-len(data) // FAT_SECTOR))
+    first = len(fat)
+    for c in range(first, first + clusters - 1):
+      fat.append(c + 1 if link else 0)
+    fat.append(0xffff if link else 0)
+    offset = (FAT_DATA_SECTOR + first - 2) * FAT_SECTOR
+    image[offset:offset + len(data)] = data
+    return first
+
+  def Directory(entries, cluster=0, parent=0):
+    data = b''
+    if cluster:
+      data += _FatEntry(b'.          ', 0x10, cluster, 0)
+      data += _FatEntry(b'..         ', 0x10, parent, 0)
+    for num, name in enumerate(sorted(entries), 1):
+      short, long_entries = _FatNames(name, num)
+      data += b''.join(long_entries)
+      value = entries[name]
+      if isinstance(value, dict):
+        # Reserve the directory's cluster before its children.
+        sub = Allocate(b'\0' * FAT_SECTOR)
+        sub_data = Directory(value, sub, cluster)
+        if len(sub_data) > FAT_SECTOR:
+          raise ValueError('Test directory %s is too large' % name)
+        offset = (FAT_DATA_SECTOR + sub - 2) * FAT_SECTOR
+        image[offset:offset + len(sub_data)] = sub_data
+        data += _FatEntry(short, 0x10, sub, 0)
+      else:
+        first = Allocate(value) if value else 0
+        data += _FatEntry(short, 0x20, first, len(value))
+    return data
+
+  root = _FatEntry(b'TEST       ', 0x08, 0, 0)
+  if deleted:
+    Allocate(deleted, link=False)
+    root += b'\xe5' + _FatEntry(b'DELETED    ', 0x20, 0, len(deleted))[1:]
+  root += Directory(tree)
+  root_offset = (1 + 2 * FAT_SECTORS) * FAT_SECTOR
+  image[root_offset:root_offset + len(root)] = root
+
+  fat_data = struct.pack('<%dH' % len(fat), *fat)
+  for copy in range(2):
+    offset = (1 + copy * FAT_SECTORS) * FAT_SECTOR
+    image[offset:offset + len(fat_data)] = fat_data
+
+  boot = struct.pack('<3s8sHBHBHHBHHHII', b'\xeb\x3c\x90', b'mkfs.fat',
+                     FAT_SECTOR, 1, 1, 2, FAT_ROOT_ENTRIES, FAT_TOTAL_SECTORS,
+                     0xf8, FAT_SECTORS, 32, 64, 0, 0)
+  boot += struct.pack('<BBBI11s8s', 0x80, 0, 0x29, 0x12345678,
+                      b'TEST       ', b'FAT16   ')
+  image[0:len(boot)] = boot
+  image[510:512] = b'\x55\xaa'
+  return image
+
+
+def WriteGpt(path, partitions, block_size=512):
+  """Writes a minimal GPT, just the parts ReadGpt looks at.
+
+  Args:
+    path: disk image to write to
+    partitions: list of (number, label, first block, blocks) tuples
+    block_size: logical block size of the disk
+  """
+  header = b'EFI PART' + b'\0' * 64 + struct.pack('<QII', 2, 128, 128)
+  table = bytearray(128 * 128)
+  for num, label, first, blocks in partitions:
+    entry = struct.pack('<16s16sQQQ72s', uuid.UUID(LINUX_DATA_GUID).bytes_le,
+                        uuid.uuid4().bytes_le, first, first + blocks - 1, 0,
+                        label.encode('utf-16-le'))
+    table[(num - 1) * 128:num * 128] = entry
+  with open(path, 'r+b') as f:
+    f.seek(block_size)
+    f.write(header)
+    f.seek(2 * block_size)
+    f.write(table)
+
+
+def HaveMke2fs():
+  """Checks for an mke2fs new enough to populate from a directory."""
+  try:
+    usage = subprocess.Popen(['mke2fs'], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT).communicate()[0]
+  except OSError:
+    return False
+  return b'-d ' in usage
+
+
+def MakeExt(path, source, fs_type='ext4', blocks=4096):
+  """Creates a 1k block ext filesystem populated from a directory.
+
+  Args:
+    path: image file to create
+    source: directory to copy into the filesystem
+    fs_type: ext2, ext3 or ext4
+    blocks: size of the filesystem in 1k blocks
+  """
+  with open(os.devnull, 'w') as null:
+    subprocess.check_call(
+        ['mke2fs', '-q', '-F', '-t', fs_type, '-b', '1024', '-I', '128',
+         '-d', source, path, str(blocks)], stdout=null, stderr=null)
+
+
+def DeleteExtFile(path, name):
+  """Removes a file from an unmounted ext filesystem, leaving its data."""
+  with open(os.devnull, 'w') as null:
+    subprocess.check_call(['debugfs', '-w', '-R', 'rm %s' % name, path],
+                          stdout=null, stderr=null)
+
+
+def DumpFreeBlocks(path):
+  """Lists free blocks according to dumpe2fs.
+
+  Returns:
+    List of (first block, count) tuples
+  """
+  with open(os.devnull, 'w') as null:
+    output = subprocess.check_output(['dumpe2fs', path], stderr=null)
+  free = []
+  for line in output.decode('utf-8').splitlines():
+    match = re.match(r'\s+Free blocks: (.*)', line)
+    if not match or not match.group(1).strip():
+      continue
+    for run in match.group(1).split(','):
+      first, _, last = run.strip().partition('-')
+      first = int(first)
+      last = int(last) if last else first
+      # Runs touching a group boundary are split, join them.
+      if free and free[-1][0] + free[-1][1] == first:
+        free[-1] = (free[-1][0], free[-1][1] + last - first + 1)
+      else:
+        free.append((first, last - first + 1))
+  return free
+
+
+class RunsTest(unittest.TestCase):
+  """Test class for _Runs."""
+
+  def testRuns(self):
+    """Test clear bit runs within and across bytes."""
+    bitmap = bytearray([0xff, 0x0f, 0x00, 0xf0, 0x01])
+    self.assertEqual(list(disk_reader._Runs(bitmap, 40, 100)),
+                     [(112, 16), (133, 7)])
+
+  def testRunsCount(self):
+    """Test that bits past count are ignored."""
+    self.assertEqual(list(disk_reader._Runs(bytearray(2), 12)), [(0, 12)])
+    self.assertEqual(list(disk_reader._Runs(bytearray([0xff, 0x00]), 8)), [])
+    self.assertEqual(list(disk_reader._Runs(bytearray([0x7f]), 7)), [])
+
+
+class ImageRangeTest(unittest.TestCase):
+  """Test class for ImageRange."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'image')
+    with open(self.path, 'wb') as f:
+      f.write(bytes(bytearray(range(256))))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testSlice(self):
+    """Test that offsets are relative to the slice."""
+    with disk_reader.ImageRange(self.path) as image:
+      part = image.Slice(16, 32)
+      self.assertEqual(part.Read(0, 2), b'\x10\x11')
+      self.assertEqual(part.Slice(4, 4).Read(0, 4), b'\x14\x15\x16\x17')
+      self.assertEqual(part.Unpack('<H', 2), (0x1312,))
+
+  def testOutOfRange(self):
+    """Test that reads and slices past the end are refused."""
+    with disk_reader.ImageRange(self.path) as image:
+      part = image.Slice(16, 32)
+      self.assertRaises(ValueError, part.Read, 30, 4)
+      self.assertRaises(ValueError, part.Read, -1, 1)
+      self.assertRaises(ValueError, image.Slice, 250, 10)
+
+
+class FatFreeRangesTest(unittest.TestCase):
+  """Test class for finding and rejecting FAT filesystems."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'fat.img')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Open(self, image):
+    with open(self.path, 'wb') as f:
+      f.write(image)
+    self.image = disk_reader.ImageRange(self.path)
+    self.addCleanup(self.image.Close)
+    return disk_reader.Open(self.image)
+
+  def testFreeRanges(self):
+    """Test that clusters of deleted files are free, used ones are not."""
+    fs = self._Open(MakeFat({'A.TXT': b'a' * 1000, 'B.TXT': b'b' * 10},
+                            deleted=b'x' * 2000))
+    self.assertEqual((fs.fs_type, fs.fat_bits, fs.cluster_count),
+                     ('vfat', 16, FAT_CLUSTERS))
+    # The deleted file used clusters 2-5, the others 6-8.
+    cluster = FAT_SECTOR
+    data = FAT_DATA_SECTOR * FAT_SECTOR
+    self.assertEqual(list(fs.FreeRanges()), [
+        (data, 4 * cluster),
+        (data + 7 * cluster, (FAT_CLUSTERS - 7) * cluster)])
+
+  def testBadBootSector(self):
+    """Test that data without a sane BIOS parameter block is not a FAT."""
+    image = MakeFat({})
+    for offset, value in ((11, b'\x00\x03'),   # 768 byte sectors
+                          (13, b'\x03'),       # 3 sectors per cluster
+                          (16, b'\x03'),       # 3 FATs
+                          (21, b'\x12'),       # bad media byte
+                          (54, b'FAT12'),      # wrong type for the size
+                          (22, b'\x01\x00')):  # FAT too small
+      bad = bytearray(image)
+      bad[offset:offset + len(value)] = value
+      self.assertRaises(disk_reader.UnsupportedFilesystem, self._Open, bad)
+
+  def testLargerThanRange(self):
+    """Test that a FAT claiming more sectors than the range is refused."""
+    image = MakeFat({})
+    with open(self.path, 'wb') as f:
+      f.write(image)
+    with disk_reader.ImageRange(self.path) as whole:
+      self.assertRaises(disk_reader.UnsupportedFilesystem,
+                        disk_reader.FatFilesystem,
+                        whole.Slice(0, len(image) - FAT_SECTOR))
+
+  def testDirty(self):
+    """Test that a FAT marked as in use or damaged has no free ranges."""
+    image = MakeFat({}, deleted=b'x' * 2000)
+    fat = FAT_SECTOR  # the first FAT follows the boot sector
+    for offset, value in ((37, b'\x01'),            # Linux dirty bit
+                          (fat + 2, b'\xff\x7f'),    # not cleanly unmounted
+                          (fat + 2, b'\xff\xbf')):   # disk errors
+      bad = bytearray(image)
+      bad[offset:offset + len(value)] = value
+      fs = self._Open(bad)
+      self.assertRaises(disk_reader.DirtyFilesystem, list, fs.FreeRanges())
+      # Files can still be read.
+      self.assertEqual(fs.ListDir(), [])
+
+  def testNoFilesystem(self):
+    """Test that zeros are not mistaken for any filesystem."""
+    self.assertRaises(disk_reader.UnsupportedFilesystem, self._Open,
+                      bytearray(1024 * 1024))
+
+  def testBtrfs(self):
+    """Test that btrfs is recognized and refused."""
+    image = bytearray(1024 * 1024)
+    image[0x10040:0x10048] = b'_BHRfS_M'
+    self.assertRaises(disk_reader.UnsupportedFilesystem, self._Open, image)
+
+
+class GptTest(unittest.TestCase):
+  """Test class for ReadGpt."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'disk.img')
+    with open(self.path, 'wb') as f:
+      f.truncate(1024 * 1024)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testReadGpt(self):
+    """Test that used entries are returned in order with their labels."""
+    WriteGpt(self.path, [(1, 'EFI-SYSTEM', 64, 100), (3, 'USR-A', 200, 50)])
+    with disk_reader.ImageRange(self.path) as image:
+      parts = disk_reader.ReadGpt(image)
+    self.assertEqual([(p.num, p.label, p.first_block, p.blocks, p.type)
+                      for p in parts],
+                     [(1, 'EFI-SYSTEM', 64, 100, LINUX_DATA_GUID),
+                      (3, 'USR-A', 200, 50, LINUX_DATA_GUID)])
+
+  def testNoGpt(self):
+    """Test that a disk without a GPT header is refused."""
+    with disk_reader.ImageRange(self.path) as image:
+      self.assertRaises(disk_reader.InvalidPartitionTable,
+                        disk_reader.ReadGpt, image)
+
+
+class FatReadTest(unittest.TestCase):
+  """Test class for reading files from FAT."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    path = os.path.join(self.tempdir, 'fat.img')
+    self.files = {
+        'BOOT.CFG': b'set timeout=1\n',
+        'vmlinuz-a': os.urandom(100 * 1024),
+        'A long name with spaces.txt': b'long',
+        'EMPTY': b'',
+        'coreos': {'grub': {'NORMAL.MOD': b'mod' * 1000}},
+    }
+    with open(path, 'wb') as f:
+      f.write(MakeFat(self.files))
+    self.image = disk_reader.ImageRange(path)
+    self.fs = disk_reader.Open(self.image)
+
+  def tearDown(self):
+    self.image.Close()
+    shutil.rmtree(self.tempdir)
+
+  def _Read(self, path):
+    return b''.join(self.fs.ReadFile(self.fs.Lookup(path)))
+
+  def testListDir(self):
+    """Test short and long names, sizes and times of the root directory."""
+    entries = dict((e.name, e) for e in self.fs.ListDir())
+    self.assertEqual(sorted(entries), sorted(self.files))
+    self.assertTrue(entries['coreos'].is_dir)
+    self.assertEqual(entries['vmlinuz-a'].size, 100 * 1024)
+    self.assertEqual(entries['BOOT.CFG'].mtime, 1514862246)
+    self.assertEqual(self.fs.label, 'TEST')
+
+  def testReadFile(self):
+    """Test reading files, including empty and nested ones."""
+    self.assertEqual(self._Read('vmlinuz-a'), self.files['vmlinuz-a'])
+    self.assertEqual(self._Read('/BOOT.CFG'), b'set timeout=1\n')
+    self.assertEqual(self._Read('EMPTY'), b'')
+    self.assertEqual(self._Read('coreos/grub/NORMAL.MOD'), b'mod' * 1000)
+    self.assertEqual(self._Read('A long name with spaces.txt'), b'long')
+
+  def testSmallChunks(self):
+    """Test that reads are split into chunks across clusters."""
+    chunks = list(self.fs.ReadFile(self.fs.Lookup('vmlinuz-a'), 1000))
+    self.assertEqual(max(len(c) for c in chunks), 1000)
+    self.assertEqual(b''.join(chunks), self.files['vmlinuz-a'])
+
+  def testLookup(self):
+    """Test that lookups are case insensitive and report missing files."""
+    self.assertEqual(self._Read('COREOS/Grub/normal.mod'), b'mod' * 1000)
+    self.assertEqual(self.fs.Lookup('/'), None)
+    self.assertRaises(IOError, self.fs.Lookup, 'missing')
+    self.assertRaises(IOError, self.fs.Lookup, 'BOOT.CFG/x')
+
+
+@unittest.skipUnless(HaveMke2fs(), 'mke2fs with -d is not installed')
+class ExtFreeRangesTest(unittest.TestCase):
+  """Test class for ext free space."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'ext.img')
+    self.source = os.path.join(self.tempdir, 'source')
+    os.mkdir(self.source)
+    for name, size in (('small', 10), ('big', 300 * 1024), ('gone', 50000)):
+      with open(os.path.join(self.source, name), 'wb') as f:
+        f.write(os.urandom(size))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Check(self, fs_type):
+    MakeExt(self.path, self.source, fs_type)
+    DeleteExtFile(self.path, 'gone')
+    with disk_reader.ImageRange(self.path) as image:
+      fs = disk_reader.Open(image)
+      self.assertEqual(fs.fs_type, fs_type)
+      free = list(fs.FreeRanges())
+    self.assertEqual(free, [(first * 1024, count * 1024)
+                            for first, count in DumpFreeBlocks(self.path)])
+
+  def testFreeRangesExt2(self):
+    """Test ext2 free blocks against dumpe2fs."""
+    self._Check('ext2')
+
+  def testFreeRangesExt4(self):
+    """Test ext4 free blocks against dumpe2fs."""
+    self._Check('ext4')
+
+  def testDirty(self):
+    """Test that a filesystem not cleanly unmounted has no free ranges."""
+    MakeExt(self.path, self.source)
+    with open(self.path, 'rb') as f:
+      image = f.read()
+    state, = struct.unpack_from('<H', image, 1024 + 58)
+    incompat, = struct.unpack_from('<I', image, 1024 + 96)
+    self.assertEqual(state, 1)
+    for offset, value in ((58, struct.pack('<H', 0)),   # mounted
+                          (58, struct.pack('<H', 3)),   # errors
+                          (96, struct.pack('<I', incompat | 4))):  # recover
+      bad = bytearray(image)
+      bad[1024 + offset:1024 + offset + len(value)] = value
+      with open(self.path, 'wb') as f:
+        f.write(bad)
+      with disk_reader.ImageRange(self.path) as bad_image:
+        fs = disk_reader.Open(bad_image)
+        self.assertEqual(fs.fs_type, 'ext4')
+        self.assertRaises(disk_reader.DirtyFilesystem, list, fs.FreeRanges())
+
+  def testLargerThanRange(self):
+    """Test that a filesystem claiming more blocks than the range is refused."""
+    MakeExt(self.path, self.source)
+    with disk_reader.ImageRange(self.path) as image:
+      self.assertRaises(disk_reader.UnsupportedFilesystem,
+                        disk_reader.ExtFilesystem,
+                        image.Slice(0, image.size - 1024))
+
+
+@unittest.skipUnless(HaveMke2fs(), 'mke2fs with -d is not installed')
+class ExtReadTest(unittest.TestCase):
+  """Test class for reading files from ext."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'ext.img')
+    self.source = os.path.join(self.tempdir, 'source')
+    os.makedirs(os.path.join(self.source, 'usr/lib/deep/er'))
+    self.files = {
+        'empty': b'',
+        'small': b'hello\n',
+        # Past the direct and single indirect blocks of a 1k block map.
+        'usr/lib/big': os.urandom(300 * 1024),
+        'usr/lib/deep/er/file': b'deep',
+    }
+    for name, data in self.files.items():
+      with open(os.path.join(self.source, name), 'wb') as f:
+        f.write(data)
+    with open(os.path.join(self.source, 'sparse'), 'wb') as f:
+      f.seek(64 * 1024)
+      f.write(b'end')
+    self.files['sparse'] = b'\0' * 64 * 1024 + b'end'
+    os.chmod(os.path.join(self.source, 'small'), 0o4750)
+    os.link(os.path.join(self.source, 'small'),
+            os.path.join(self.source, 'usr/hardlink'))
+    self.files['usr/hardlink'] = self.files['small']
+    # Short targets are stored in the inode, long ones in a block.
+    self.links = {'lib': 'usr/lib', 'long': 'x' * 100}
+    for name, target in self.links.items():
+      os.symlink(target, os.path.join(self.source, name))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Check(self, fs_type):
+    MakeExt(self.path, self.source, fs_type)
+    with disk_reader.ImageRange(self.path) as image:
+      fs = disk_reader.Open(image)
+      self.assertEqual(fs.fs_type, fs_type)
+      for name, data in self.files.items():
+        entry = fs.Lookup(name)
+        self.assertEqual(b''.join(fs.ReadFile(entry)), data)
+        self.assertEqual(entry.size, len(data))
+        st = os.lstat(os.path.join(self.source, name))
+        self.assertEqual((entry.mode, entry.uid, entry.gid, entry.mtime),
+                         (st.st_mode, st.st_uid, st.st_gid, int(st.st_mtime)))
+      self.assertEqual(b''.join(fs.ReadFile(fs.Lookup('usr/lib/big'), 1000)),
+                       self.files['usr/lib/big'])
+
+      for name, target in self.links.items():
+        entry = fs.Lookup(name)
+        self.assertEqual(entry.target, target)
+        self.assertFalse(entry.is_dir)
+
+      self.assertEqual(sorted(e.name for e in fs.ListDir()),
+                       sorted(['empty', 'lib', 'long', 'lost+found', 'small',
+                               'sparse', 'usr']))
+      self.assertEqual(sorted(e.name for e in fs.ListDir(fs.Lookup('usr'))),
+                       ['hardlink', 'lib'])
+      self.assertEqual(fs.Lookup('usr/hardlink').start,
+                       fs.Lookup('small').start)
+      # Symlinks are not followed.
+      self.assertRaises(IOError, fs.Lookup, 'lib/big')
+      self.assertRaises(IOError, fs.Lookup, 'usr/missing')
+
+  def testReadExt2(self):
+    """Test reading files that use the block map."""
+    self._Check('ext2')
+
+  def testReadExt4(self):
+    """Test reading files that use extents."""
+    self._Check('ext4')
+
+
+if __name__ == '__main__':
+  unittest.main()
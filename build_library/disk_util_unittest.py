@@ -0,0 +1,580 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for disk_util."""
+
+import argparse
+import contextlib
+import imp
+import json
+import os
+import shutil
+import stat
+import StringIO
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import disk_reader
+import disk_reader_unittest
+
+disk_util = imp.load_source(
+    'disk_util', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'disk_util'))
+
+TEST_LAYOUT = {
+    'metadata': {
+        'part_alignment': 256,
+        'disk_alignment': 256,
+        'block_size': 512,
+        'fs_block_size': 1024,
+    },
+    'layouts': {
+        'base': {
+            '1': {'label': 'EFI-SYSTEM', 'type': 'efi', 'blocks': '4608',
+                  'fs_type': 'vfat'},
+            '2': {'label': 'ROOT', 'type': 'coreos-resize', 'blocks': '8192',
+                  'fs_type': 'ext4'},
+            '3': {'label': 'OEM', 'type': 'data', 'blocks': '4608',
+                  'fs_type': 'ext4'},
+        },
+    },
+}
+
+
+@unittest.skipUnless(disk_reader_unittest.HaveMke2fs(),
+                     'mke2fs with -d is not installed')
+class SparsifyTest(unittest.TestCase):
+  """Test class for the sparsify action."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'disk.img')
+    layout = os.path.join(self.tempdir, 'layout.json')
+    with open(layout, 'w') as f:
+      json.dump(TEST_LAYOUT, f)
+    self.options = argparse.Namespace(disk_layout_file=layout,
+                                      disk_layout='base',
+                                      disk_image=self.image)
+    self.config, self.partitions = disk_util.LoadPartitionConfig(self.options)
+
+    # Partition 1 and 3 are FAT, 2 is ext4.  All have a deleted file.
+    fat = disk_reader_unittest.MakeFat({'A.TXT': b'a' * 3000},
+                                       deleted=b'stale' * 1000)
+    source = os.path.join(self.tempdir, 'source')
+    os.mkdir(source)
+    for name in ('keep', 'gone'):
+      with open(os.path.join(source, name), 'wb') as f:
+        f.write(os.urandom(100 * 1024))
+    ext = os.path.join(self.tempdir, 'ext.img')
+    disk_reader_unittest.MakeExt(ext, source)
+    disk_reader_unittest.DeleteExtFile(ext, 'gone')
+    with open(ext, 'rb') as f:
+      ext = f.read()
+
+    # Write every byte so the image starts out fully allocated.
+    data = bytearray(self.config['metadata']['bytes'])
+    for num, fs in (('1', fat), ('2', ext), ('3', fat)):
+      first = self.partitions[num]['first_byte']
+      data[first:first + len(fs)] = fs
+    with open(self.image, 'wb') as f:
+      f.write(data)
+    self._WriteGpt()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _WriteGpt(self, **labels):
+    disk_reader_unittest.WriteGpt(self.image, [
+        (part['num'], labels.get(num, part['label']), part['first_block'],
+         part['blocks'])
+        for num, part in self.partitions.items()])
+
+  def _Sparsify(self):
+    """Runs sparsify, returning its output and the image before and after."""
+    with open(self.image, 'rb') as f:
+      before = f.read()
+    blocks = os.stat(self.image).st_blocks
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO.StringIO()
+    try:
+      disk_util.Sparsify(self.options)
+      output = sys.stdout.getvalue()
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+    with open(self.image, 'rb') as f:
+      after = f.read()
+    self.assertTrue(os.stat(self.image).st_blocks <= blocks)
+    return output, before, after
+
+  def _Expected(self, before, nums):
+    """Returns the image with the free space of some partitions zeroed."""
+    expected = bytearray(before)
+    with disk_reader.ImageRange(self.image) as image:
+      for num in nums:
+        part = self.partitions[num]
+        fs = disk_reader.Open(image.Slice(part['first_byte'], part['bytes']))
+        for offset, length in fs.FreeRanges():
+          offset += part['first_byte']
+          expected[offset:offset + length] = b'\0' * length
+    return bytes(expected)
+
+  def testSparsify(self):
+    """Test that only free space of partitions matching the layout is zeroed."""
+    expected = self._Expected(open(self.image, 'rb').read(), ('1', '2'))
+    output, before, after = self._Sparsify()
+    self.assertEqual(after, expected)
+    self.assertNotEqual(after, before)
+    self.assertIn('Sparsified partition 1 (EFI-SYSTEM)', output)
+    self.assertIn('Sparsified partition 2 (ROOT)', output)
+    self.assertIn('Skipping partition 3 (OEM): found vfat, layout expects ext4',
+                  output)
+
+    # The stale data of the deleted files is gone, the live files are not.
+    esp_end = self.partitions['2']['first_byte']
+    self.assertIn(b'stalestale', before[:esp_end])
+    self.assertNotIn(b'stalestale', after[:esp_end])
+    with disk_reader.ImageRange(self.image) as image:
+      part = self.partitions['1']
+      fs = disk_reader.Open(image.Slice(part['first_byte'], part['bytes']))
+      self.assertEqual(b''.join(fs.ReadFile(fs.Lookup('A.TXT'))), b'a' * 3000)
+
+  def testLabelMismatch(self):
+    """Test that partitions not labeled like the layout are left alone."""
+    self._WriteGpt(**{'2': 'OTHER'})
+    expected = self._Expected(open(self.image, 'rb').read(), ('1',))
+    output, _, after = self._Sparsify()
+    self.assertEqual(after, expected)
+    self.assertIn('Skipping partition 2 (OTHER): layout expects ROOT', output)
+
+  def testDirty(self):
+    """Test that filesystems not cleanly unmounted are left alone."""
+    root = self.partitions['2']['first_byte']
+    esp = self.partitions['1']['first_byte']
+    with open(self.image, 'r+b') as f:
+      # Set needs_recovery in the ext4 superblock.
+      f.seek(root + 1024 + 96)
+      incompat, = struct.unpack('<I', f.read(4))
+      f.seek(root + 1024 + 96)
+      f.write(struct.pack('<I', incompat | 4))
+      # Set the dirty bit in the FAT boot sector.
+      f.seek(esp + 37)
+      f.write(b'\x01')
+    before = open(self.image, 'rb').read()
+    output, _, after = self._Sparsify()
+    self.assertEqual(after, before)
+    self.assertIn('WARNING: Skipping partition 1 (EFI-SYSTEM): dirty bit is '
+                  'set', output)
+    self.assertIn('WARNING: Skipping partition 2 (ROOT): journal needs '
+                  'recovery', output)
+
+  def testNoFilesystem(self):
+    """Test that partitions without a recognized filesystem are left alone."""
+    part = self.partitions['1']
+    with open(self.image, 'r+b') as f:
+      f.seek(part['first_byte'])
+      f.write(b'\0' * 512)
+    expected = self._Expected(open(self.image, 'rb').read(), ('2',))
+    output, _, after = self._Sparsify()
+    self.assertEqual(after, expected)
+    self.assertIn('Skipping partition 1 (EFI-SYSTEM)', output)
+
+
+@unittest.skipUnless(disk_reader_unittest.HaveMke2fs(),
+                     'mke2fs with -d is not installed')
+class ReadFilesTest(unittest.TestCase):
+  """Test class for the ls, cat and cp actions."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'disk.img')
+    layout = os.path.join(self.tempdir, 'layout.json')
+    with open(layout, 'w') as f:
+      json.dump(TEST_LAYOUT, f)
+    self.options = argparse.Namespace(disk_layout_file=layout,
+                                      disk_layout='base',
+                                      disk_image=self.image,
+                                      partition='ROOT', recursive=True)
+    config, partitions = disk_util.LoadPartitionConfig(self.options)
+
+    self.source = os.path.join(self.tempdir, 'source')
+    os.makedirs(os.path.join(self.source, 'etc/ssh'))
+    with open(os.path.join(self.source, 'etc/ssh/sshd_config'), 'wb') as f:
+      f.write(b'UsePAM yes\n')
+    os.chmod(os.path.join(self.source, 'etc/ssh/sshd_config'), 0o600)
+    os.symlink('../usr/share/zoneinfo/UTC',
+               os.path.join(self.source, 'etc/localtime'))
+    ext = os.path.join(self.tempdir, 'ext.img')
+    disk_reader_unittest.MakeExt(ext, self.source)
+
+    part = partitions['2']
+    with open(self.image, 'wb') as f:
+      f.truncate(config['metadata']['bytes'])
+      f.seek(part['first_byte'])
+      with open(ext, 'rb') as ext_file:
+        f.write(ext_file.read())
+    disk_reader_unittest.WriteGpt(self.image, [
+        (p['num'], p['label'], p['first_block'], p['blocks'])
+        for p in partitions.values()])
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Output(self, func):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      func(self.options)
+      return sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+
+  def testListFiles(self):
+    """Test listing a directory tree."""
+    self.options.path = '/etc'
+    lines = self._Output(disk_util.ListFiles).splitlines()
+    self.assertEqual([l.split()[-1] for l in lines],
+                     ['../usr/share/zoneinfo/UTC', '/etc/ssh',
+                      '/etc/ssh/sshd_config'])
+    self.assertTrue(lines[2].startswith('-rw------- 0 '))
+
+  def testCatFile(self):
+    """Test writing a file to stdout."""
+    self.options.path = 'etc/ssh/sshd_config'
+    self.assertEqual(self._Output(disk_util.CatFile), 'UsePAM yes\n')
+    self.options.path = 'etc'
+    self.assertRaises(IOError, disk_util.CatFile, self.options)
+
+  def testCopyFiles(self):
+    """Test copying a directory with its modes and symlinks."""
+    self.options.path = 'etc'
+    self.options.output = os.path.join(self.tempdir, 'etc')
+    disk_util.CopyFiles(self.options)
+    config = os.path.join(self.options.output, 'ssh/sshd_config')
+    with open(config) as f:
+      self.assertEqual(f.read(), 'UsePAM yes\n')
+    self.assertEqual(os.stat(config).st_mode & 0o777, 0o600)
+    self.assertEqual(os.readlink(os.path.join(self.options.output,
+                                              'localtime')),
+                     '../usr/share/zoneinfo/UTC')
+
+  def testPartitionNotFound(self):
+    """Test that a partition missing from the image is reported."""
+    self.options.partition = 'USR-B'
+    self.options.path = '/'
+    self.assertRaises(disk_util.PartitionNotFound, disk_util.ListFiles,
+                      self.options)
+
+
+class FormatTest(unittest.TestCase):
+  """Test class for format --populate and the populate action.
+
+  Loop devices need root, so each partition is formatted as a file of its
+  own and the commands are run without sudo.
+  """
+
+  LAYOUT = {
+      'metadata': TEST_LAYOUT['metadata'],
+      'layouts': {
+          'base': {
+              '1': {'label': 'EFI-SYSTEM', 'type': 'efi', 'blocks': '4608',
+                    'fs_type': 'vfat'},
+              '2': {'label': 'ROOT', 'type': 'coreos-resize', 'blocks': '8192',
+                    'fs_type': 'ext4', 'fs_label': 'ROOT',
+                    'fs_bytes_per_inode': '4096', 'fs_inode_size': '256'},
+              '3': {'label': 'OEM', 'type': 'data', 'blocks': '4608',
+                    'fs_type': 'ext2'},
+              '4': {'label': 'BIOS-BOOT', 'type': 'bios', 'blocks': '512'},
+          },
+      },
+  }
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    layout = os.path.join(self.tempdir, 'layout.json')
+    with open(layout, 'w') as f:
+      json.dump(self.LAYOUT, f)
+    self.options = argparse.Namespace(
+        disk_layout_file=layout, disk_layout='base', create=True,
+        disk_image=os.path.join(self.tempdir, 'disk.img'))
+    _, self.partitions = disk_util.LoadPartitionConfig(self.options)
+
+    self.source = os.path.join(self.tempdir, 'source')
+    os.makedirs(os.path.join(self.source, 'bin'))
+    with open(os.path.join(self.source, 'bin/tool'), 'wb') as f:
+      f.write(b'#!/bin/sh\n')
+    os.chmod(os.path.join(self.source, 'bin/tool'), 0o750)
+    os.symlink('bin/tool', os.path.join(self.source, 'tool'))
+
+    self.commands = []
+    self.image_blocks = {}
+    self._Patch('Sudo', self._Sudo)
+    self._Patch('PartitionLoop', self._PartitionLoop)
+    self._Patch('WritePartitionTable', lambda *args: None)
+    self._Patch('GetPartitionTableFromImage', self._GetPartitionTable)
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    self.addCleanup(setattr, sys, 'stdout', stdout)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Patch(self, name, value):
+    self.addCleanup(setattr, disk_util, name, getattr(disk_util, name))
+    setattr(disk_util, name, value)
+
+  def _Sudo(self, cmd, stdout_null=False):
+    cmd = [str(c) for c in cmd]
+    self.commands.append(cmd)
+    if cmd[0] in ('mke2fs', 'tune2fs'):
+      with open(os.devnull, 'w') as null:
+        subprocess.check_call(cmd, stdout=null)
+
+  @contextlib.contextmanager
+  def _PartitionLoop(self, options, part):
+    path = os.path.join(self.tempdir, 'part%d.img' % part['num'])
+    with open(path, 'wb') as f:
+      f.truncate(part['bytes'])
+    yield path
+
+  def _GetPartitionTable(self, options, config, partitions):
+    for num, part in partitions.items():
+      if part['type'] != 'blank':
+        part['image_blocks'] = self.image_blocks.get(num, part['blocks'])
+        part['image_compat'] = part['blocks'] >= part['image_blocks']
+
+  def _Tree(self, path):
+    """Returns the names, modes and contents of a directory tree."""
+    tree = {}
+    for root, dirs, files in os.walk(path):
+      for name in dirs + files:
+        full = os.path.join(root, name)
+        st = os.lstat(full)
+        if stat.S_ISLNK(st.st_mode):
+          data = os.readlink(full)
+        elif stat.S_ISREG(st.st_mode):
+          data = open(full, 'rb').read()
+        else:
+          data = None
+        tree[os.path.relpath(full, path)] = (st.st_mode, data)
+    return tree
+
+  def testFormatExtCommand(self):
+    """Test the mke2fs and tune2fs command lines."""
+    self._Patch('Sudo', lambda cmd, stdout_null=False: self.commands.append(
+        [str(c) for c in cmd]))
+    part = self.partitions['2']
+    disk_util.FormatExt(part, '/dev/loop9', self.source)
+    disk_util.FormatExt(self.partitions['3'], '/dev/loop8')
+    self.assertEqual(self.commands, [
+        ['mke2fs', '-q', '-t', 'ext4', '-b', '1024', '-i', '4096', '-I', '256',
+         '-d', self.source, '/dev/loop9', str(part['fs_blocks'])],
+        ['tune2fs', '-e', 'remount-ro', '-L', 'ROOT', '/dev/loop9'],
+        ['mke2fs', '-q', '-t', 'ext2', '-b', '1024', '-i', '1024', '-I', '128',
+         '/dev/loop8', str(self.partitions['3']['fs_blocks'])],
+        ['tune2fs', '-e', 'remount-ro', '/dev/loop8'],
+    ])
+
+  @unittest.skipUnless(disk_reader_unittest.HaveMke2fs(),
+                       'mke2fs with -d is not installed')
+  def testPopulate(self):
+    """Test that populate fills the filesystem and keeps the staged tree."""
+    before = self._Tree(self.source)
+    self.options.partition = 'ROOT'
+    self.options.source = self.source
+    disk_util.Populate(self.options)
+    self.assertEqual(self._Tree(self.source), before)
+
+    with disk_reader.ImageRange(os.path.join(self.tempdir,
+                                             'part2.img')) as image:
+      fs = disk_reader.Open(image)
+      self.assertEqual((fs.fs_type, fs.label), ('ext4', 'ROOT'))
+      self.assertEqual(fs.size, self.partitions['2']['fs_bytes'])
+      entry = fs.Lookup('bin/tool')
+      self.assertEqual(b''.join(fs.ReadFile(entry)), b'#!/bin/sh\n')
+      self.assertEqual(stat.S_IMODE(entry.mode), 0o750)
+      self.assertEqual(fs.Lookup('tool').target, 'bin/tool')
+
+  def testPopulateRejected(self):
+    """Test that only ext partitions matching the image are populated."""
+    self.options.source = self.source
+    for partition in ('EFI-SYSTEM', 'BIOS-BOOT'):
+      self.options.partition = partition
+      self.assertRaises(disk_util.InvalidLayout, disk_util.Populate,
+                        self.options)
+    self.image_blocks['3'] = 4096
+    self.options.partition = 'OEM'
+    self.assertRaises(disk_util.InvalidLayout, disk_util.Populate,
+                      self.options)
+    self.assertEqual(self.commands, [])
+
+  @unittest.skipUnless(disk_reader_unittest.HaveMke2fs(),
+                       'mke2fs with -d is not installed')
+  def testFormatPopulate(self):
+    """Test that format --populate only fills the named partitions."""
+    self._Patch('FormatFat', lambda part, device: None)
+    before = self._Tree(self.source)
+    self.options.populate = ['3=%s' % self.source]
+    disk_util.Format(self.options)
+    self.assertEqual(self._Tree(self.source), before)
+    mke2fs = dict((os.path.basename(cmd[-2]), cmd)
+                  for cmd in self.commands if cmd[0] == 'mke2fs')
+    self.assertEqual(sorted(mke2fs), ['part2.img', 'part3.img'])
+    self.assertNotIn('-d', mke2fs['part2.img'])
+    self.assertEqual(mke2fs['part3.img'][-4:-2], ['-d', self.source])
+
+  def testFormatPopulateRejected(self):
+    """Test that bad --populate arguments are refused before formatting."""
+    for populate in ('OEM', 'NOSUCH=%s' % self.source):
+      self.options.populate = [populate]
+      self.assertRaises((ValueError, disk_util.PartitionNotFound),
+                        disk_util.Format, self.options)
+    self.options.populate = ['EFI-SYSTEM=%s' % self.source]
+    self.assertRaises(disk_util.InvalidLayout, disk_util.Format, self.options)
+    self.assertEqual(self.commands, [])
+
+@unittest.skipUnless(disk_reader_unittest.HaveMke2fs(),
+                     'mke2fs with -d is not installed')
+class InspectTest(unittest.TestCase):
+  """Test class for the inspect action."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'disk.img')
+    self.layout = os.path.join(self.tempdir, 'layout.json')
+    with open(self.layout, 'w') as f:
+      json.dump(TEST_LAYOUT, f)
+    options = argparse.Namespace(disk_layout_file=self.layout,
+                                 disk_layout='base')
+    self.config, self.partitions = disk_util.LoadPartitionConfig(options)
+
+    # Partition 1 is FAT, 2 and 3 are ext4, just like the layout.
+    fat = disk_reader_unittest.MakeFat({'A.TXT': b'a'})
+    source = os.path.join(self.tempdir, 'source')
+    os.mkdir(source)
+    filesystems = [('1', fat)]
+    for num in ('2', '3'):
+      ext = os.path.join(self.tempdir, 'ext%s.img' % num)
+      disk_reader_unittest.MakeExt(ext, source,
+                                   blocks=self.partitions[num]['fs_blocks'])
+      with open(ext, 'rb') as f:
+        filesystems.append((num, f.read()))
+
+    data = bytearray(self.config['metadata']['bytes'])
+    for num, fs in filesystems:
+      first = self.partitions[num]['first_byte']
+      data[first:first + len(fs)] = fs
+    with open(self.image, 'wb') as f:
+      f.write(data)
+    disk_reader_unittest.WriteGpt(self.image, [
+        (part['num'], part['label'], part['first_block'], part['blocks'])
+        for part in self.partitions.values()])
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Inspect(self, path):
+    return disk_util.InspectImage(path, self.config['metadata']['block_size'],
+                                  self.partitions)
+
+  def _Main(self, *paths):
+    """Runs the inspect action, returning the exit status and the reports."""
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      try:
+        disk_util.main(['disk_util', '--disk_layout_file', self.layout,
+                        'inspect', '-j', '2'] + list(paths))
+        status = 0
+      except SystemExit as e:
+        status = e.code
+      output = sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+    return status, [json.loads(line) for line in output.splitlines()]
+
+  def testInspect(self):
+    """Test the report for an image matching the layout."""
+    result = self._Inspect(self.image)
+    self.assertNotIn('error', result)
+    self.assertEqual(result['bytes'], self.config['metadata']['bytes'])
+    self.assertEqual(result['missing_partitions'], [])
+    self.assertTrue(result['layout_compatible'])
+    parts = dict((str(part['num']), part) for part in result['partitions'])
+    self.assertEqual(sorted(parts), ['1', '2', '3'])
+    for num, part in parts.items():
+      layout = self.partitions[num]
+      self.assertEqual(part['label'], layout['label'])
+      self.assertEqual(part['first_byte'], layout['first_byte'])
+      self.assertEqual(part['bytes'], layout['bytes'])
+      self.assertEqual(part['fs_type'], layout['fs_type'])
+      self.assertEqual(part['layout_fs_type'], layout['fs_type'])
+      self.assertTrue(part['layout_compatible'])
+    self.assertEqual(parts['2']['fs_bytes'], self.partitions['2']['fs_bytes'])
+
+  def testFilesystemMismatch(self):
+    """Test that a partition holding the wrong filesystem is incompatible."""
+    fat = disk_reader_unittest.MakeFat({})
+    with open(self.image, 'r+b') as f:
+      f.seek(self.partitions['3']['first_byte'])
+      f.write(fat)
+    result = self._Inspect(self.image)
+    self.assertFalse(result['layout_compatible'])
+    parts = dict((str(part['num']), part) for part in result['partitions'])
+    self.assertEqual((parts['3']['fs_type'], parts['3']['layout_fs_type']),
+                     ('vfat', 'ext4'))
+    self.assertFalse(parts['3']['layout_compatible'])
+    self.assertTrue(parts['2']['layout_compatible'])
+
+  def testNoFilesystem(self):
+    """Test that a partition the layout expects a filesystem in is reported."""
+    with open(self.image, 'r+b') as f:
+      f.seek(self.partitions['2']['first_byte'])
+      f.write(b'\0' * 4096)
+    result = self._Inspect(self.image)
+    parts = dict((str(part['num']), part) for part in result['partitions'])
+    self.assertIsNone(parts['2']['fs_type'])
+    self.assertIn('fs_error', parts['2'])
+    self.assertFalse(result['layout_compatible'])
+
+  def testTruncated(self):
+    """Test that partitions past the end of the image are an error."""
+    with open(self.image, 'r+b') as f:
+      f.truncate(self.partitions['3']['first_byte'])
+    self.assertIn('error', self._Inspect(self.image))
+
+  def testMissing(self):
+    """Test that an image which does not exist is an error."""
+    result = self._Inspect(os.path.join(self.tempdir, 'missing.img'))
+    self.assertIn('error', result)
+    self.assertEqual(result['partitions'], [])
+
+  def testBadGpt(self):
+    """Test that an image without a GPT is an error."""
+    with open(self.image, 'r+b') as f:
+      f.seek(self.config['metadata']['block_size'])
+      f.write(b'NOT PART')
+    self.assertIn('error', self._Inspect(self.image))
+
+  def testMain(self):
+    """Test that main prints one report per image and fails on errors."""
+    status, results = self._Main(self.image, self.image)
+    self.assertEqual(status, 0)
+    self.assertEqual([result['image'] for result in results],
+                     [self.image, self.image])
+    self.assertTrue(all(result['layout_compatible'] for result in results))
+
+    missing = os.path.join(self.tempdir, 'missing.img')
+    status, results = self._Main(self.image, missing)
+    self.assertEqual(status, 1)
+    self.assertEqual([result['image'] for result in results],
+                     [self.image, missing])
+    self.assertNotIn('error', results[0])
+    self.assertIn('error', results[1])
+
+if __name__ == '__main__':
+  unittest.main()
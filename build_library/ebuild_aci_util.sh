@@ -25,8 +25,8 @@ create_ebuild_aci_image() {
 
     emerge_to_image_unchecked "${root_fs_dir}" "${pkg}"
     run_ldconfig "${root_fs_dir}"
-    write_packages "${root_fs_dir}" "${BUILD_DIR}/${image_packages}"
-    write_licenses "${root_fs_dir}" "${BUILD_DIR}/${image_licenses}"
+    write_packages_and_licenses "${root_fs_dir}" \
+        "${BUILD_DIR}/${image_packages}" "${BUILD_DIR}/${image_licenses}"
 
     cleanup_mounts "${root_fs_dir}"
     trap - EXIT
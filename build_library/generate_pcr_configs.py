@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Generate the TPM PCR policy configs for a disk image.
+
+Everything that GRUB measures is read straight from the image, without
+mounting it: the boot sectors and core image from the MBR and BIOS-BOOT
+partition, and the kernel and GRUB modules from the EFI-SYSTEM partition
+through a read-only FAT reader.  All files are hashed in parallel as they
+are read, modules are decompressed on the way since GRUB measures them
+after loading.
+
+Writes kernel.config, grub_loader.config, grub_modules.config,
+kernel_cmdline.config and grub_commands.config to the output directory.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+import disk_reader
+import parallel
+
+ESP_LABEL = 'EFI-SYSTEM'
+BIOS_BOOT_LABEL = 'BIOS-BOOT'
+KERNEL_PATH = 'coreos/vmlinuz-a'
+GRUB_PATH = 'coreos/grub'
+BLOCK_SIZE = 512
+
+
+def FindPartition(partitions, label):
+  for part in partitions:
+    if part.label == label:
+      return part
+  raise disk_reader.InvalidPartitionTable('No %s partition found' % label)
+
+
+def Gunzip(chunks):
+  """Decompresses a stream of chunks if it is gzipped."""
+  decompressor = None
+  for chunk in chunks:
+    if decompressor is None:
+      if chunk[:2] != b'\x1f\x8b':
+        yield chunk
+        for chunk in chunks:
+          yield chunk
+        return
+      # Accept only the gzip format, not raw zlib data.
+      decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.decompress(chunk)
+  if decompressor is not None:
+    yield decompressor.flush()
+
+
+def Sha1(chunks):
+  h = hashlib.sha1()
+  for chunk in chunks:
+    h.update(chunk)
+  return h.hexdigest()
+
+
+def FindModules(esp, entry=None):
+  """Lists every GRUB module on the ESP as (name, FileEntry) tuples."""
+  modules = []
+  for child in esp.ListDir(entry):
+    if child.is_dir:
+      modules.extend(FindModules(esp, child))
+    elif child.name.endswith('.mod'):
+      modules.append((child.name, child))
+  return modules
+
+
+def KernelConfig(kernel, version):
+  return {"9": {"binaryvalues": [{"prefix": "grub_linux", "values": [{"value": kernel, "description": "coreos-%s" % version}]}]}}
+
+
+def LoaderConfig(boot, diskboot, core, version):
+  return {"4": {"binaryvalues": [{"values": [{"value": boot, "description": "CoreOS Grub boot.img %s" % version}]}]},
+          "8": {"binaryvalues" : [{"values": [{"value": diskboot, "description": "CoreOS Grub diskboot.img %s" % version}]}]},
+          "9": {"binaryvalues": [{"values": [{"value": core, "description": "CoreOS Grub core.img %s" % version}]}]}}
+
+
+def ModulesConfig(modules, version):
+  hashvalues = []
+  for name, value in modules:
+    description = "CoreOS Grub %s %s" % (name, version)
+    hashvalues.append({"value": value, "description": description})
+  return {"9": {"binaryvalues": [{"prefix": "grub_module", "values": hashvalues}]}}
+
+
+def CmdlineConfig(version):
+  return {"8": {"asciivalues": [{"prefix": "grub_kernel_cmdline", "values": [{"value": "rootflags=rw mount.usrflags=ro BOOT_IMAGE=/coreos/vmlinuz-[ab] mount.usr=PARTUUID=\S{36} rootflags=rw mount.usrflags=ro consoleblank=0 root=LABEL=ROOT (console=\S+)? (coreos.autologin=\S+)? verity.usrhash=\\S{64}", "description": "CoreOS kernel command line %s" % version}]}]}}
+
+
+def CommandsConfig(version):
+  commands = [{"value": '\[.*\]', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'gptprio.next -d usr -u usr_uuid', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'insmod all_video', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'linux /coreos/vmlinuz-[ab] rootflags=rw mount.usrflags=ro consoleblank=0 root=LABEL=ROOT (console=\S+)? (coreos.autologin=\S+)?', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'menuentry CoreOS \S+ --id=coreos\S* {', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'search --no-floppy --set randomize_disk_guid --disk-uuid 00000000-0000-0000-0000-000000000001', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'search --no-floppy --set oem --part-label OEM --hint hd0,gpt1', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'set .+', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'setparams CoreOS default', "description": "CoreOS Grub configuration %s" % version},
+              {"value": 'source (hd0,gpt6)/grub.cfg', "description": "CoreOS Grub configuration %s" % version}]
+  return {"8": {"asciivalues": [{"prefix": "grub_cmd", "values": commands}]}}
+
+
+def Measure(disk_image, version, jobs=None):
+  """Hashes everything GRUB measures and builds the PCR configs.
+
+  Args:
+    disk_image: path to the disk image
+    version: CoreOS version for the descriptions
+    jobs: number of files to hash at once, defaults to the number of CPUs
+  Returns:
+    A dict of config file name to its JSON text
+  """
+  with disk_reader.ImageRange(disk_image) as image:
+    partitions = disk_reader.ReadGpt(image, BLOCK_SIZE)
+    bios_boot = FindPartition(partitions, BIOS_BOOT_LABEL)
+    esp_part = FindPartition(partitions, ESP_LABEL)
+    esp = disk_reader.FatFilesystem(image.Slice(
+        esp_part.first_block * BLOCK_SIZE, esp_part.blocks * BLOCK_SIZE))
+
+    # The MBR boot code, then diskboot.img followed by the core image
+    # whose length in sectors diskboot.img records.
+    boot_offset = bios_boot.first_block * BLOCK_SIZE
+    boot = image.Read(0, 440)
+    diskboot = image.Read(boot_offset, 512)
+    core_len, = struct.unpack_from('<H', diskboot, 508)
+    core = image.Read(boot_offset + 512, core_len * 512)
+
+    modules = FindModules(esp, esp.Lookup(GRUB_PATH))
+    sources = [lambda: [boot], lambda: [diskboot], lambda: [core],
+               lambda: esp.ReadFile(esp.Lookup(KERNEL_PATH))]
+    sources.extend(lambda e=entry: Gunzip(esp.ReadFile(e))
+                   for _, entry in modules)
+
+    values = parallel.Map(lambda source: Sha1(source()), sources, jobs)
+
+  boot, diskboot, core, kernel = values[:4]
+  module_values = list(zip([name for name, _ in modules], values[4:]))
+  # The old scripts ran on python2, whose dict order happened to be sorted
+  # for all of these.  Sort explicitly so python3 writes the same bytes.
+  return {
+      "kernel.config": json.dumps(KernelConfig(kernel, version),
+                                  sort_keys=True) + "\n",
+      "grub_loader.config": json.dumps(
+          LoaderConfig(boot, diskboot, core, version), sort_keys=True),
+      "grub_modules.config": json.dumps(ModulesConfig(module_values, version),
+                                        sort_keys=True),
+      "kernel_cmdline.config": json.dumps(CmdlineConfig(version),
+                                          sort_keys=True),
+      "grub_commands.config": json.dumps(CommandsConfig(version),
+                                         sort_keys=True),
+  }
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__,
+          formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--jobs', '-j', type=int, default=0,
+          help='files to hash in parallel, 0 for one per cpu')
+  parser.add_argument('disk_image', help='path to the disk image')
+  parser.add_argument('output_dir', help='directory to write configs to')
+  parser.add_argument('version', help='CoreOS version')
+  options = parser.parse_args(argv[1:])
+
+  configs = Measure(options.disk_image, options.version, options.jobs)
+  for name, text in configs.items():
+    with open(os.path.join(options.output_dir, name), "w") as f:
+      f.write(text)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
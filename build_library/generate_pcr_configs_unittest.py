@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for generate_pcr_configs."""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import disk_reader_unittest
+import generate_pcr_configs
+
+VERSION = '1688.0.0'
+BIOS_BOOT_BLOCK = 64
+CORE_SECTORS = 3
+ESP_BLOCK = 128
+
+KERNEL = b''.join(struct.pack('<I', i) for i in range(20000))
+MODULES = {
+    'i386-pc': {'normal.mod': b'normal' * 300, 'biosdisk.mod': b'bios' * 50},
+    'x86_64-efi': {'normal.mod': b'efi normal' * 200, 'linux.mod': b'l' * 5},
+}
+
+# Written by the generate_kernel_hash.sh and generate_grub_hashes.py this
+# replaced, run on the same fixture with the modules uncompressed in a
+# directory instead of gzipped on the ESP.  The order of the modules
+# depended on os.walk() so only their values are compared.
+OLD_KERNEL_CONFIG = (
+    '{"9": {"binaryvalues": [{"prefix": "grub_linux", "values": '
+    '[{"description": "coreos-1688.0.0", "value": '
+    '"38a3cd5d935d6fe16ecbae53e71d8bd800b825ef"}]}]}}\n')
+OLD_LOADER_CONFIG = (
+    '{"4": {"binaryvalues": [{"values": [{"description": "CoreOS Grub boot.img '
+    '1688.0.0", "value": "0886bc2c2e31213f850b55cf539b5300f0ceb303"}]}]}, '
+    '"8": {"binaryvalues": [{"values": [{"description": "CoreOS Grub '
+    'diskboot.img 1688.0.0", "value": '
+    '"4781506ff0a96ddfc4b4376d57bbf7a3f83b4c51"}]}]}, "9": {"binaryvalues": '
+    '[{"values": [{"description": "CoreOS Grub core.img 1688.0.0", "value": '
+    '"6f91e77d2eb3ebf2b3af1cc0cc3748e495eb78e5"}]}]}}')
+OLD_MODULE_VALUES = [
+    {'description': 'CoreOS Grub biosdisk.mod 1688.0.0',
+     'value': 'aaa1b38ae0db052c9fe223d9ca1fffccb28b8e0e'},
+    {'description': 'CoreOS Grub linux.mod 1688.0.0',
+     'value': '890a492c4fc7a01e4582fc6774ffb8a9e01f14d5'},
+    {'description': 'CoreOS Grub normal.mod 1688.0.0',
+     'value': 'e50e381d58dc3a0ab8f4a2da9a9d0d5ba44bb07f'},
+    {'description': 'CoreOS Grub normal.mod 1688.0.0',
+     'value': 'fd63f5c2334005b794d23f4545b1ee808b041145'},
+]
+# sha1 of kernel_cmdline.config and grub_commands.config, which do not
+# depend on the image.
+OLD_CMDLINE_SHA1 = '98186748e10432a5dd58d84f18392091e4d9246a'
+OLD_COMMANDS_SHA1 = '4489eb19f01f14647d516ecf33833560a450e66e'
+
+
+def _Gzip(data):
+  out = io.BytesIO()
+  with gzip.GzipFile('', 'wb', fileobj=out, mtime=0) as f:
+    f.write(data)
+  return out.getvalue()
+
+
+def MakeDiskImage(path):
+  """Writes a disk image with a BIOS-BOOT partition and a FAT ESP."""
+  boot = bytes(bytearray(i % 251 for i in range(440)))
+  diskboot = bytearray(b'D' * 512)
+  struct.pack_into('<H', diskboot, 508, CORE_SECTORS)
+  core = b'core' * (CORE_SECTORS * 128)
+  # Anything after the core image is not measured.
+  tail = b'not measured' * 100
+
+  grub = dict((arch, dict((name, _Gzip(data)) for name, data in mods.items()))
+              for arch, mods in MODULES.items())
+  esp = disk_reader_unittest.MakeFat(
+      {'coreos': {'vmlinuz-a': KERNEL, 'grub': grub}})
+  esp_blocks = len(esp) // 512
+
+  with open(path, 'wb') as f:
+    f.write(boot)
+    f.seek(BIOS_BOOT_BLOCK * 512)
+    f.write(bytes(diskboot) + core + tail)
+    f.seek(ESP_BLOCK * 512)
+    f.write(bytes(esp))
+    f.truncate((ESP_BLOCK + esp_blocks + 34) * 512)
+  disk_reader_unittest.WriteGpt(path, [
+      (1, 'EFI-SYSTEM', ESP_BLOCK, esp_blocks),
+      (2, 'BIOS-BOOT', BIOS_BOOT_BLOCK, ESP_BLOCK - BIOS_BOOT_BLOCK),
+  ])
+
+
+class GeneratePcrConfigsTest(unittest.TestCase):
+  """Test class for generate_pcr_configs."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'disk.img')
+    MakeDiskImage(self.image)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Check(self, configs):
+    self.assertEqual(configs['kernel.config'], OLD_KERNEL_CONFIG)
+    self.assertEqual(configs['grub_loader.config'], OLD_LOADER_CONFIG)
+    modules = json.loads(configs['grub_modules.config'])
+    values = modules['9']['binaryvalues'][0]['values']
+    self.assertEqual(sorted(values, key=lambda v: (v['description'],
+                                                   v['value'])),
+                     OLD_MODULE_VALUES)
+    self.assertEqual(modules['9']['binaryvalues'][0]['prefix'], 'grub_module')
+    self.assertEqual(
+        hashlib.sha1(configs['kernel_cmdline.config'].encode()).hexdigest(),
+        OLD_CMDLINE_SHA1)
+    self.assertEqual(
+        hashlib.sha1(configs['grub_commands.config'].encode()).hexdigest(),
+        OLD_COMMANDS_SHA1)
+
+  def testMatchesOldScripts(self):
+    """Test that the configs match what the old scripts wrote."""
+    self._Check(generate_pcr_configs.Measure(self.image, VERSION, jobs=4))
+
+  def testOneJob(self):
+    """Test that hashing on one thread gives the same configs."""
+    self._Check(generate_pcr_configs.Measure(self.image, VERSION, jobs=1))
+
+  def testMain(self):
+    """Test that main writes every config to the output directory."""
+    output = os.path.join(self.tempdir, 'pcrs')
+    os.mkdir(output)
+    generate_pcr_configs.main(['generate_pcr_configs.py', self.image, output,
+                               VERSION])
+    configs = {}
+    for name in os.listdir(output):
+      with open(os.path.join(output, name)) as f:
+        configs[name] = f.read()
+    self._Check(configs)
+
+
+if __name__ == '__main__':
+  unittest.main()
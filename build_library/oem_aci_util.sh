@@ -32,8 +32,8 @@ create_oem_aci_image() {
     extract_prod_gcc "${root_fs_dir}"
     emerge_to_image "${root_fs_dir}" "${base_pkg}"
     run_ldconfig "${root_fs_dir}"
-    write_packages "${root_fs_dir}" "${BUILD_DIR}/${image_packages}"
-    write_licenses "${root_fs_dir}" "${BUILD_DIR}/${image_licenses}"
+    write_packages_and_licenses "${root_fs_dir}" \
+        "${BUILD_DIR}/${image_packages}" "${BUILD_DIR}/${image_licenses}"
 
     # clean-ups of things we do not need
     sudo rm ${root_fs_dir}/etc/csh.env
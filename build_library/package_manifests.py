@@ -0,0 +1,229 @@
+#!/usr/bin/python2
+# needs to be python2 for portage
+
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Write the package list and license manifest of an image root.
+
+Replaces separate equery/portageq calls per package: the image's package
+database is read once and every package that is not installed in the image
+(initramfs-only kernel dependencies, package.provided and torcx sources) is
+resolved against the board's portage tree in the same process.
+
+The package list has the format:
+  sys-apps/systemd-212-r8::coreos
+
+The license manifest has the format:
+  [
+    {"project": "sys-apps/systemd-212-r8::coreos", "licenses": ["GPL-2", ...]}
+  ]
+
+Both are sorted in the collation order of the locale the build runs in,
+the same as sort(1) in the shell functions this replaces.
+"""
+
+import argparse
+import json
+import locale
+import os
+import re
+import sys
+
+
+def GetDbs(config_root, target_root):
+  """Returns the (vardb, portdb) for the given roots.
+
+  Equivalent to running equery or portageq with ROOT and PORTAGE_CONFIGROOT
+  set to the given directories.
+  """
+  import portage
+  env = dict((k, v) for k, v in os.environ.items()
+             if k not in ('ROOT', 'PORTAGE_CONFIGROOT'))
+  trees = portage.create_trees(config_root=config_root,
+                               target_root=target_root, env=env)
+  root_trees = trees[trees._target_eroot]
+  return root_trees['vartree'].dbapi, root_trees['porttree'].dbapi
+
+
+def ToAtom(pkg):
+  """Converts a bare cat/pkg-ver into an atom the way equery does."""
+  import portage.dep
+  if not portage.dep.isvalidatom(pkg) and portage.dep.isvalidatom('=' + pkg):
+    return '=' + pkg
+  return pkg
+
+
+def KernelDepends(root, vardb):
+  """Lists build deps of coreos-kernel that use the "=" slot operator.
+
+  These approximate the packages that only exist in the initramfs.
+  OEM ACIs have no kernel package so this may be empty.
+  """
+  atoms = []
+  for cpv in vardb.match('sys-kernel/coreos-kernel'):
+    with open(os.path.join(root, 'var/db/pkg', cpv, 'DEPEND')) as f:
+      atoms.extend(a for a in f.read().split(' ') if a.endswith('='))
+  return atoms
+
+
+def ProvidedPackages(config_root):
+  """Lists packages from the profile's package.provided.
+
+  In production images GCC libraries are extracted manually.
+  """
+  path = os.path.join(config_root, 'etc/portage/profile/package.provided')
+  if not os.path.exists(path):
+    return []
+  with open(path) as f:
+    return [line.strip() for line in f if line.strip()]
+
+
+def TorcxSources(manifest):
+  """Lists source packages of all torcx images installed on disk."""
+  with open(manifest) as f:
+    data = json.load(f)
+  sources = []
+  for package in data['value']['packages']:
+    for version in package['versions']:
+      for location in version.get('locations', []):
+        if location.get('path'):
+          sources.append(version['sourcePackage'])
+  return sources
+
+
+def BestAvailable(portdb, atom):
+  """Returns the highest unmasked cpv::repo for an atom, or None."""
+  import portage
+  matches = portdb.xmatch('match-visible', ToAtom(atom))
+  if not matches:
+    return None
+  cpv = portage.best(matches)
+  repo = portdb.aux_get(cpv, ['repository'])[0]
+  return '%s::%s' % (cpv, repo)
+
+
+def ImagePackages(root, config_root, board_root, torcx_manifest=None):
+  """Lists packages in an image.
+
+  Returns:
+    A tuple of the sorted cpv::repo list, the image vardb and board portdb.
+  """
+  vardb, _ = GetDbs(config_root, root)
+  _, portdb = GetDbs(board_root, board_root)
+
+  packages = []
+  for cpv in vardb.cpv_all():
+    repo = vardb.aux_get(cpv, ['repository'])[0]
+    packages.append('%s::%s' % (cpv, repo))
+
+  wanted = [a for a in KernelDepends(root, vardb)
+            if not vardb.match(ToAtom(a))]
+  wanted.extend(ProvidedPackages(config_root))
+  if torcx_manifest:
+    wanted.extend(TorcxSources(torcx_manifest))
+
+  for atom in wanted:
+    pkg = BestAvailable(portdb, atom)
+    if pkg:
+      packages.append(pkg)
+
+  return sorted(packages, key=locale.strxfrm), vardb, portdb
+
+
+def SplitLicenses(lic_str):
+  """Picks the licenses that apply from a LICENSE string.
+
+  All required licenses are kept and, from a one-of group, the first GPL
+  license or else the first license.  For example:
+    GPL-3+ LGPL-3+ || ( GPL-3+ libgcc libstdc++ ) FDL-1.3+
+    required: GPL-3+ LGPL-3+ FDL-1.3+
+    one-of: GPL-3+ libgcc libstdc++
+  """
+  req_lics = []
+  opt_lics = []
+  for line in lic_str.split('\n'):
+    req_lics.extend(re.sub(r'\|\| \([^)]*\)', '', line, count=1).split())
+    match = re.match(r'.*\|\| \(([^)]*)\).*', line)
+    opt_lics.extend((match.group(1) if match else line).split())
+
+  opt_lic = ''
+  for lic in opt_lics:
+    if 'GPL' in lic:
+      opt_lic = lic
+      break
+  else:
+    if opt_lics:
+      opt_lic = opt_lics[0]
+
+  return sorted(set(req_lics + [opt_lic]) - set(['']), key=locale.strxfrm)
+
+
+def WriteLicenses(path, root, packages, portdb):
+  """Writes the license manifest for a list of cpv::repo packages."""
+  entries = []
+  for pkg in packages:
+    # Ignore virtual packages since they aren't licensed
+    if pkg.split('/', 1)[0] == 'virtual':
+      continue
+
+    cpv = pkg.split('::', 1)[0]
+    lic_path = os.path.join(root, 'var/db/pkg', cpv, 'LICENSE')
+    if os.path.isfile(lic_path):
+      with open(lic_path) as f:
+        lic_str = f.read().rstrip('\n')
+    else:
+      # The package is not installed in the image so get the license
+      # from its ebuild
+      try:
+        lic_str = portdb.aux_get(cpv, ['LICENSE'])[0]
+      except KeyError:
+        lic_str = ''
+      if not lic_str:
+        sys.stderr.write('WARNING: No license found for %s\n' % pkg)
+        continue
+
+    lics = ', '.join('"%s"' % l for l in SplitLicenses(lic_str))
+    entries.append('  {"project": "%s", "licenses": [%s]}' % (pkg, lics))
+
+  with open(path, 'w') as f:
+    f.write('[')
+    if entries:
+      f.write('\n' + ',\n'.join(entries))
+    f.write('\n]\n')
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__,
+          formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--root', required=True,
+          help='root of the image')
+  parser.add_argument('--configroot', required=True,
+          help='PORTAGE_CONFIGROOT the image was built with')
+  parser.add_argument('--board_root', required=True,
+          help='board sysroot used to look up packages not in the image')
+  parser.add_argument('--torcx_manifest',
+          help='also list sources of torcx images installed on disk')
+  parser.add_argument('--packages', help='path to write the package list')
+  parser.add_argument('--licenses', help='path to write the license manifest')
+  options = parser.parse_args(argv[1:])
+
+  # Sort like sort(1) would, which falls back to C for an unknown locale.
+  try:
+    locale.setlocale(locale.LC_COLLATE, '')
+  except locale.Error:
+    pass
+
+  packages, _, portdb = ImagePackages(options.root, options.configroot,
+                                      options.board_root,
+                                      options.torcx_manifest)
+  if options.packages:
+    with open(options.packages, 'w') as f:
+      f.writelines(p + '\n' for p in packages)
+  if options.licenses:
+    WriteLicenses(options.licenses, options.root, packages, portdb)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
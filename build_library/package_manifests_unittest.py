@@ -0,0 +1,111 @@
+#!/usr/bin/python2
+# needs to be python2 for portage
+
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for package_manifests."""
+
+import json
+import locale
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import package_manifests
+
+
+class PackageManifestsTest(unittest.TestCase):
+  """Test class for package_manifests."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.collate = locale.setlocale(locale.LC_COLLATE)
+
+  def tearDown(self):
+    locale.setlocale(locale.LC_COLLATE, self.collate)
+    shutil.rmtree(self.tempdir)
+
+  def _SortOrder(self, lang, names):
+    """Returns names sorted by sort(1) and by SplitLicenses in a locale."""
+    try:
+      locale.setlocale(locale.LC_COLLATE, lang)
+    except locale.Error:
+      self.skipTest('locale %s is not available' % lang)
+    env = dict(os.environ, LC_ALL=lang)
+    proc = subprocess.Popen(['sort', '-u'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, env=env)
+    out, _ = proc.communicate('\n'.join(names).encode('utf-8'))
+    return (out.decode('utf-8').split(),
+            package_manifests.SplitLicenses(' '.join(names)))
+
+  def testSplitLicensesRequired(self):
+    """Test that required licenses are deduplicated and sorted."""
+    self.assertEqual(package_manifests.SplitLicenses('MIT GPL-2 MIT'),
+                     ['GPL-2', 'MIT'])
+
+  def testSplitLicensesOneOfPrefersGpl(self):
+    """Test that a GPL license is picked from a one-of group."""
+    self.assertEqual(package_manifests.SplitLicenses(
+        'GPL-3+ LGPL-3+ || ( GPL-3+ libgcc libstdc++ ) FDL-1.3+'),
+        ['FDL-1.3+', 'GPL-3+', 'LGPL-3+'])
+    self.assertEqual(package_manifests.SplitLicenses(
+        'ZLIB || ( BSD MIT )'), ['BSD', 'ZLIB'])
+
+  def testSplitLicensesBytewise(self):
+    """Test that licenses are sorted like sort(1) in the C locale."""
+    expected, result = self._SortOrder('C', ['public-domain', 'MIT', 'BSD-2',
+                                             'as-is', 'Apache-2.0'])
+    self.assertEqual(result, ['Apache-2.0', 'BSD-2', 'MIT', 'as-is',
+                              'public-domain'])
+    self.assertEqual(result, expected)
+
+  def testSplitLicensesLocale(self):
+    """Test that licenses are sorted like sort(1) in other locales."""
+    expected, result = self._SortOrder('en_US.UTF-8', [
+        'public-domain', 'MIT', 'BSD-2', 'as-is', 'Apache-2.0', 'LGPL-2.1+',
+        'LGPL-2.1'])
+    self.assertEqual(result[:3], ['Apache-2.0', 'as-is', 'BSD-2'])
+    self.assertEqual(result, expected)
+
+  def testMainUsesLocale(self):
+    """Test that main collates in the locale from the environment."""
+    calls = []
+    setlocale = locale.setlocale
+    image_packages = package_manifests.ImagePackages
+    locale.setlocale = lambda *args: calls.append(args) or 'C'
+    package_manifests.ImagePackages = lambda *args: ([], None, None)
+    try:
+      package_manifests.main(['package_manifests.py', '--root', '/',
+                              '--configroot', '/', '--board_root', '/'])
+    finally:
+      locale.setlocale = setlocale
+      package_manifests.ImagePackages = image_packages
+    self.assertEqual(calls, [(locale.LC_COLLATE, '')])
+
+  def testSplitLicensesEmpty(self):
+    """Test that an empty LICENSE gives no licenses."""
+    self.assertEqual(package_manifests.SplitLicenses(''), [])
+
+  def testWriteLicenses(self):
+    """Test the manifest format, skipping virtual packages."""
+    lic_dir = os.path.join(self.tempdir, 'var/db/pkg/sys-apps/foo-1')
+    os.makedirs(lic_dir)
+    with open(os.path.join(lic_dir, 'LICENSE'), 'w') as f:
+      f.write('MIT || ( BSD GPL-2 )\n')
+    path = os.path.join(self.tempdir, 'license.json')
+    package_manifests.WriteLicenses(
+        path, self.tempdir, ['sys-apps/foo-1::coreos', 'virtual/bar-1::coreos'],
+        None)
+    with open(path) as f:
+      text = f.read()
+    self.assertEqual(text, '[\n  {"project": "sys-apps/foo-1::coreos", '
+                     '"licenses": ["GPL-2", "MIT"]}\n]\n')
+    self.assertEqual(len(json.loads(text)), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
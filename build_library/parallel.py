@@ -0,0 +1,42 @@
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Thread pool helpers shared by the build library tools.
+
+The work these tools do in parallel is reading and hashing files, which
+releases the GIL, so threads are enough to use several cores.
+"""
+
+import multiprocessing
+import multiprocessing.pool
+import sys
+import threading
+
+# Waiting with a timeout keeps KeyboardInterrupt working.
+WAIT_TIMEOUT = getattr(threading, 'TIMEOUT_MAX', sys.maxsize)
+
+
+def Map(func, items, jobs=None):
+  """Calls func on each item in a pool of threads.
+
+  Args:
+    func: function taking a single item
+    items: list of items to process
+    jobs: number of items to process at once, defaults to the number of CPUs
+  Returns:
+    List of results, in the same order as items
+  """
+  if not items:
+    return []
+  if not jobs:
+    jobs = multiprocessing.cpu_count()
+  jobs = min(jobs, len(items))
+  if jobs == 1:
+    return [func(item) for item in items]
+
+  pool = multiprocessing.pool.ThreadPool(jobs)
+  try:
+    return pool.map_async(func, items, chunksize=1).get(WAIT_TIMEOUT)
+  finally:
+    pool.terminate()
@@ -80,8 +80,8 @@ create_prod_image() {
   emerge_to_image "${root_fs_dir}" "${base_pkg}"
   run_ldconfig "${root_fs_dir}"
   run_localedef "${root_fs_dir}"
-  write_packages "${root_fs_dir}" "${BUILD_DIR}/${image_packages}"
-  write_licenses "${root_fs_dir}" "${BUILD_DIR}/${image_licenses}"
+  write_packages_and_licenses "${root_fs_dir}" \
+      "${BUILD_DIR}/${image_packages}" "${BUILD_DIR}/${image_licenses}"
 
   # Assert that if this is supposed to be an official build that the
   # official update keys have been used.
@@ -135,6 +135,7 @@ EOF
   # Upload
   local to_upload=(
     "${BUILD_DIR}/${image_contents}"
+    "${BUILD_DIR}/${image_contents%.txt}_sha256.txt"
     "${BUILD_DIR}/${image_packages}"
     "${BUILD_DIR}/${image_licenses}"
     "${BUILD_DIR}/${image_name}"
@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Delete old image builds and hardlink identical files between the rest.
+
+The output root is scanned once, indexing every build directory (e.g.
+amd64-usr/developer-1688.0.0-a1) and every file in it.  Builds are grouped
+by board and channel, the channel being the update group the build was
+named after, and each group is pruned by the first matching policy:
+
+  PATTERN:KEEP[:DAYS]
+
+PATTERN is matched against BOARD/CHANNEL, e.g. 'amd64-usr/stable' or
+'*/developer'.  The KEEP newest builds and any build younger than DAYS are
+kept.  The latest builds, and anything newer, are always kept unless
+--nokeep_latest is given.
+
+With --dedupe, files in the builds that are kept are deduplicated: files of
+the same size, owner and mode are hashed and byte-identical ones are
+replaced by hardlinks to a single copy.
+
+Space is only counted as reclaimed when the last link to a file goes away,
+so files that are already shared between builds are not counted twice.
+"""
+
+import argparse
+import collections
+import fnmatch
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import time
+
+import digests
+
+# Build directories are named GROUP-VERSION or GROUP-VERSION-aATTEMPT.
+BUILD_NAME_RE = re.compile(r'^(?P<channel>.+?)-(?P<version>\d.*)$')
+LATEST_LINK = 'latest'
+HASH_TYPE = 'sha256'
+DAY = 24 * 60 * 60
+
+Policy = collections.namedtuple('Policy', ('pattern', 'keep', 'max_age'))
+
+
+class StillMounted(Exception):
+  pass
+
+
+class Build(object):
+  """A build output directory and the files in it."""
+
+  def __init__(self, board, name, path):
+    self.board = board
+    self.name = name
+    self.path = path
+    match = BUILD_NAME_RE.match(name)
+    self.channel = match.group('channel') if match else name
+
+    # version.txt is written last, use it to tell when a build finished.
+    version_txt = os.path.join(path, 'version.txt')
+    self.has_version = os.path.exists(version_txt)
+    self.mtime = os.stat(version_txt if self.has_version else path).st_mtime
+
+    # List of (path, lstat result) for every regular file.
+    self.files = []
+    # Why the build is kept, None if it will be deleted.
+    self.keep_reason = None
+
+  @property
+  def group(self):
+    return '%s/%s' % (self.board, self.channel)
+
+  def Scan(self):
+    for dirpath, _, filenames in os.walk(self.path):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        st = os.lstat(path)
+        if stat.S_ISREG(st.st_mode):
+          self.files.append((path, st))
+
+
+def FormatSize(size):
+  """Formats a byte count the way prune_images always has."""
+  if size < 1024 * 1024:
+    return '%d KB' % (size // 1024)
+  elif size < 1024 * 1024 * 1024:
+    return '%.2f MB' % (size / 1024.0 / 1024)
+  return '%.2f GB' % (size / 1024.0 / 1024 / 1024)
+
+
+def ParsePolicy(spec):
+  """Parses a PATTERN:KEEP[:DAYS] policy."""
+  fields = spec.split(':')
+  if len(fields) not in (2, 3):
+    raise ValueError('Invalid policy %r, expected PATTERN:KEEP[:DAYS]' % spec)
+  max_age = float(fields[2]) * DAY if len(fields) == 3 else 0
+  return Policy(fields[0], int(fields[1]), max_age)
+
+
+def IndexBuilds(output_root, board=None):
+  """Finds every build under the output root and the files in each.
+
+  Args:
+    output_root: directory containing one directory per board
+    board: only index this board
+  Returns:
+    A (builds, latest) tuple, latest maps each board to the build its
+    latest link points at, if any.
+  """
+  if board:
+    boards = [board]
+  else:
+    boards = sorted(b for b in os.listdir(output_root)
+                    if os.path.isdir(os.path.join(output_root, b)))
+
+  builds, latest = [], {}
+  for board in boards:
+    board_path = os.path.join(output_root, board)
+    link = os.path.join(board_path, LATEST_LINK)
+    latest_name = os.readlink(link) if os.path.islink(link) else None
+    for name in sorted(os.listdir(board_path)):
+      path = os.path.join(board_path, name)
+      if os.path.islink(path) or not os.path.isdir(path):
+        continue
+      build = Build(board, name, path)
+      build.Scan()
+      builds.append(build)
+      if name == latest_name:
+        latest[board] = build
+  return builds, latest
+
+
+def SelectBuilds(builds, latest, policies, keep_latest=True, now=None):
+  """Decides which builds to keep, setting keep_reason on each.
+
+  Args:
+    builds: list of Build objects
+    latest: dict of board to latest Build
+    policies: list of Policy, the first matching one applies to a group
+    keep_latest: keep the latest builds and anything newer, if a board has
+                 no latest build every finished build is kept
+    now: current time, for testing
+  """
+  if now is None:
+    now = time.time()
+
+  groups = collections.defaultdict(list)
+  for build in builds:
+    groups[build.group].append(build)
+
+  for group, members in groups.items():
+    policy = None
+    for p in policies:
+      if fnmatch.fnmatch(group, p.pattern):
+        policy = p
+        break
+
+    members.sort(key=lambda b: b.mtime, reverse=True)
+    for index, build in enumerate(members):
+      newest = latest.get(build.board)
+      if keep_latest and build is newest:
+        build.keep_reason = 'latest'
+      elif (keep_latest and build.has_version and
+            (not newest or not newest.has_version or
+             build.mtime > newest.mtime)):
+        build.keep_reason = 'newer than latest'
+      elif policy and index < policy.keep:
+        build.keep_reason = 'newest %d in %s' % (policy.keep, group)
+      elif policy and now - build.mtime < policy.max_age:
+        build.keep_reason = 'younger than %g days' % (policy.max_age / DAY)
+
+
+def FindDuplicates(builds, min_size=0, jobs=None):
+  """Finds byte-identical files that could be hardlinked together.
+
+  Files are only compared if they have the same size, owner and mode, and
+  are on the same filesystem.  Only one path of each inode is hashed.
+
+  Args:
+    builds: list of Build objects to deduplicate between
+    min_size: ignore files smaller than this
+    jobs: number of files to hash at once
+  Returns:
+    List of (source path, path to replace with a link to source) tuples
+  """
+  candidates = collections.defaultdict(dict)
+  for build in builds:
+    for path, st in build.files:
+      if st.st_size < min_size:
+        continue
+      key = (st.st_dev, st.st_size, st.st_mode, st.st_uid, st.st_gid)
+      candidates[key].setdefault(st.st_ino, []).append(path)
+
+  # Size first, only hash files that might match something.
+  inodes = []
+  for key, by_inode in candidates.items():
+    if len(by_inode) > 1:
+      inodes.extend((key, paths) for paths in by_inode.values())
+
+  results = digests.HashFiles([paths[0] for _, paths in inodes],
+                              [HASH_TYPE], jobs)
+  matches = collections.defaultdict(list)
+  for (key, paths), (digest,) in zip(inodes, results):
+    matches[key, digest].append(paths)
+
+  links = []
+  for inode_paths in matches.values():
+    # Keep the inode with the most links, it costs the fewest renames.
+    inode_paths.sort(key=len, reverse=True)
+    source = inode_paths[0][0]
+    for paths in inode_paths[1:]:
+      links.extend((source, path) for path in paths)
+  return links
+
+
+def ReclaimedBytes(stats, removed_paths):
+  """Counts the space freed by removing paths.
+
+  Args:
+    stats: dict of path to lstat result for every indexed file
+    removed_paths: paths that will be deleted or replaced
+  Returns:
+    Bytes used by inodes whose every link is in removed_paths
+  """
+  removed = collections.Counter()
+  inodes = {}
+  for path in removed_paths:
+    st = stats[path]
+    key = (st.st_dev, st.st_ino)
+    removed[key] += 1
+    inodes[key] = st
+  return sum(st.st_blocks * 512 for key, st in inodes.items()
+             if removed[key] >= st.st_nlink)
+
+
+def SubMounts(path):
+  """Lists mount points at or below path, deepest first."""
+  path = os.path.realpath(path)
+  mounts = []
+  with open('/proc/self/mounts') as f:
+    for line in f:
+      mount_point = line.split()[1].replace('\\040', ' ')
+      if mount_point == path or mount_point.startswith(path + '/'):
+        mounts.append(mount_point)
+  return sorted(mounts, key=len, reverse=True)
+
+
+def UmountTree(path):
+  """Unmounts everything at or below path, the same as safe_umount_tree.
+
+  Raises:
+    StillMounted if anything is still mounted afterwards
+  """
+  mounts = SubMounts(path)
+  if not mounts:
+    return
+
+  # First try to unmount, this might fail because of nested binds.
+  if subprocess.call(['umount', '-d'] + mounts) == 0:
+    return
+
+  # Check whether our mounts were successfully unmounted.
+  mounts = SubMounts(path)
+  if not mounts:
+    sys.stderr.write('WARNING: umount failed, but devices were unmounted '
+                     'anyway\n')
+    return
+
+  # Try one more time, giving up if anything is left.
+  sys.stderr.write('WARNING: Failed to unmount %s\n' % ' '.join(mounts))
+  subprocess.call(['umount', '-d'] + mounts)
+  mounts = SubMounts(path)
+  if mounts:
+    raise StillMounted('Still mounted: %s' % ' '.join(mounts))
+
+
+def DeleteBuild(build):
+  """Deletes a build, unmounting anything left mounted inside it.
+
+  Raises:
+    StillMounted if something could not be unmounted, nothing is deleted
+  """
+  UmountTree(build.path)
+  shutil.rmtree(build.path)
+
+
+def LinkFile(source, path):
+  """Atomically replaces path with a hardlink to source."""
+  tmp = '%s.prune-%d' % (path, os.getpid())
+  os.link(source, tmp)
+  try:
+    os.rename(tmp, path)
+  except OSError:
+    os.unlink(tmp)
+    raise
+
+
+def Prune(output_root, board=None, policies=(), keep_latest=True,
+          dedupe=False, min_size=0, dry_run=False, jobs=None):
+  """Deletes old builds and deduplicates the rest.
+
+  Args:
+    output_root: directory containing one directory per board
+    board: only prune this board
+    policies: list of Policy, the first matching one applies to a group
+    keep_latest: keep the latest builds and anything newer
+    dedupe: hardlink identical files in the builds that are kept
+    min_size: ignore files smaller than this when deduplicating
+    dry_run: only report what would be done
+    jobs: number of files to hash at once
+  Returns:
+    Number of bytes reclaimed, or that would be with dry_run
+  """
+  builds, latest = IndexBuilds(output_root, board)
+  SelectBuilds(builds, latest, policies, keep_latest)
+  stats = dict(f for build in builds for f in build.files)
+
+  deleted = [b for b in builds if b.keep_reason is None]
+  kept = [b for b in builds if b.keep_reason is not None]
+  deleted_paths = [path for build in deleted for path, _ in build.files]
+  deleted_bytes = ReclaimedBytes(stats, deleted_paths)
+
+  links = FindDuplicates(kept, min_size, jobs) if dedupe else []
+  total_bytes = ReclaimedBytes(stats,
+                               deleted_paths + [path for _, path in links])
+
+  verb = 'Would delete' if dry_run else 'Deleting'
+  for build in builds:
+    if build.keep_reason:
+      print('Keeping %s/%s (%s)' % (build.board, build.name,
+                                    build.keep_reason))
+    else:
+      print('%s %s/%s' % (verb, build.board, build.name))
+      if not dry_run:
+        DeleteBuild(build)
+
+  verb = 'Would link' if dry_run else 'Linking'
+  if links:
+    print('%s %d identical files' % (verb, len(links)))
+  if not dry_run:
+    for source, path in links:
+      LinkFile(source, path)
+    # Clean up the latest link if it pointed at a deleted build.
+    for board_path in set(os.path.dirname(b.path) for b in deleted):
+      link = os.path.join(board_path, LATEST_LINK)
+      if os.path.islink(link) and not os.path.exists(link):
+        os.unlink(link)
+
+  verb = 'Reclaimable' if dry_run else 'Reclaimed'
+  print('%s %s from deleted builds' % (verb, FormatSize(deleted_bytes)))
+  print('%s %s from identical files' %
+        (verb, FormatSize(total_bytes - deleted_bytes)))
+  print('%s %s in total' % (verb, FormatSize(total_bytes)))
+  return total_bytes
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__,
+          formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--board',
+          help='only prune builds for this board')
+  parser.add_argument('--policy', action='append', default=[],
+          help='PATTERN:KEEP[:DAYS] policy, may be given more than once')
+  parser.add_argument('--keep', type=int, default=0,
+          help='newest builds to keep if no policy matches')
+  parser.add_argument('--max_age', type=float, default=0,
+          help='keep builds younger than this many days if no policy matches')
+  parser.add_argument('--nokeep_latest', action='store_false',
+          dest='keep_latest', help='allow deleting the latest builds')
+  parser.add_argument('--dedupe', action='store_true',
+          help='hardlink identical files in the builds that are kept')
+  parser.add_argument('--min_size', type=int, default=1024 * 1024,
+          help='smallest file in bytes to deduplicate')
+  parser.add_argument('--dry_run', '-n', action='store_true',
+          help='only report what would be deleted and linked')
+  parser.add_argument('--jobs', '-j', type=int, default=0,
+          help='files to hash in parallel, 0 for one per cpu')
+  parser.add_argument('output_root',
+          help='directory containing image result directories')
+  options = parser.parse_args(argv[1:])
+
+  try:
+    policies = [ParsePolicy(p) for p in options.policy]
+  except ValueError as e:
+    parser.error(str(e))
+  policies.append(Policy('*', options.keep, options.max_age * DAY))
+
+  try:
+    Prune(options.output_root, options.board, policies, options.keep_latest,
+          options.dedupe, options.min_size, options.dry_run, options.jobs)
+  except StillMounted as e:
+    sys.stderr.write('ERROR: %s\n' % e)
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for prune_images."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import prune_images
+
+NOW = 1500000000
+DAY = prune_images.DAY
+
+
+class PruneImagesTest(unittest.TestCase):
+  """Test class for prune_images."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.board = os.path.join(self.tempdir, 'amd64-usr')
+    os.mkdir(self.board)
+    # Keep the Keeping/Deleting report out of the test output.
+    self._stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def tearDown(self):
+    sys.stdout.close()
+    sys.stdout = self._stdout
+    shutil.rmtree(self.tempdir)
+
+  def _Build(self, name, age_days, finished=True, data=b''):
+    """Creates a build directory finished age_days before NOW."""
+    path = os.path.join(self.board, name)
+    os.mkdir(path)
+    with open(os.path.join(path, 'image.bin'), 'wb') as f:
+      f.write(data)
+    mtime = NOW - age_days * DAY
+    if finished:
+      version_txt = os.path.join(path, 'version.txt')
+      open(version_txt, 'w').close()
+      os.utime(version_txt, (mtime, mtime))
+    os.utime(path, (mtime, mtime))
+
+  def _Latest(self, name):
+    os.symlink(name, os.path.join(self.board, prune_images.LATEST_LINK))
+
+  def _Select(self, policies, keep_latest=True):
+    builds, latest = prune_images.IndexBuilds(self.tempdir)
+    prune_images.SelectBuilds(builds, latest, policies, keep_latest, now=NOW)
+    return dict((b.name, b.keep_reason) for b in builds)
+
+  def testKeepLatest(self):
+    """Test that latest and finished builds newer than it are kept."""
+    self._Build('developer-3.0.0', 1)
+    self._Build('developer-2.0.0', 5)
+    self._Build('developer-1.0.0', 10)
+    self._Build('developer-4.0.0', 0, finished=False)
+    self._Latest('developer-2.0.0')
+    self.assertEqual(self._Select([prune_images.Policy('*', 0, 0)]), {
+        'developer-4.0.0': None,
+        'developer-3.0.0': 'newer than latest',
+        'developer-2.0.0': 'latest',
+        'developer-1.0.0': None,
+    })
+
+  def testNoKeepLatest(self):
+    """Test that without keep_latest only the policy applies."""
+    self._Build('developer-2.0.0', 5)
+    self._Build('developer-1.0.0', 10)
+    self._Latest('developer-2.0.0')
+    self.assertEqual(self._Select([prune_images.Policy('*', 0, 0)], False), {
+        'developer-2.0.0': None,
+        'developer-1.0.0': None,
+    })
+
+  def testNoLatestLink(self):
+    """Test that every finished build is kept if there is no latest."""
+    self._Build('developer-2.0.0', 5)
+    self._Build('developer-1.0.0', 10, finished=False)
+    self.assertEqual(self._Select([prune_images.Policy('*', 0, 0)]), {
+        'developer-2.0.0': 'newer than latest',
+        'developer-1.0.0': None,
+    })
+
+  def testPolicies(self):
+    """Test that the first matching policy applies to each channel."""
+    for version, age in (('3', 1), ('2', 5), ('1', 10)):
+      self._Build('alpha-%s.0.0' % version, age)
+      self._Build('developer-%s.0.0' % version, age)
+    self.assertEqual(self._Select([
+        prune_images.Policy('amd64-usr/alpha', 2, 0),
+        prune_images.Policy('*', 0, 3 * DAY),
+    ], keep_latest=False), {
+        'alpha-3.0.0': 'newest 2 in amd64-usr/alpha',
+        'alpha-2.0.0': 'newest 2 in amd64-usr/alpha',
+        'alpha-1.0.0': None,
+        'developer-3.0.0': 'younger than 3 days',
+        'developer-2.0.0': None,
+        'developer-1.0.0': None,
+    })
+
+  def testPrune(self):
+    """Test that only the latest link is removed with the build it named."""
+    self._Build('developer-2.0.0', 5, data=b'x' * 8192)
+    self._Build('developer-1.0.0', 10, data=b'x' * 8192)
+    self._Latest('developer-1.0.0')
+    os.symlink('missing', os.path.join(self.board, 'other'))
+    prune_images.Prune(self.tempdir, policies=[prune_images.Policy('*', 1, 0)],
+                       keep_latest=False)
+    self.assertEqual(sorted(os.listdir(self.board)),
+                     ['developer-2.0.0', 'other'])
+
+  def testPruneNoDedupeByDefault(self):
+    """Test that identical files are only linked when asked to."""
+    self._Build('developer-2.0.0', 5, data=b'x' * 8192)
+    self._Build('developer-1.0.0', 10, data=b'x' * 8192)
+    self._Latest('developer-1.0.0')
+    paths = [os.path.join(self.board, name, 'image.bin')
+             for name in ('developer-1.0.0', 'developer-2.0.0')]
+    prune_images.Prune(self.tempdir)
+    self.assertFalse(os.path.samefile(*paths))
+    prune_images.Prune(self.tempdir, dedupe=True)
+    self.assertTrue(os.path.samefile(*paths))
+
+  def testDeleteBuildStillMounted(self):
+    """Test that a build is not deleted if unmounting it fails."""
+    self._Build('developer-1.0.0', 10)
+    builds, _ = prune_images.IndexBuilds(self.tempdir)
+    calls = []
+    sub_mounts, call = prune_images.SubMounts, prune_images.subprocess.call
+    prune_images.SubMounts = lambda path: [os.path.join(path, 'rootfs')]
+    prune_images.subprocess.call = lambda cmd: calls.append(cmd) or 32
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+      self.assertRaises(prune_images.StillMounted,
+                        prune_images.DeleteBuild, builds[0])
+    finally:
+      sys.stderr.close()
+      sys.stderr = stderr
+      prune_images.SubMounts = sub_mounts
+      prune_images.subprocess.call = call
+    self.assertEqual(len(calls), 2)
+    self.assertTrue(os.path.isdir(builds[0].path))
+
+
+if __name__ == '__main__':
+  unittest.main()
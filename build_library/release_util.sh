@@ -17,6 +17,7 @@ unset _user
 
 IMAGE_ZIPPER="lbzip2 --compress --keep"
 IMAGE_ZIPEXT=".bz2"
+IMAGE_ZIPPATTERN='\.(img|bin|vdi|vhd|vmdk)$'
 
 DEFINE_boolean parallel ${FLAGS_TRUE} \
   "Enable parallelism in gsutil."
@@ -179,7 +180,7 @@ upload_image() {
         # digests is assigned after image is possibly compressed/renamed
     fi
 
-    local uploads=()
+    local uploads=() compressed=()
     local filename
     for filename in "$@"; do
         if [[ ! -f "${filename}" ]]; then
@@ -187,9 +188,8 @@ upload_image() {
         fi
 
         # Compress disk images
-        if [[ "${filename}" =~ \.(img|bin|vdi|vhd|vmdk)$ ]]; then
-            info "Compressing ${filename##*/}"
-            $IMAGE_ZIPPER -f "${filename}"
+        if [[ "${filename}" =~ ${IMAGE_ZIPPATTERN} ]]; then
+            compressed+=( "${filename##*/}" )
             uploads+=( "${filename}${IMAGE_ZIPEXT}" )
         else
             uploads+=( "${filename}" )
@@ -201,8 +201,15 @@ upload_image() {
     fi
 
     # For consistency generate a .DIGESTS file similar to the one catalyst
-    # produces for the SDK tarballs and up upload it too.
-    make_digests -d "${digests}" "${uploads[@]}"
+    # produces for the SDK tarballs and up upload it too.  Disk images are
+    # hashed as they are compressed rather than read back afterwards.
+    if [[ ${#compressed[@]} -gt 0 ]]; then
+        info "Compressing ${compressed[*]}"
+    fi
+    "${BUILD_LIBRARY_DIR}/digests.py" --types "${_digest_types}" \
+        compress --zipper "${IMAGE_ZIPPER}" --zipext "${IMAGE_ZIPEXT}" \
+        --pattern "${IMAGE_ZIPPATTERN}" -d "${digests}" "$@" \
+        || die "compressing and hashing images failed"
     uploads+=( "${digests}" )
 
     # Create signature as ...DIGESTS.asc as Gentoo does.
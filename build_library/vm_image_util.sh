@@ -78,6 +78,18 @@ VM_README=
 VM_NAME=
 VM_GROUP=
 
+# Set to a copy of VM_SRC_IMG already updated to the disk layout by
+# prepare_base_image to clone it instead of repeating the update.
+VM_BASE_IMG=
+
+# Set to a lock file to serialize OEM builds between concurrent formats.
+VM_OEM_LOCK=
+
+# Set at runtime to the directory OEM content is installed to. For
+# partitioned images it is staged outside the image and write_vm_disk
+# builds the OEM filesystem from it.
+VM_OEM_DIR=
+
 # Contains a list of all generated files
 VM_GENERATED_FILES=()
 
@@ -408,6 +420,26 @@ _disk_ext() {
     esac
 }
 
+# Formats with the same base image key can share one prepare_base_image.
+vm_base_image_key() {
+    local disk_layout="${1:-$(_get_vm_opt DISK_LAYOUT)}"
+    echo "${disk_layout}-$(_get_vm_opt PARTITIONED_IMG)"
+}
+
+# Copy the source image and update it to the disk layout, this is the
+# part of setup_disk_image that does not depend on anything format specific.
+prepare_base_image() {
+    local disk_layout="${1:-$(_get_vm_opt DISK_LAYOUT)}"
+    local base_img="$2"
+
+    cp --sparse=always "${VM_SRC_IMG}" "${base_img}"
+
+    if [[ $(_get_vm_opt PARTITIONED_IMG) -eq 1 ]]; then
+      "${BUILD_LIBRARY_DIR}/disk_util" --disk_layout="${disk_layout}" \
+          update "${base_img}"
+    fi
+}
+
 setup_disk_image() {
     local disk_layout="${1:-$(_get_vm_opt DISK_LAYOUT)}"
 
@@ -415,11 +447,12 @@ setup_disk_image() {
     mkdir -p "${VM_TMP_DIR}" "${VM_TMP_ROOT}"
 
     info "Initializing new disk image..."
-    cp --sparse=always "${VM_SRC_IMG}" "${VM_TMP_IMG}"
-
-    if [[ $(_get_vm_opt PARTITIONED_IMG) -eq 1 ]]; then
-      "${BUILD_LIBRARY_DIR}/disk_util" --disk_layout="${disk_layout}" \
-          update "${VM_TMP_IMG}"
+    if [[ -n "${VM_BASE_IMG}" ]]; then
+        # A reflink clone is nearly free on btrfs and xfs, anywhere else
+        # this falls back to the same sparse copy as prepare_base_image.
+        cp --reflink=auto --sparse=always "${VM_BASE_IMG}" "${VM_TMP_IMG}"
+    else
+        prepare_base_image "${disk_layout}" "${VM_TMP_IMG}"
     fi
 
     assert_image_size "${VM_TMP_IMG}" raw
@@ -444,6 +477,15 @@ setup_disk_image() {
     if [[ -z "${VM_GROUP}" ]]; then
         die "Unable to determine update group for this image."
     fi
+
+    if [[ $(_get_vm_opt PARTITIONED_IMG) -eq 1 ]]; then
+        # Start from whatever the source image already has in OEM.
+        VM_OEM_DIR="${VM_TMP_DIR}/oem_root"
+        sudo cp -a "${VM_TMP_ROOT}/usr/share/oem" "${VM_OEM_DIR}"
+        sudo rm -rf "${VM_OEM_DIR}/lost+found"
+    else
+        VM_OEM_DIR="${VM_TMP_ROOT}/usr/share/oem"
+    fi
 }
 
 # If the current type defines a oem package install it to the given fs image.
@@ -456,6 +498,14 @@ install_oem_package() {
         return 0
     fi
 
+    # Formats built concurrently may want the same package with different
+    # USE flags so building and installing it must not be interleaved.
+    local lock_fd
+    if [[ -n "${VM_OEM_LOCK}" ]]; then
+        exec {lock_fd}>>"${VM_OEM_LOCK}"
+        flock "${lock_fd}"
+    fi
+
     # Split into two steps because we want to always install $oem_pkg from
     # the ebuild (build_packages doesn't handle it) *but* we never want to
     # build anything else from source here. emerge doesn't have a way to
@@ -475,7 +525,12 @@ install_oem_package() {
         --root="${oem_tmp}" --sysroot="${oem_tmp}" \
         --root-deps=rdeps --usepkgonly ${getbinpkg} \
         --quiet --jobs=2 "${oem_pkg}"
-    sudo rsync -a "${oem_tmp}/usr/share/oem/" "${VM_TMP_ROOT}/usr/share/oem/"
+
+    if [[ -n "${lock_fd}" ]]; then
+        exec {lock_fd}>&-
+    fi
+
+    sudo rsync -a "${oem_tmp}/usr/share/oem/" "${VM_OEM_DIR}/"
     sudo rm -rf "${oem_tmp}"
 }
 
@@ -491,6 +546,13 @@ install_oem_aci() {
     [ "${FLAGS_getbinpkg}" = "${FLAGS_TRUE}" ] &&
     binpkgflags=(--getbinpkg --getbinpkgver="${FLAGS_getbinpkgver}")
 
+    # Don't let concurrent formats build the same ACI at once.
+    local lock_fd
+    if [[ -n "${VM_OEM_LOCK}" ]]; then
+        exec {lock_fd}>>"${VM_OEM_LOCK}"
+        flock "${lock_fd}"
+    fi
+
     # Build an OEM ACI if necessary, supplying build environment flags.
     [ -e "${aci_path}" ] &&
     info "ACI ${aci_path} exists; reusing it" ||
@@ -500,10 +562,14 @@ install_oem_aci() {
         "${binpkgflags[@]}" \
         "${oem_aci}"
 
+    if [[ -n "${lock_fd}" ]]; then
+        exec {lock_fd}>&-
+    fi
+
     info "Installing ${oem_aci} OEM ACI"
     sudo install -Dpm 0644 \
         "${aci_path}" \
-        "${VM_TMP_ROOT}/usr/share/oem/coreos-oem-${oem_aci}.aci" ||
+        "${VM_OEM_DIR}/coreos-oem-${oem_aci}.aci" ||
     die "Could not install ${oem_aci} OEM ACI"
 }
 
@@ -519,15 +585,27 @@ run_fs_hook() {
 _run_box_fs_hook() {
     # Copy basic Vagrant configs from OEM
     mkdir -p "${VM_TMP_DIR}/box"
-    cp -R "${VM_TMP_ROOT}/usr/share/oem/box/." "${VM_TMP_DIR}/box"
-    sudo rm -fr "${VM_TMP_ROOT}/usr/share/oem/box"
+    cp -R "${VM_OEM_DIR}/box/." "${VM_TMP_DIR}/box"
+    sudo rm -fr "${VM_OEM_DIR}/box"
 }
 
 # Write the vm disk image to the target directory in the proper format
 write_vm_disk() {
+    local disk_layout="${1:-$(_get_vm_opt DISK_LAYOUT)}"
+
     if [[ $(_get_vm_opt PARTITIONED_IMG) -eq 1 ]]; then
         # unmount before creating block device images
         cleanup_mounts "${VM_TMP_ROOT}"
+
+        # Write the staged OEM content as a new filesystem in one pass
+        # instead of copying it file by file into the mounted partition.
+        "${BUILD_LIBRARY_DIR}/disk_util" --disk_layout="${disk_layout}" \
+            populate "${VM_TMP_IMG}" OEM "${VM_OEM_DIR}"
+
+        # Drop blocks freed by the OEM install and fs hooks so they are not
+        # carried through every conversion, compression and upload.
+        "${BUILD_LIBRARY_DIR}/disk_util" --disk_layout="${disk_layout}" \
+            sparsify "${VM_TMP_IMG}"
     fi
 
     local disk_format=$(_get_vm_opt DISK_FORMAT)
@@ -600,7 +678,7 @@ _write_cpio_common() {
     # Build the squashfs, embed squashfs into a gzipped cpio
     pushd "${cpio_target}" >/dev/null
     sudo mksquashfs "${base_dir}" "./usr.squashfs" -pf "${VM_TMP_DIR}/extra"
-    find . | cpio -o -H newc | gzip > "$2"
+    "${BUILD_LIBRARY_DIR}/write_cpio.py" . "$2"
     popd >/dev/null
 
 }
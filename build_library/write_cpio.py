@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Write a directory tree as a gzipped newc cpio archive for an initramfs.
+
+Replaces find | cpio -o -H newc | gzip.  The archive is written directly
+from the tree in sorted order with inode numbers, link counts and mtimes
+that do not depend on the filesystem or when it was built, so the same
+tree always gives the same archive.
+
+The archive is compressed in fixed size blocks on several threads.  Each
+block is flushed to a byte boundary and the blocks are concatenated into
+one gzip stream, the same technique pigz uses, which any gzip reader
+including the kernel can decompress.  zlib releases the GIL while
+compressing so threads are enough to use several cores.  The output only
+depends on the block size, not on the number of threads.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import multiprocessing.pool
+import os
+import stat
+import struct
+import sys
+import zlib
+
+import digests
+import parallel
+
+BLOCK_SIZE = 1024 * 1024
+# Blocks to keep in flight per thread, bounds the memory used.
+BLOCKS_PER_JOB = 2
+TRAILER = b'TRAILER!!!'
+# Gzip header without a name and with a zero mtime, for unix.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03'
+
+
+def _Encode(name):
+  """Returns a file name as bytes."""
+  if isinstance(name, bytes):
+    return name
+  return os.fsencode(name)
+
+
+def CompressBlock(data, level, last):
+  """Compresses one block as raw deflate data ending on a byte boundary."""
+  compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  if last:
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+  return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzip(object):
+  """A write-only file object that gzips its input on a thread pool."""
+
+  def __init__(self, out, jobs=None, level=6, block_size=BLOCK_SIZE):
+    """Starts a gzip stream.
+
+    Args:
+      out: file object to write the compressed stream to
+      jobs: number of threads, defaults to the number of CPUs
+      level: zlib compression level
+      block_size: bytes of input to compress in each block
+    """
+    if not jobs:
+      jobs = multiprocessing.cpu_count()
+    self._out = out
+    self._level = level
+    self._block_size = block_size
+    self._max_pending = jobs * BLOCKS_PER_JOB
+    self._pool = multiprocessing.pool.ThreadPool(jobs)
+    self._pending = collections.deque()
+    self._buffer = []
+    self._buffered = 0
+    self._crc = 0
+    self._size = 0
+    self._out.write(GZIP_HEADER)
+
+  def write(self, data):
+    self._crc = zlib.crc32(data, self._crc)
+    self._size += len(data)
+    self._buffer.append(data)
+    self._buffered += len(data)
+    # Hold back a full block until more data arrives, the final block
+    # has to be compressed differently.
+    if self._buffered > self._block_size:
+      data = b''.join(self._buffer)
+      offset = 0
+      while len(data) - offset > self._block_size:
+        self._Submit(data[offset:offset + self._block_size], False)
+        offset += self._block_size
+      self._buffer = [data[offset:]]
+      self._buffered = len(self._buffer[0])
+
+  def _Submit(self, data, last):
+    self._pending.append(self._pool.apply_async(
+        CompressBlock, (data, self._level, last)))
+    while len(self._pending) > (0 if last else self._max_pending):
+      self._out.write(self._pending.popleft().get(parallel.WAIT_TIMEOUT))
+
+  def close(self):
+    """Finishes the stream, the output file is left open."""
+    if self._pool is None:
+      return
+    try:
+      self._Submit(b''.join(self._buffer), True)
+      self._out.write(struct.pack('<II', self._crc & 0xffffffff,
+                                  self._size & 0xffffffff))
+    finally:
+      self._pool.terminate()
+      self._pool = None
+
+
+def Walk(root):
+  """Walks a tree in sorted order, directories before their contents.
+
+  Yields:
+    (path relative to root, lstat result) tuples, starting with
+    ('', lstat(root)).
+  """
+  yield '', os.lstat(root)
+  stack = ['']
+  while stack:
+    rel = stack.pop()
+    subdirs = []
+    for name in sorted(os.listdir(os.path.join(root, rel))):
+      path = os.path.join(rel, name)
+      st = os.lstat(os.path.join(root, path))
+      yield path, st
+      if stat.S_ISDIR(st.st_mode):
+        subdirs.append(path)
+    # Visit subdirectories after all entries of their parent, in order.
+    stack.extend(reversed(subdirs))
+
+
+def _Header(ino, mode, uid, gid, nlink, mtime, size, rdev, name):
+  name += b'\0'
+  header = b'070701' + b''.join(b'%08x' % v for v in (
+      ino, mode, uid, gid, nlink, mtime, size, 0, 0,
+      os.major(rdev), os.minor(rdev), len(name), 0))
+  return header + name + b'\0' * (-(len(header) + len(name)) % 4)
+
+
+def WriteCpio(root, out, mtime=0):
+  """Writes a newc cpio archive of a directory tree.
+
+  Names are relative to the root and prefixed with ./ like find prints
+  them.  Hardlinked files share an inode number and only the first one
+  holds the data, the way the kernel's initramfs unpacker expects.
+
+  Args:
+    root: directory to archive
+    out: file object to write the archive to
+    mtime: modification time recorded for every entry
+  """
+  entries = list(Walk(root))
+
+  # Count links and subdirectories inside the archive only.
+  nlinks = collections.Counter()
+  for path, st in entries:
+    if stat.S_ISDIR(st.st_mode):
+      nlinks[path] = 2
+      if path:
+        nlinks[os.path.dirname(path)] += 1
+    else:
+      nlinks[(st.st_dev, st.st_ino)] += 1
+
+  inodes = {}
+  for path, st in entries:
+    name = _Encode(os.path.join('.', path) if path else '.')
+    full = os.path.join(root, path)
+    data = None
+    if stat.S_ISDIR(st.st_mode):
+      ino = len(inodes) + 1
+      inodes[path] = ino
+      nlink = nlinks[path]
+      size = 0
+    else:
+      key = (st.st_dev, st.st_ino)
+      nlink = nlinks[key]
+      if key in inodes:
+        ino, size = inodes[key], 0
+      else:
+        ino = inodes[key] = len(inodes) + 1
+        size = st.st_size
+        if stat.S_ISLNK(st.st_mode):
+          data = _Encode(os.readlink(full))
+          size = len(data)
+        elif not stat.S_ISREG(st.st_mode):
+          size = 0
+
+    rdev = st.st_rdev if (stat.S_ISCHR(st.st_mode) or
+                          stat.S_ISBLK(st.st_mode)) else 0
+    out.write(_Header(ino, st.st_mode, st.st_uid, st.st_gid, nlink, mtime,
+                      size, rdev, name))
+
+    if data is not None:
+      out.write(data)
+    elif size:
+      written = 0
+      with open(full, 'rb') as f:
+        for chunk in iter(lambda: f.read(digests.CHUNK_SIZE), b''):
+          written += len(chunk)
+          if written > size:
+            break
+          out.write(chunk)
+      if written != size:
+        raise IOError('%s changed size while being archived' % full)
+    out.write(b'\0' * (-size % 4))
+
+  out.write(_Header(0, 0, 0, 0, 1, 0, 0, 0, TRAILER))
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__,
+          formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--jobs', '-j', type=int, default=0,
+          help='number of threads to compress with, 0 for one per cpu')
+  parser.add_argument('--level', type=int, default=6,
+          help='gzip compression level')
+  parser.add_argument('--mtime', type=int, default=0,
+          help='modification time to record for every file')
+  parser.add_argument('root', help='directory to archive')
+  parser.add_argument('output', help='path to write the gzipped archive to')
+  options = parser.parse_args(argv[1:])
+
+  try:
+    with open(options.output, 'wb') as f:
+      gz = ParallelGzip(f, options.jobs, options.level)
+      try:
+        WriteCpio(options.root, gz, options.mtime)
+      finally:
+        gz.close()
+  except BaseException:
+    if os.path.exists(options.output):
+      os.unlink(options.output)
+    raise
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
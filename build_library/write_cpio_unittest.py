@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# Copyright (c) 2018 The CoreOS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for write_cpio."""
+
+import gzip
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import write_cpio
+
+FIELDS = ('ino', 'mode', 'uid', 'gid', 'nlink', 'mtime', 'size', 'devmajor',
+          'devminor', 'rdevmajor', 'rdevminor', 'namesize', 'check')
+
+
+def ReadCpio(archive):
+  """Parses a newc archive into a list of (name, header dict, data)."""
+  entries = []
+  offset = 0
+  while True:
+    magic = archive[offset:offset + 6]
+    if magic != b'070701':
+      raise ValueError('bad magic %r at %d' % (magic, offset))
+    values = archive[offset + 6:offset + 110]
+    header = dict((field, int(values[i * 8:i * 8 + 8], 16))
+                  for i, field in enumerate(FIELDS))
+    offset += 110
+    name = archive[offset:offset + header['namesize']]
+    if not name.endswith(b'\0'):
+      raise ValueError('name %r is not terminated' % name)
+    name = name[:-1]
+    offset += header['namesize']
+    offset += -offset % 4
+    data = archive[offset:offset + header['size']]
+    offset += header['size']
+    offset += -offset % 4
+    entries.append((name, header, data))
+    if name == write_cpio.TRAILER:
+      if offset != len(archive):
+        raise ValueError('%d bytes after the trailer' % (len(archive) - offset))
+      return entries
+
+
+class WriteCpioTest(unittest.TestCase):
+  """Test class for WriteCpio."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.root = os.path.join(self.tempdir, 'root')
+    for d in ('usr/bin', 'usr/lib', 'etc'):
+      os.makedirs(os.path.join(self.root, d))
+    for name, data in (('init', b'#!/bin/sh\n'),
+                       ('etc/empty', b''),
+                       ('usr/bin/tool', b'tool' * 1001)):
+      with open(os.path.join(self.root, name), 'wb') as f:
+        f.write(data)
+    os.chmod(os.path.join(self.root, 'init'), 0o755)
+    os.link(os.path.join(self.root, 'usr/bin/tool'),
+            os.path.join(self.root, 'usr/lib/tool'))
+    os.symlink('usr/lib', os.path.join(self.root, 'lib'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Archive(self, mtime=0):
+    out = io.BytesIO()
+    write_cpio.WriteCpio(self.root, out, mtime)
+    return out.getvalue()
+
+  def testWalk(self):
+    """Test that directories come before their contents, in sorted order."""
+    self.assertEqual([path for path, _ in write_cpio.Walk(self.root)], [
+        '', 'etc', 'init', 'lib', 'usr', 'etc/empty', 'usr/bin', 'usr/lib',
+        'usr/bin/tool', 'usr/lib/tool'])
+
+  def testHeaders(self):
+    """Test the names, modes, sizes and data of each entry."""
+    entries = ReadCpio(self._Archive(mtime=1234))
+    names = [name for name, _, _ in entries]
+    self.assertEqual(names, [
+        b'.', b'./etc', b'./init', b'./lib', b'./usr', b'./etc/empty',
+        b'./usr/bin', b'./usr/lib', b'./usr/bin/tool', b'./usr/lib/tool',
+        write_cpio.TRAILER])
+    by_name = dict((name, (header, data)) for name, header, data in entries)
+
+    header, data = by_name[b'./init']
+    st = os.lstat(os.path.join(self.root, 'init'))
+    self.assertEqual(header['mode'], stat.S_IFREG | 0o755)
+    self.assertEqual((header['uid'], header['gid']), (st.st_uid, st.st_gid))
+    self.assertEqual(header['mtime'], 1234)
+    self.assertEqual(header['nlink'], 1)
+    self.assertEqual(data, b'#!/bin/sh\n')
+
+    header, data = by_name[b'./lib']
+    self.assertTrue(stat.S_ISLNK(header['mode']))
+    self.assertEqual(data, b'usr/lib')
+
+    header, data = by_name[b'./etc/empty']
+    self.assertEqual((header['size'], data), (0, b''))
+
+    # Directory link counts only include what is in the archive.
+    self.assertEqual(by_name[b'.'][0]['nlink'], 4)
+    self.assertEqual(by_name[b'./usr'][0]['nlink'], 4)
+    self.assertTrue(stat.S_ISDIR(by_name[b'./usr'][0]['mode']))
+
+    inodes = [header['ino'] for name, header, _ in entries[:-1]]
+    self.assertEqual(inodes[:9], list(range(1, 10)))
+    self.assertEqual(entries[-1][1]['ino'], 0)
+
+  def testHardlinks(self):
+    """Test that hardlinks share an inode and only the first holds data."""
+    by_name = dict((name, (header, data))
+                   for name, header, data in ReadCpio(self._Archive()))
+    first, first_data = by_name[b'./usr/bin/tool']
+    second, second_data = by_name[b'./usr/lib/tool']
+    self.assertEqual(first['ino'], second['ino'])
+    self.assertEqual((first['nlink'], second['nlink']), (2, 2))
+    self.assertEqual(first_data, b'tool' * 1001)
+    self.assertEqual((second['size'], second_data), (0, b''))
+
+  def testDeterministic(self):
+    """Test that the archive does not depend on inodes or timestamps."""
+    archive = self._Archive()
+    copy = os.path.join(self.tempdir, 'copy')
+    shutil.copytree(self.root, copy, symlinks=True)
+    # copytree does not preserve hardlinks.
+    os.unlink(os.path.join(copy, 'usr/lib/tool'))
+    os.link(os.path.join(copy, 'usr/bin/tool'),
+            os.path.join(copy, 'usr/lib/tool'))
+    os.utime(os.path.join(copy, 'init'), (1, 1))
+    out = io.BytesIO()
+    write_cpio.WriteCpio(copy, out)
+    self.assertEqual(out.getvalue(), archive)
+
+  def testChangedSize(self):
+    """Test that a file growing while it is archived is an error."""
+    out = io.BytesIO()
+    walk = write_cpio.Walk
+
+    def _Walk(root):
+      for path, st in walk(root):
+        if path == 'init':
+          with open(os.path.join(root, path), 'ab') as f:
+            f.write(b'more')
+        yield path, st
+
+    write_cpio.Walk = _Walk
+    try:
+      self.assertRaises(IOError, write_cpio.WriteCpio, self.root, out)
+    finally:
+      write_cpio.Walk = walk
+
+
+def _Gunzip(data):
+  with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+    return f.read()
+
+
+class ParallelGzipTest(unittest.TestCase):
+  """Test class for ParallelGzip."""
+
+  def _Compress(self, chunks, jobs, block_size=4096):
+    out = io.BytesIO()
+    gz = write_cpio.ParallelGzip(out, jobs, block_size=block_size)
+    for chunk in chunks:
+      gz.write(chunk)
+    gz.close()
+    return out.getvalue()
+
+  def testRoundTrip(self):
+    """Test that gzip decompresses the stream, block sized input or not."""
+    data = os.urandom(10000) + b'\0' * 30000 + b'cpio' * 5000
+    for chunks in ([data], [data[i:i + 1000] for i in range(0, len(data), 1000)],
+                   [data[:8192], data[8192:]], [b''], []):
+      compressed = self._Compress(chunks, jobs=3)
+      self.assertEqual(_Gunzip(compressed), b''.join(chunks))
+
+  def testDeterministic(self):
+    """Test that the output only depends on the block size."""
+    data = b''.join(b'%d\n' % i for i in range(20000))
+    one = self._Compress([data], jobs=1)
+    self.assertEqual(self._Compress([data[:777], data[777:]], jobs=4), one)
+    self.assertNotEqual(self._Compress([data], jobs=1, block_size=8192), one)
+
+  def testMain(self):
+    """Test that main writes an archive which gzip and ReadCpio accept."""
+    tempdir = tempfile.mkdtemp()
+    try:
+      root = os.path.join(tempdir, 'root')
+      os.mkdir(root)
+      with open(os.path.join(root, 'init'), 'wb') as f:
+        f.write(b'#!/bin/sh\n')
+      output = os.path.join(tempdir, 'cpio.gz')
+      self.assertEqual(write_cpio.main(['write_cpio.py', '-j', '2', root,
+                                        output]), 0)
+      with gzip.open(output) as f:
+        names = [name for name, _, _ in ReadCpio(f.read())]
+      self.assertEqual(names, [b'.', b'./init', write_cpio.TRAILER])
+    finally:
+      shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+  unittest.main()
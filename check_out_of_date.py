@@ -11,6 +11,8 @@ import sys
 
 import portage.versions
 
+import overlay_index
+
 
 def split_package(p):
     # split into cat/package,ver-rev
@@ -43,15 +45,9 @@ def exec_command(cmd):
 
 
 def get_portage_tree_packages(tree_path):
-    """ returns a list of all packages in a portage tree/overlay in the form of cat/pkg-ver"""
-    pkgs = exec_command_strict("find -L {} -maxdepth 3 -type f -name *.ebuild -not -name skel.ebuild -printf %P\\n".format(tree_path))
-
-    def process_line(line):
-        # cat/pkg/pkg-ver.ebuild -> cat/pkg-ver
-        chunks = line.split("/")
-        end = chunks[2].replace(".ebuild", "")
-        return chunks[0] + "/" + end
-    return build_pkg_map(map(process_line, pkgs.splitlines()))
+    """ returns a map of cat/pkg to versions of all packages in a portage tree/overlay"""
+    index = overlay_index.OverlayIndex([tree_path])
+    return build_pkg_map(index.cpvs(tree_path))
 
 
 def process_emerge_output(eout):
@@ -653,6 +653,7 @@ get_git_id() {
 
 # Generate a DIGESTS file, as normally used by Gentoo.
 # This is an alternative to shash which doesn't know how to report errors.
+# Each file is read once for all hash types, see build_library/digests.py.
 # Usage: make_digests -d file.DIGESTS file1 [file2...]
 _digest_types="md5 sha1 sha512"
 make_digests() {
@@ -660,46 +661,27 @@ make_digests() {
     local digests="$(readlink -f "$2")"
     shift 2
 
-    pushd "$(dirname "$1")" >/dev/null
-    echo -n > "${digests}"
-    for filename in "$@"; do
-        filename=$(basename "$filename")
-        info "Computing DIGESTS for ${filename}"
-        for hash_type in $_digest_types; do
-            echo "# $hash_type HASH" | tr "a-z" "A-Z" >> "${digests}"
-            ${hash_type}sum "${filename}" >> "${digests}"
-        done
-    done
-    popd >/dev/null
+    info "Computing DIGESTS for ${*##*/}"
+    "${BUILD_LIBRARY_DIR}/digests.py" --types "${_digest_types}" \
+        make -d "${digests}" "$@"
 }
 
 # Validate a DIGESTS file. Essentially the inverse of make_digests.
 # Usage: verify_digests [-d file.DIGESTS] file1 [file2...]
 # If -d is not specified file1.DIGESTS will be used
 verify_digests() {
-    local digests filename hash_type status
+    local digests
     if [[ "$1" == "-d" ]]; then
         [[ -n "$2" ]] || die "-d requires an argument"
         digests="$(readlink -f "$2")"
         shift 2
     else
-        digests=$(basename "${1}.DIGESTS")
+        digests="${1}.DIGESTS"
     fi
 
-    pushd "$(dirname "$1")" >/dev/null
-    for filename in "$@"; do
-        filename=$(basename "$filename")
-        info "Validating DIGESTS for ${filename}"
-        for hash_type in $_digest_types; do
-            grep -A1 -i "^# ${hash_type} HASH$" "${digests}" | \
-                grep "$filename$" | ${hash_type}sum -c - --strict || return 1
-            # Also check that none of the greps failed in the above pipeline
-            for status in ${PIPESTATUS[@]}; do
-                [[ $status -eq 0 ]] || return 1
-            done
-        done
-    done
-    popd >/dev/null
+    info "Validating DIGESTS for ${*##*/}"
+    "${BUILD_LIBRARY_DIR}/digests.py" --types "${_digest_types}" \
+        verify -d "${digests}" "$@"
 }
 
 # Get current timestamp. Assumes common.sh runs at startup.
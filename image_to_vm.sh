@@ -29,7 +29,7 @@ DEFINE_string board "${DEFAULT_BOARD}" \
 # We default to TRUE so the buildbot gets its image. Note this is different
 # behavior from image_to_usb.sh
 DEFINE_string format "" \
-  "Output format, one of: ${VALID_IMG_TYPES[*]}"
+  "Output format, one or more of: ${VALID_IMG_TYPES[*]}"
 DEFINE_string from "" \
   "Directory containing coreos_production_image.bin."
 DEFINE_string disk_layout "" \
@@ -44,6 +44,8 @@ DEFINE_boolean getbinpkg "${FLAGS_FALSE}" \
   "Download binary packages from remote repository."
 DEFINE_string getbinpkgver "" \
   "Use binary packages from a specific version."
+DEFINE_integer jobs "${NUM_JOBS}" \
+  "Number of formats to build at once when given more than one."
 
 # include upload options
 . "${BUILD_LIBRARY_DIR}/release_util.sh" || exit 1
@@ -61,9 +63,22 @@ if [[ -z "${FLAGS_format}" ]]; then
     FLAGS_format="$(get_default_vm_type ${FLAGS_board})"
 fi
 
-if ! set_vm_type "${FLAGS_format}"; then
-    die_notrace "Invalid format: ${FLAGS_format}"
-fi
+# Multiple formats may be separated by commas or spaces.  Each is built
+# once, a repeated format would have two builds writing the same files.
+read -ra formats <<<"${FLAGS_format//,/ }"
+FORMATS=()
+declare -A SEEN_FORMATS
+for format in "${formats[@]}"; do
+    if [[ -n "${SEEN_FORMATS[${format}]}" ]]; then
+        warn "Ignoring repeated format: ${format}"
+        continue
+    fi
+    if ! set_vm_type "${format}"; then
+        die_notrace "Invalid format: ${format}"
+    fi
+    SEEN_FORMATS[${format}]=1
+    FORMATS+=( "${format}" )
+done
 
 if [ ! -z "${FLAGS_oem_pkg}" ] && ! set_vm_oem_pkg "${FLAGS_oem_pkg}"; then
   die_notrace "Invalid oem : ${FLAGS_oem_pkg}"
@@ -105,33 +120,114 @@ if [ -f "${FLAGS_from}/version.txt" ]; then
     COREOS_VERSION_STRING="${COREOS_VERSION}"
 fi
 
-set_vm_paths "${FLAGS_from}" "${FLAGS_to}" "${COREOS_PRODUCTION_IMAGE_NAME}"
+fix_mtab
+
+# Build and upload a single format, VM_IMG_TYPE must already be set.
+build_vm() {
+    set_vm_paths "${FLAGS_from}" "${FLAGS_to}" "${COREOS_PRODUCTION_IMAGE_NAME}"
 
-# Make sure things are cleaned up on failure
-trap vm_cleanup EXIT
+    # Make sure things are cleaned up on failure
+    trap vm_cleanup EXIT
 
-fix_mtab
+    # Setup new (raw) image, possibly resizing filesystems
+    setup_disk_image "${FLAGS_disk_layout}"
 
-# Setup new (raw) image, possibly resizing filesystems
-setup_disk_image "${FLAGS_disk_layout}"
+    # Optionally install any OEM packages
+    install_oem_package
+    install_oem_aci
+    run_fs_hook
 
-# Optionally install any OEM packages
-install_oem_package
-install_oem_aci
-run_fs_hook
+    # Changes done, glue it together
+    write_vm_disk "${FLAGS_disk_layout}"
+    write_vm_conf "${FLAGS_mem}"
+    write_vm_bundle
 
-# Changes done, glue it together
-write_vm_disk
-write_vm_conf "${FLAGS_mem}"
-write_vm_bundle
+    vm_cleanup
+    trap - EXIT
 
-vm_cleanup
-trap - EXIT
+    # Optionally upload all of our hard work
+    vm_upload
+}
 
-# Optionally upload all of our hard work
-vm_upload
+if [[ ${#FORMATS[@]} -eq 1 ]]; then
+    build_vm
+
+    # Ready to set sail!
+    okboat
+    command_completed
+    print_readme
+    exit 0
+fi
+
+# Multiple formats: copy and update the source image once per disk layout,
+# then build each format from a copy-on-write clone of it concurrently.
+BASE_DIR="${FLAGS_to}/${COREOS_PRODUCTION_IMAGE_NAME%.bin}.vmbase"
+rm -rf "${BASE_DIR}"
+mkdir -p "${BASE_DIR}"
+
+# Stop any format still building before removing the base images it may
+# be reading.  Each format runs in its own process group so that the
+# commands it is running are stopped too.
+cleanup_formats() {
+    local pid
+    for pid in $(jobs -p); do
+        kill -TERM -- "-${pid}" 2>/dev/null || true
+    done
+    wait || true
+    rm -rf "${BASE_DIR}"
+}
+trap cleanup_formats EXIT
+
+declare -A BASE_IMGS
+for format in "${FORMATS[@]}"; do
+    set_vm_type "${format}"
+    set_vm_paths "${FLAGS_from}" "${FLAGS_to}" "${COREOS_PRODUCTION_IMAGE_NAME}"
+    key=$(vm_base_image_key "${FLAGS_disk_layout}")
+    if [[ -z "${BASE_IMGS[${key}]}" ]]; then
+        info "Preparing ${key} base image"
+        BASE_IMGS[${key}]="${BASE_DIR}/${key}.bin"
+        prepare_base_image "${FLAGS_disk_layout}" "${BASE_IMGS[${key}]}"
+    fi
+done
+
+VM_OEM_LOCK="${BASE_DIR}/oem.lock"
+declare -A PIDS LOGS
+set -m
+for format in "${FORMATS[@]}"; do
+    while [[ $(jobs -rp | wc -l) -ge ${FLAGS_jobs} ]]; do
+        wait -n || true
+    done
+
+    set_vm_type "${format}"
+    LOGS[${format}]="${FLAGS_to}/$(_src_to_dst_name \
+        "${COREOS_PRODUCTION_IMAGE_NAME}" ".log")"
+    info "Building ${format}, logging to $(relpath "${LOGS[${format}]}")"
+    (
+        # Run the vm_cleanup EXIT trap when stopped so nothing stays mounted.
+        trap 'exit 143' TERM
+        VM_BASE_IMG="${BASE_IMGS[$(vm_base_image_key "${FLAGS_disk_layout}")]}"
+        build_vm
+        print_readme
+    ) &>"${LOGS[${format}]}" &
+    PIDS[${format}]=$!
+done
+
+FAILED=()
+for format in "${FORMATS[@]}"; do
+    if wait "${PIDS[${format}]}"; then
+        info "Built ${format}"
+    else
+        error "Building ${format} failed, last lines of its log:"
+        tail -n 20 "${LOGS[${format}]}" >&2
+        FAILED+=( "${format}" )
+    fi
+done
+set +m
+
+if [[ ${#FAILED[@]} -ne 0 ]]; then
+    die_notrace "Failed to build formats: ${FAILED[*]}"
+fi
 
 # Ready to set sail!
 okboat
 command_completed
-print_readme
@@ -4,13 +4,29 @@
 
 """Common python commands used by various build scripts."""
 
-import inspect
+import base64
+import errno
+import fcntl
+import json
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 _STDOUT_IS_TTY = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
 
+# Set to a path to record every command run through this module, see
+# EnableTelemetry() for the supported formats.
+TELEMETRY_FILE_ENV = 'CROS_BUILD_TELEMETRY'
+TELEMETRY_FORMAT_ENV = 'CROS_BUILD_TELEMETRY_FORMAT'
+TELEMETRY_FORMATS = ('jsonl', 'chrome')
+
+_caller_name = None
+_telemetry = None
+
 # TODO(sosa):  Move logging to logging module.
 
 class RunCommandException(Exception):
@@ -19,15 +35,148 @@ class RunCommandException(Exception):
 
 
 def _GetCallerName():
-  """Returns the name of the calling module with __main__."""
-  top_frame = inspect.stack()[-1][0]
-  return os.path.basename(top_frame.f_code.co_filename)
+  """Returns the name of the calling module with __main__.
+
+  The outermost frame is found by following f_back instead of using
+  inspect.stack(), which reads source context for every frame, and the
+  result is cached since it cannot change for the life of the process.
+  """
+  global _caller_name
+  if _caller_name is None:
+    frame = sys._getframe()
+    while frame.f_back:
+      frame = frame.f_back
+    _caller_name = os.path.basename(frame.f_code.co_filename)
+  return _caller_name
+
+
+class _RusagePopen(subprocess.Popen):
+  """Popen that reaps its child with wait4() to keep its resource usage."""
+  rusage = None
+
+  def wait(self, *args, **kwargs):
+    while self.returncode is None:
+      try:
+        pid, sts, rusage = os.wait4(self.pid, 0)
+      except OSError as e:
+        if e.errno == errno.EINTR:
+          continue
+        if e.errno != errno.ECHILD:
+          raise
+        pid, sts, rusage = self.pid, 0, None
+      if pid == self.pid:
+        self.rusage = rusage
+        self._handle_exitstatus(sts)
+    return self.returncode
+
+
+class _Telemetry(object):
+  """Appends one record per command to a JSON Lines or Chrome trace file.
+
+  Chrome trace files use the JSON Array Format, which allows the closing
+  bracket to be left off so several processes can append to the same file
+  and it can still be loaded into chrome://tracing or Perfetto.
+  """
+
+  def __init__(self, path, fmt):
+    if fmt not in TELEMETRY_FORMATS:
+      raise ValueError('Unknown telemetry format %r' % fmt)
+    self.path = path
+    self.fmt = fmt
+
+  def Record(self, record):
+    if self.fmt == 'chrome':
+      data = json.dumps({
+          'name': os.path.basename(str(record['argv'][0])),
+          'cat': record['program'],
+          'ph': 'X',
+          'ts': int(record['start'] * 1e6),
+          'dur': int(record['wall_secs'] * 1e6),
+          'pid': record['pid'],
+          'tid': record['pid'],
+          'args': record,
+      }) + ',\n'
+    else:
+      data = json.dumps(record) + '\n'
+
+    with open(self.path, 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        f.seek(0, os.SEEK_END)
+        if self.fmt == 'chrome' and f.tell() == 0:
+          data = '[\n' + data
+        f.write(data)
+      finally:
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def EnableTelemetry(path, fmt=None):
+  """Records every command run through this module to a file.
+
+  Each record holds the argv, cwd, wall and CPU time, peak RSS, exit code and
+  number of retries of one RunCommand or RunCommandCaptureOutput call.
+
+  Arguments:
+    path: file to append records to.  None disables telemetry.
+    fmt: 'jsonl' for one JSON object per line or 'chrome' for a trace that
+      can be loaded into chrome://tracing.  Defaults to 'chrome' if path
+      ends in .json and 'jsonl' otherwise.
+  """
+  global _telemetry
+  if not path:
+    _telemetry = None
+    return
+  if fmt is None:
+    fmt = 'chrome' if path.endswith('.json') else 'jsonl'
+  _telemetry = _Telemetry(os.path.abspath(path), fmt)
+
+
+def _Popen(*args, **kwargs):
+  """Starts a command, tracking its resource usage if telemetry is on."""
+  if _telemetry:
+    return _RusagePopen(*args, **kwargs)
+  return subprocess.Popen(*args, **kwargs)
+
+
+def _RecordTelemetry(cmd, cwd, start, procs):
+  """Writes a telemetry record for a command and all of its retries.
+
+  Arguments:
+    cmd: the command that was run.
+    cwd: the working directory it was run in.
+    start: time.time() before the first attempt was started.
+    procs: the finished _RusagePopen objects, one per attempt.
+  """
+  if not _telemetry:
+    return
+
+  usages = [p.rusage for p in procs if p.rusage is not None]
+  record = {
+      'program': _GetCallerName(),
+      'pid': os.getpid(),
+      'argv': cmd,
+      'cwd': os.path.abspath(cwd or os.getcwd()),
+      'start': start,
+      'wall_secs': time.time() - start,
+      'user_secs': sum(u.ru_utime for u in usages),
+      'sys_secs': sum(u.ru_stime for u in usages),
+      # ru_maxrss is in kilobytes on Linux.
+      'max_rss_kb': max([u.ru_maxrss for u in usages] or [0]),
+      'returncode': procs[-1].returncode,
+      'retries': len(procs) - 1,
+  }
+  try:
+    _telemetry.Record(record)
+  except (IOError, OSError) as e:
+    _Info('Failed to write telemetry to %s: %s' % (_telemetry.path, e))
 
 
 def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
                exit_code=False, redirect_stdout=False, redirect_stderr=False,
                cwd=None, input=None, enter_chroot=False, num_retries=0,
-               log_to_file=None, combine_stdout_stderr=False):
+               log_to_file=None, combine_stdout_stderr=False,
+               chroot_session=None):
   """Runs a shell command.
 
   Arguments:
@@ -47,6 +196,8 @@ def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
     log_to_file: Redirects all stderr and stdout to file specified by this path.
     combine_stdout_stderr: Combines stdout and stdin streams into stdout. Auto
       set to true if log_to_file specifies a file.
+    chroot_session: a started ChrootSession to run the command in instead of
+      a new cros_sdk.  Implies enter_chroot.
 
   Returns:
     If exit_code is True, returns the return code of the shell command.
@@ -75,7 +226,11 @@ def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
     if combine_stdout_stderr: stderr = subprocess.STDOUT
 
   if input:  stdin = subprocess.PIPE
-  if enter_chroot:  cmd = ['cros_sdk', '--'] + cmd
+  popen = _Popen
+  if chroot_session:
+    popen = chroot_session.Popen
+  elif enter_chroot:
+    cmd = ['cros_sdk', '--'] + cmd
 
   # Print out the command before running.
   cmd_string = 'PROGRAM(%s) -> RunCommand: %r in dir %s' % (_GetCallerName(),
@@ -86,6 +241,8 @@ def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
     else:
       _Info('%s -- Logging to %s' % (cmd_string, log_to_file))
 
+  start = time.time()
+  procs = []
   for retry_count in range(num_retries + 1):
 
     # If it's not the first attempt, it's a retry
@@ -93,15 +250,17 @@ def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
       _Info('PROGRAM(%s) -> RunCommand: retrying %r in dir %s' %
             (_GetCallerName(), cmd, cwd))
 
-    proc = subprocess.Popen(cmd, cwd=cwd, stdin=stdin,
-                            stdout=stdout, stderr=stderr, close_fds=True)
+    proc = popen(cmd, cwd=cwd, stdin=stdin,
+                 stdout=stdout, stderr=stderr, close_fds=True)
     (output, error) = proc.communicate(input)
+    procs.append(proc)
 
     # if the command worked, don't retry any more.
     if proc.returncode == 0:
       break
 
   if file_handle: file_handle.close()
+  _RecordTelemetry(cmd, cwd, start, procs)
 
   # If they asked for an exit_code, give it to them on success or failure
   if exit_code:
@@ -125,7 +284,7 @@ def RunCommand(cmd, print_cmd=True, error_ok=False, error_message=None,
 def RunCommandCaptureOutput(cmd, print_cmd=True, cwd=None, input=None,
                             enter_chroot=False,
                             combine_stdout_stderr=True,
-                            verbose=False):
+                            verbose=False, chroot_session=None):
   """Runs a shell command. Differs from RunCommand, because it allows
      you to run a command and capture the exit code, output, and stderr
      all at the same time.
@@ -140,6 +299,8 @@ def RunCommandCaptureOutput(cmd, print_cmd=True, cwd=None, input=None,
       cwd must point to the scripts directory.
     combine_stdout_stderr -- combine outputs together.
     verbose -- also echo cmd.stdout and cmd.stderr to stdout and stderr
+    chroot_session: a started ChrootSession to run the command in instead of
+      a new cros_sdk.  Implies enter_chroot.
 
   Returns:
     Returns a tuple: (exit_code, stdout, stderr) (integer, string, string)
@@ -154,16 +315,22 @@ def RunCommandCaptureOutput(cmd, print_cmd=True, cwd=None, input=None,
   if input:  stdin = subprocess.PIPE
   if combine_stdout_stderr: stderr = subprocess.STDOUT
 
-  if enter_chroot:  cmd = ['cros_sdk', '--'] + cmd
+  popen = _Popen
+  if chroot_session:
+    popen = chroot_session.Popen
+  elif enter_chroot:
+    cmd = ['cros_sdk', '--'] + cmd
 
   # Print out the command before running.
   if print_cmd:
     _Info('PROGRAM(%s) -> RunCommand: %r in dir %s' %
           (_GetCallerName(), cmd, cwd))
 
-  proc = subprocess.Popen(cmd, cwd=cwd, stdin=stdin,
-                          stdout=stdout, stderr=stderr, close_fds=True)
+  start = time.time()
+  proc = popen(cmd, cwd=cwd, stdin=stdin,
+               stdout=stdout, stderr=stderr, close_fds=True)
   output, error = proc.communicate(input)
+  _RecordTelemetry(cmd, cwd, start, [proc])
 
   if verbose:
     if output: sys.stdout.write(output)
@@ -173,6 +340,251 @@ def RunCommandCaptureOutput(cmd, print_cmd=True, cwd=None, input=None,
   return proc.returncode, output, error
 
 
+# Runs inside the chroot for the lifetime of a ChrootSession.  Requests and
+# replies are lines of JSON on the two fifos named on its command line, so
+# the commands it runs inherit the stdin, stdout and stderr of cros_sdk.
+# Output that is captured is sent back base64 encoded.
+_CHROOT_HELPER = r"""
+import base64, json, subprocess, sys
+rep_out = open(sys.argv[2], 'wb')
+req_in = open(sys.argv[1], 'rb')
+def enc(data):
+  return data if data is None else base64.b64encode(data).decode('ascii')
+for line in iter(req_in.readline, b''):
+  req = json.loads(line.decode('utf-8'))
+  try:
+    proc = subprocess.Popen(
+        req['argv'], cwd=req['cwd'], close_fds=True,
+        stdin=subprocess.PIPE if req['input'] is not None else None,
+        stdout=subprocess.PIPE if req['stdout'] else None,
+        stderr=(subprocess.STDOUT if req['combine'] else
+                subprocess.PIPE if req['stderr'] else None))
+    out, err = proc.communicate(
+        req['input'] and base64.b64decode(req['input'].encode('ascii')))
+    rep = {'returncode': proc.returncode, 'stdout': enc(out), 'stderr': enc(err)}
+  except OSError as e:
+    rep = {'errno': e.errno, 'error': e.strerror}
+  rep_out.write(json.dumps(rep).encode('utf-8') + b'\n')
+  rep_out.flush()
+"""
+
+
+def _SetBlocking(fd):
+  """Clears O_NONBLOCK on a file descriptor."""
+  flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+  fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+
+class ChrootSession(object):
+  """Runs many commands inside the chroot through a single cros_sdk call.
+
+  Entering the chroot is far more expensive than most of the commands run
+  in it, so a session enters it once and starts a small helper that runs
+  each command it is sent.  Pass the session to RunCommand or
+  RunCommandCaptureOutput as chroot_session, or use its methods of the same
+  names.  Return codes and captured output are the same as with
+  enter_chroot.  Commands inherit the stdin, stdout and stderr the session
+  was started with, so output that is not captured appears as it is
+  written.
+
+  The helper is sent commands through two fifos in a temporary directory
+  under cwd, which has to be visible inside the chroot.
+
+  Usage:
+    with ChrootSession() as chroot:
+      chroot.RunCommand(['emerge-amd64-usr', '--info'])
+  """
+
+  # Seconds between checks that the helper has opened its fifos.
+  _START_POLL_SECS = 0.05
+
+  def __init__(self, cwd=None, python='python'):
+    """Initializes the session without entering the chroot.
+
+    Arguments:
+      cwd: the directory to run cros_sdk in, as with enter_chroot.  Command
+        cwds must be inside of it.
+      python: python interpreter inside the chroot used for the helper.
+    """
+    self.cwd = os.path.abspath(cwd or os.getcwd())
+    self._python = python
+    self._proc = None
+    self._fifo_dir = None
+    self._requests = None
+    self._replies = None
+    self._lock = threading.Lock()
+
+  def Start(self):
+    """Enters the chroot and starts the helper.
+
+    Raises:
+      RunCommandException if cros_sdk exits before the helper is running.
+    """
+    if self._proc:
+      return
+    self._fifo_dir = tempfile.mkdtemp(prefix='.chroot_session.', dir=self.cwd)
+    requests = os.path.join(self._fifo_dir, 'requests')
+    replies = os.path.join(self._fifo_dir, 'replies')
+    os.mkfifo(requests, 0o600)
+    os.mkfifo(replies, 0o600)
+    # Opening the read end without blocking lets the helper open the write
+    # end of replies right away.  It opens requests after that, so once
+    # requests can be opened for writing the helper is ready.
+    replies_fd = os.open(replies, os.O_RDONLY | os.O_NONBLOCK)
+    self._replies = os.fdopen(replies_fd, 'rb')
+
+    # Pass the helper as one argument with no whitespace or quotes so it
+    # survives however cros_sdk forwards the command line.
+    helper = 'exec(__import__("base64").b64decode("%s"))' % (
+        base64.b64encode(_CHROOT_HELPER.encode('utf-8')).decode('ascii'))
+    self._proc = subprocess.Popen(
+        ['cros_sdk', '--', self._python, '-c', helper,
+         os.path.relpath(requests, self.cwd),
+         os.path.relpath(replies, self.cwd)],
+        cwd=self.cwd, close_fds=True)
+
+    while True:
+      try:
+        requests_fd = os.open(requests, os.O_WRONLY | os.O_NONBLOCK)
+        break
+      except OSError as e:
+        if e.errno != errno.ENXIO:
+          self.Close()
+          raise
+      if self._proc.poll() is not None:
+        returncode = self.Close()
+        raise RunCommandException(
+            'Chroot session exited with %d before it started' % returncode)
+      time.sleep(self._START_POLL_SECS)
+    _SetBlocking(requests_fd)
+    _SetBlocking(replies_fd)
+    self._requests = os.fdopen(requests_fd, 'wb')
+
+  def Close(self):
+    """Stops the helper and leaves the chroot.
+
+    Returns:
+      The exit code of cros_sdk.
+    """
+    if not self._proc:
+      return None
+    proc, self._proc = self._proc, None
+    for f in (self._requests, self._replies):
+      if f:
+        try:
+          f.close()
+        except IOError:
+          pass
+    self._requests = self._replies = None
+    returncode = proc.wait()
+    shutil.rmtree(self._fifo_dir, ignore_errors=True)
+    self._fifo_dir = None
+    return returncode
+
+  def __enter__(self):
+    self.Start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.Close()
+
+  def Popen(self, cmd, cwd=None, stdin=None, stdout=None, stderr=None,
+            close_fds=True):
+    """Returns a subprocess.Popen work-alike running cmd in the chroot.
+
+    cmd is passed to subprocess.Popen inside the chroot unchanged, so a
+    string is the name of the program to run, as with _Popen.
+    """
+    if not self._proc:
+      raise RunCommandException('Chroot session has not been started')
+    rel_cwd = os.path.relpath(os.path.abspath(cwd or self.cwd), self.cwd)
+    if rel_cwd == os.pardir or rel_cwd.startswith(os.pardir + os.sep):
+      raise ValueError('cwd %s is outside of the chroot session dir %s' %
+                       (cwd, self.cwd))
+    return _ChrootSessionProc(self, cmd, rel_cwd, stdin, stdout, stderr)
+
+  def _Call(self, request):
+    """Sends one request to the helper and returns its decoded reply."""
+    with self._lock:
+      # The command writes to the same stdout and stderr, keep anything
+      # written before it ahead of its output.
+      sys.stdout.flush()
+      sys.stderr.flush()
+      try:
+        self._requests.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._requests.flush()
+        reply = self._replies.readline()
+      except (IOError, OSError):
+        reply = None
+      if not reply:
+        raise RunCommandException('Chroot session exited unexpectedly')
+    return json.loads(reply.decode('utf-8'))
+
+  def RunCommand(self, cmd, **kwargs):
+    """Same as the module level RunCommand, run in this session."""
+    return RunCommand(cmd, chroot_session=self, **kwargs)
+
+  def RunCommandCaptureOutput(self, cmd, **kwargs):
+    """Same as the module level RunCommandCaptureOutput, run in this session."""
+    return RunCommandCaptureOutput(cmd, chroot_session=self, **kwargs)
+
+
+class _ChrootSessionProc(object):
+  """The part of subprocess.Popen used by RunCommand, for ChrootSession.
+
+  Streams that are None are inherited from the session.  Streams that are
+  PIPE or a file object, as with log_to_file, are captured by the helper;
+  the output for a file object is written to it once the command exits.
+  """
+  rusage = None
+
+  def __init__(self, session, cmd, cwd, stdin, stdout, stderr):
+    self.returncode = None
+    self._session = session
+    self._cmd = cmd
+    self._cwd = cwd
+    self._stdin = stdin
+    self._stdout = stdout
+    self._stderr = stderr
+
+  @staticmethod
+  def _Decode(data):
+    return data if data is None else base64.b64decode(data)
+
+  @staticmethod
+  def _Relay(data, dest):
+    """Returns data if it was to be captured, writes it to dest otherwise."""
+    if dest == subprocess.PIPE:
+      return data
+    if data:
+      dest.write(data)
+      dest.flush()
+    return None
+
+  def communicate(self, input=None):
+    if self._stdin != subprocess.PIPE:
+      input = None
+    # Both streams going to the same file are combined like Popen would,
+    # keeping their order.
+    combine = (self._stderr == subprocess.STDOUT or
+               (self._stderr not in (None, subprocess.PIPE) and
+                self._stderr is self._stdout))
+    reply = self._session._Call({
+        'argv': self._cmd,
+        'cwd': self._cwd,
+        'input': input and base64.b64encode(input).decode('ascii'),
+        'stdout': self._stdout is not None,
+        'stderr': self._stderr is not None and not combine,
+        'combine': combine,
+    })
+    if 'error' in reply:
+      raise OSError(reply['errno'], reply['error'])
+
+    self.returncode = reply['returncode']
+    return (self._Relay(self._Decode(reply['stdout']), self._stdout),
+            self._Relay(self._Decode(reply['stderr']), self._stderr))
+
+
 class Color(object):
   """Conditionally wraps text in ANSI color escape sequences."""
   BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE = range(8)
@@ -244,3 +656,8 @@ def PrependChrootPath(path):
 def IsInsideChroot():
   """Returns True if we are inside chroot."""
   return os.path.exists('/etc/debian_chroot')
+
+
+if os.environ.get(TELEMETRY_FILE_ENV):
+  EnableTelemetry(os.environ[TELEMETRY_FILE_ENV],
+                  os.environ.get(TELEMETRY_FORMAT_ENV) or None)
@@ -6,8 +6,12 @@
 
 """Unit tests for cros_build_lib."""
 
+import json
 import mox
 import os
+import shutil
+import stat
+import sys
 import tempfile
 import unittest
 
@@ -104,6 +108,208 @@ class CrosBuildLibTest(mox.MoxTestBase):
     log_fh.close()
     os.remove(log_file)
 
+  def testGetCallerName(self):
+    """Test that the caller name is the top level script and is cached."""
+    name = cros_build_lib._GetCallerName()
+    self.assertFalse(os.path.sep in name)
+    self.mox.StubOutWithMock(cros_build_lib.sys, '_getframe')
+    self.mox.ReplayAll()
+    self.assertEqual(cros_build_lib._GetCallerName(), name)
+
+  def testTelemetryJsonLines(self):
+    """Test that RunCommand records each command as a line of JSON."""
+    log_file = tempfile.mktemp()
+    cros_build_lib.EnableTelemetry(log_file)
+    try:
+      cros_build_lib.RunCommand(['ls', '/nosuchdir'],
+                                # Keep the test quiet options
+                                print_cmd=False,
+                                redirect_stdout=True,
+                                redirect_stderr=True,
+                                # Test specific options
+                                num_retries=1,
+                                cwd='/',
+                                exit_code=True)
+      cros_build_lib.RunCommandCaptureOutput(['true'], print_cmd=False)
+    finally:
+      cros_build_lib.EnableTelemetry(None)
+
+    log_fh = open(log_file)
+    records = [json.loads(line) for line in log_fh]
+    log_fh.close()
+    os.remove(log_file)
+
+    self.assertEqual(len(records), 2)
+    self.assertEqual(records[0]['argv'], ['ls', '/nosuchdir'])
+    self.assertEqual(records[0]['cwd'], '/')
+    self.assertEqual(records[0]['retries'], 1)
+    self.assertNotEqual(records[0]['returncode'], 0)
+    self.assertTrue(records[0]['max_rss_kb'] > 0)
+    self.assertEqual(records[1]['argv'], ['true'])
+    self.assertEqual(records[1]['returncode'], 0)
+    self.assertEqual(records[1]['retries'], 0)
+
+  def testTelemetryChromeTrace(self):
+    """Test that RunCommand can append commands to a Chrome trace."""
+    log_file = tempfile.mktemp(suffix='.json')
+    cros_build_lib.EnableTelemetry(log_file)
+    try:
+      for _ in range(2):
+        cros_build_lib.RunCommand(['true'], print_cmd=False)
+    finally:
+      cros_build_lib.EnableTelemetry(None)
+
+    log_fh = open(log_file)
+    log_data = log_fh.read()
+    log_fh.close()
+    os.remove(log_file)
+
+    # The closing bracket is optional in the trace format, add it to parse.
+    events = json.loads(log_data.rstrip(',\n') + ']')
+    self.assertEqual(len(events), 2)
+    self.assertEqual(events[0]['name'], 'true')
+    self.assertEqual(events[0]['ph'], 'X')
+    self.assertEqual(events[0]['args']['returncode'], 0)
+
+
+class ChrootSessionTest(unittest.TestCase):
+  """Test ChrootSession against a stub cros_sdk."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.entries = os.path.join(self.tempdir, 'entries')
+    cros_sdk = os.path.join(self.tempdir, 'cros_sdk')
+    with open(cros_sdk, 'w') as f:
+      f.write('#!/bin/sh\n'
+              '[ "$1" = "--" ] && shift\n'
+              'echo "$PWD" >> "%s"\n'
+              'exec "$@"\n' % self.entries)
+    os.chmod(cros_sdk, stat.S_IRWXU)
+    self.old_path = os.environ['PATH']
+    os.environ['PATH'] = '%s:%s' % (self.tempdir, self.old_path)
+    self.session = cros_build_lib.ChrootSession(cwd=self.tempdir,
+                                                python=sys.executable)
+    self.session.Start()
+
+  def tearDown(self):
+    self.session.Close()
+    os.environ['PATH'] = self.old_path
+    shutil.rmtree(self.tempdir)
+
+  def testEntersOnce(self):
+    """Test that many commands only run cros_sdk once."""
+    for _ in range(3):
+      self.session.RunCommand(['true'], print_cmd=False)
+    self.assertEqual(self.session.Close(), 0)
+    with open(self.entries) as f:
+      self.assertEqual(f.read().splitlines(), [self.tempdir])
+
+  def testOutputAndInput(self):
+    """Test that output is captured and input is passed through."""
+    result = self.session.RunCommand(['cat'], print_cmd=False,
+                                     redirect_stdout=True, input='Hi')
+    self.assertEqual(result, 'Hi')
+    result = self.session.RunCommandCaptureOutput(
+        ['sh', '-c', 'echo -n out; echo -n err >&2'], print_cmd=False,
+        combine_stdout_stderr=False)
+    self.assertEqual(result, (0, 'out', 'err'))
+
+  def testCwd(self):
+    """Test that cwd is resolved relative to the session directory."""
+    subdir = os.path.join(self.tempdir, 'sub')
+    os.mkdir(subdir)
+    result = self.session.RunCommand(['pwd'], print_cmd=False,
+                                     redirect_stdout=True, cwd=subdir)
+    self.assertEqual(result.strip(), subdir)
+    self.assertRaises(ValueError, self.session.RunCommand, ['true'],
+                      print_cmd=False, cwd='/')
+
+  def testErrors(self):
+    """Test that failures are reported as with enter_chroot."""
+    result = self.session.RunCommand(['ls', '/nosuchdir'], print_cmd=False,
+                                     redirect_stdout=True,
+                                     redirect_stderr=True, exit_code=True)
+    self.assertNotEqual(result, 0)
+    self.assertRaises(cros_build_lib.RunCommandException,
+                      self.session.RunCommand, ['ls', '/nosuchdir'],
+                      print_cmd=False, redirect_stderr=True)
+    self.assertRaises(OSError, self.session.RunCommand, ['/nosuchcmd'],
+                      print_cmd=False)
+    # The session is still usable after a command fails.
+    self.assertEqual(self.session.RunCommand(['true'], print_cmd=False,
+                                             exit_code=True), 0)
+
+  def testStringCommand(self):
+    """Test that a string is the program to run, as with Popen."""
+    self.assertEqual(self.session.RunCommand('true', print_cmd=False,
+                                             exit_code=True), 0)
+    self.assertRaises(OSError, self.session.RunCommand, 'echo hi',
+                      print_cmd=False)
+
+  def testLogToFile(self):
+    """Test that log_to_file keeps stdout and stderr in order."""
+    log = os.path.join(self.tempdir, 'log')
+    self.session.RunCommand(['sh', '-c', 'echo 1; echo 2 >&2; echo 3'],
+                            print_cmd=False, log_to_file=log)
+    with open(log) as f:
+      self.assertEqual(f.read(), '1\n2\n3\n')
+
+  def _StartWithStdio(self, stdin, output):
+    """Starts a second session with its stdio on the given files."""
+    saved = [os.dup(fd) for fd in (0, 1, 2)]
+    try:
+      for fd, f in ((0, stdin), (1, output), (2, output)):
+        os.dup2(f.fileno(), fd)
+      session = cros_build_lib.ChrootSession(cwd=self.tempdir,
+                                             python=sys.executable)
+      session.Start()
+    finally:
+      for fd, old in enumerate(saved):
+        os.dup2(old, fd)
+        os.close(old)
+    return session
+
+  def testInheritsStdio(self):
+    """Test that commands use the session's stdio directly."""
+    path = os.path.join(self.tempdir, 'stdio')
+    with open(path, 'w') as f:
+      f.write('typed\n')
+    with open(path) as stdin:
+      with open(os.path.join(self.tempdir, 'output'), 'w+') as output:
+        session = self._StartWithStdio(stdin, output)
+        try:
+          self.assertEqual(session.RunCommand(['cat'], print_cmd=False,
+                                              redirect_stdout=True),
+                           'typed\n')
+          # The output is in the file while the command is still running.
+          self.assertEqual(session.RunCommand(
+              ['sh', '-c', 'echo live; grep -q live "$0"', output.name],
+              print_cmd=False, exit_code=True), 0)
+          session.RunCommand(['sh', '-c', 'echo 1; echo 2 >&2; echo 3'],
+                             print_cmd=False)
+        finally:
+          session.Close()
+        output.seek(0)
+        self.assertEqual(output.read(), 'live\n1\n2\n3\n')
+
+  def testStartFails(self):
+    """Test that a cros_sdk that exits early is reported."""
+    cros_sdk = os.path.join(self.tempdir, 'cros_sdk')
+    with open(cros_sdk, 'w') as f:
+      f.write('#!/bin/sh\nexit 3\n')
+    session = cros_build_lib.ChrootSession(cwd=self.tempdir,
+                                           python=sys.executable)
+    self.assertRaises(cros_build_lib.RunCommandException, session.Start)
+    self.assertEqual(session.Close(), None)
+
+  def testCleansUp(self):
+    """Test that closing the session removes its fifos."""
+    self.assertEqual(len([n for n in os.listdir(self.tempdir)
+                          if n.startswith('.chroot_session.')]), 1)
+    self.session.Close()
+    self.assertEqual([n for n in os.listdir(self.tempdir)
+                      if n.startswith('.chroot_session.')], [])
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+# Indexes the packages in portage trees and overlays so tree-wide checks can
+# share one scan instead of each walking tens of thousands of files.
+#
+# Each tree is scanned with scandir into cat/pkg -> version -> (keywords,
+# eclasses) and cached as gzipped json, keyed by the tree's real path.  Later
+# runs only re-read ebuilds whose mtime or size changed.
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+INDEX_FORMAT = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "overlay_index")
+
+# top level directories of a tree that are never categories
+NOT_CATEGORIES = frozenset(["eclass", "licenses", "metadata", "profiles", "scripts"])
+
+INHERIT_RE = re.compile(r"^\s*inherit\s+((?:[^\n\\]|\\\n)*)", re.MULTILINE)
+KEYWORDS_RE = re.compile(r"^\s*KEYWORDS=([\"']?)(.*?)\1\s*$", re.MULTILINE)
+
+
+class _Entry(object):
+    """ minimal stand-in for os.DirEntry when scandir isn't available"""
+
+    def __init__(self, parent, name):
+        self.name = name
+        self.path = os.path.join(parent, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def list_dir(path):
+    """ returns the entries of a directory, sorted by name"""
+    if scandir is not None:
+        entries = list(scandir(path))
+    else:
+        entries = [_Entry(path, name) for name in os.listdir(path)]
+    return sorted(entries, key=lambda e: e.name)
+
+
+def read_ebuild(path):
+    """ returns [keywords, eclasses] of an ebuild, both space separated"""
+    with io.open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    eclasses = []
+    for match in INHERIT_RE.finditer(text):
+        eclasses.extend(match.group(1).replace("\\\n", " ").split("#")[0].split())
+    keywords = KEYWORDS_RE.search(text)
+    return [" ".join(keywords.group(2).split()) if keywords else "",
+            " ".join(sorted(set(eclasses)))]
+
+
+def scan_tree(tree_path, old=None):
+    """ scans a tree, reusing entries from an older scan for unchanged ebuilds
+
+    returns a dict of cat/pkg to a dict of version to [mtime, size, keywords, eclasses]
+    """
+    old = old or {}
+    packages = {}
+    for cat in list_dir(tree_path):
+        if cat.name.startswith(".") or cat.name in NOT_CATEGORIES or not cat.is_dir():
+            continue
+        for pkg in list_dir(cat.path):
+            if not pkg.is_dir():
+                continue
+            name = cat.name + "/" + pkg.name
+            prefix = pkg.name + "-"
+            cached = old.get(name, {})
+            ebuilds = {}
+            for ebuild in list_dir(pkg.path):
+                if (not ebuild.name.startswith(prefix) or
+                        not ebuild.name.endswith(".ebuild") or
+                        not ebuild.is_file()):
+                    continue
+                ver = ebuild.name[len(prefix):-len(".ebuild")]
+                st = ebuild.stat()
+                entry = cached.get(ver)
+                if entry is None or entry[0] != st.st_mtime or entry[1] != st.st_size:
+                    entry = [st.st_mtime, st.st_size] + read_ebuild(ebuild.path)
+                ebuilds[ver] = entry
+            if ebuilds:
+                packages[name] = ebuilds
+    return packages
+
+
+def cache_path(cache_dir, tree_path):
+    key = hashlib.sha1(tree_path.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".json.gz")
+
+
+def load_tree(tree_path, cache_dir=DEFAULT_CACHE_DIR):
+    """ returns the package map of a tree, updating its cached index if needed"""
+    tree_path = os.path.realpath(tree_path)
+    if not os.path.isdir(tree_path):
+        raise IOError("{} is not a directory".format(tree_path))
+    if not cache_dir:
+        return scan_tree(tree_path)
+
+    path = cache_path(cache_dir, tree_path)
+    old = None
+    try:
+        with gzip.open(path, "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        if data.get("format") == INDEX_FORMAT and data.get("tree") == tree_path:
+            old = data["packages"]
+    except (IOError, ValueError, KeyError):
+        pass
+
+    packages = scan_tree(tree_path, old)
+    if packages != old:
+        data = {"format": INDEX_FORMAT, "tree": tree_path, "packages": packages}
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "wb") as raw:
+                # no name or mtime in the header so equal indexes are equal files
+                with gzip.GzipFile("", "wb", fileobj=raw, mtime=0) as f:
+                    f.write(json.dumps(data, sort_keys=True,
+                                       separators=(",", ":")).encode("utf-8"))
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            # the index is only a cache, still answer the query
+            sys.stderr.write("WARNING: could not save index {}: {}\n".format(path, e))
+    return packages
+
+
+def version_key(ver):
+    """ approximate portage version ordering without needing portage"""
+    return [(0, int(part)) if part.isdigit() else (1, part)
+            for part in re.split(r"(\d+)", ver) if part]
+
+
+class OverlayIndex(object):
+    """ the packages of a list of trees, from lowest to highest priority like PORTDIR_OVERLAY"""
+
+    def __init__(self, trees, cache_dir=DEFAULT_CACHE_DIR):
+        self.trees = [os.path.realpath(t) for t in trees]
+        self.packages = [load_tree(t, cache_dir) for t in self.trees]
+
+    def cpvs(self, tree):
+        """ lists every package in a tree in the form of cat/pkg-ver"""
+        packages = self.packages[self.trees.index(os.path.realpath(tree))]
+        return ["{}-{}".format(pkg, ver)
+                for pkg in sorted(packages) for ver in sorted(packages[pkg], key=version_key)]
+
+    def versions(self, pkg):
+        """ returns a list of (tree, {version: (keywords, eclasses)}) for trees that have pkg"""
+        found = []
+        for tree, packages in zip(self.trees, self.packages):
+            if pkg in packages:
+                found.append((tree, dict((ver, tuple(entry[2:]))
+                                         for ver, entry in packages[pkg].items())))
+        return found
+
+    def duplicates(self):
+        """ returns a dict of cat/pkg to the trees it is in, for packages in more than one"""
+        trees = {}
+        for tree, packages in zip(self.trees, self.packages):
+            for pkg in packages:
+                trees.setdefault(pkg, []).append(tree)
+        return dict((pkg, t) for pkg, t in trees.items() if len(t) > 1)
+
+    def shadowed(self):
+        """ returns a dict of cat/pkg-ver to (tree used, [trees shadowed]) for ebuilds in more than one tree"""
+        shadowed = {}
+        for pkg, trees in self.duplicates().items():
+            by_ver = {}
+            for tree in trees:
+                for ver in self.packages[self.trees.index(tree)][pkg]:
+                    by_ver.setdefault(ver, []).append(tree)
+            for ver, vtrees in by_ver.items():
+                if len(vtrees) > 1:
+                    shadowed["{}-{}".format(pkg, ver)] = (vtrees[-1], vtrees[:-1])
+        return shadowed
+
+    def inherits(self, eclass):
+        """ lists the cat/pkg-ver of every ebuild that inherits an eclass"""
+        found = set()
+        for packages in self.packages:
+            for pkg, ebuilds in packages.items():
+                for ver, entry in ebuilds.items():
+                    if eclass in entry[3].split():
+                        found.add("{}-{}".format(pkg, ver))
+        return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query packages across portage trees and overlays")
+    parser.add_argument("--cache-dir", help="where to keep the indexes, empty to always rescan",
+                        default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--json", help="print results as json", action="store_true")
+    commands = parser.add_subparsers(title="queries", dest="query")
+
+    c = commands.add_parser("dups", help="packages in more than one tree")
+    c.add_argument("trees", nargs="+", help="trees to compare")
+
+    c = commands.add_parser("shadowed", help="ebuilds hidden by the same version in a later tree")
+    c.add_argument("trees", nargs="+", help="trees from lowest to highest priority")
+
+    c = commands.add_parser("versions", help="versions, keywords and eclasses of a package")
+    c.add_argument("package", help="cat/pkg to look up")
+    c.add_argument("trees", nargs="+", help="trees to search")
+
+    c = commands.add_parser("inherits", help="ebuilds inheriting an eclass")
+    c.add_argument("eclass", help="eclass name")
+    c.add_argument("trees", nargs="+", help="trees to search")
+    args = parser.parse_args()
+
+    index = OverlayIndex(args.trees, args.cache_dir)
+    if args.query == "dups":
+        result = index.duplicates()
+        lines = sorted(result)
+    elif args.query == "shadowed":
+        result = index.shadowed()
+        lines = ["{} {} shadows {}".format(cpv, used, " ".join(hidden))
+                 for cpv, (used, hidden) in sorted(result.items())]
+    elif args.query == "versions":
+        result = index.versions(args.package)
+        lines = []
+        for tree, vers in result:
+            for ver in sorted(vers, key=version_key):
+                keywords, eclasses = vers[ver]
+                lines.append("{}-{} {} KEYWORDS=\"{}\" inherit {}".format(
+                    args.package, ver, tree, keywords, eclasses))
+    else:
+        result = index.inherits(args.eclass)
+        lines = result
+
+    if args.json:
+        print(json.dumps(result, sort_keys=True))
+    else:
+        for line in lines:
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+# Unit tests for overlay_index.
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import overlay_index
+
+
+class OverlayIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        self.portage = os.path.join(self.tempdir, "portage-stable")
+        self.overlay = os.path.join(self.tempdir, "coreos-overlay")
+        self.write(self.portage, "sys-apps/foo/foo-1.9.ebuild",
+                   'EAPI=6\ninherit eutils \\\n\tsystemd # comment\n'
+                   'KEYWORDS="amd64  ~arm64"\n')
+        self.write(self.portage, "sys-apps/foo/foo-1.10.ebuild",
+                   "inherit eutils\nKEYWORDS='amd64'\n")
+        self.write(self.portage, "sys-apps/bar/bar-2.ebuild", "EAPI=6\n")
+        self.write(self.portage, "sys-apps/bar/metadata.xml", "<pkgmetadata/>\n")
+        self.write(self.portage, "sys-apps/bar/bar-3.ebuild.orig", "")
+        self.write(self.portage, "eclass/eutils.eclass", "")
+        self.write(self.portage, "profiles/repo_name", "portage-stable\n")
+        self.write(self.overlay, "sys-apps/foo/foo-1.10.ebuild",
+                   "inherit systemd\nKEYWORDS=arm64\n")
+        self.write(self.overlay, "coreos-base/baz/baz-0.1.ebuild",
+                   "inherit systemd\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, tree, path, text):
+        path = os.path.join(tree, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(text)
+
+    def test_read_ebuild(self):
+        path = os.path.join(self.portage, "sys-apps/foo/foo-1.9.ebuild")
+        self.assertEqual(overlay_index.read_ebuild(path),
+                         ["amd64 ~arm64", "eutils systemd"])
+        path = os.path.join(self.portage, "sys-apps/bar/bar-2.ebuild")
+        self.assertEqual(overlay_index.read_ebuild(path), ["", ""])
+
+    def test_scan_tree(self):
+        packages = overlay_index.scan_tree(self.portage)
+        self.assertEqual(sorted(packages), ["sys-apps/bar", "sys-apps/foo"])
+        self.assertEqual(sorted(packages["sys-apps/foo"]), ["1.10", "1.9"])
+        self.assertEqual(packages["sys-apps/foo"]["1.10"][2:], ["amd64", "eutils"])
+        self.assertEqual(list(packages["sys-apps/bar"]), ["2"])
+
+    def test_scan_tree_reuses_unchanged(self):
+        old = overlay_index.scan_tree(self.portage)
+        old["sys-apps/bar"]["2"][2] = "cached"
+        old["sys-apps/foo"]["1.9"][0] -= 1
+        packages = overlay_index.scan_tree(self.portage, old)
+        self.assertEqual(packages["sys-apps/bar"]["2"][2], "cached")
+        self.assertEqual(packages["sys-apps/foo"]["1.9"][2], "amd64 ~arm64")
+
+    def test_load_tree_cache(self):
+        packages = overlay_index.load_tree(self.portage, self.cache_dir)
+        path = overlay_index.cache_path(self.cache_dir, os.path.realpath(self.portage))
+        with gzip.open(path, "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        self.assertEqual(data["format"], overlay_index.INDEX_FORMAT)
+        self.assertEqual(data["packages"], packages)
+        with open(path, "rb") as f:
+            saved = f.read()
+
+        # an unchanged tree gives the same answer without rewriting the index
+        os.utime(path, (0, 0))
+        self.assertEqual(overlay_index.load_tree(self.portage, self.cache_dir), packages)
+        self.assertEqual(os.stat(path).st_mtime, 0)
+
+        self.write(self.portage, "sys-apps/bar/bar-3.ebuild", "inherit git-r3\n")
+        packages = overlay_index.load_tree(self.portage, self.cache_dir)
+        self.assertEqual(packages["sys-apps/bar"]["3"][3], "git-r3")
+        with open(path, "rb") as f:
+            self.assertNotEqual(f.read(), saved)
+
+    def test_load_tree_bad_cache(self):
+        path = overlay_index.cache_path(self.cache_dir, os.path.realpath(self.portage))
+        os.makedirs(self.cache_dir)
+        with open(path, "wb") as f:
+            f.write(b"not gzip")
+        self.assertEqual(overlay_index.load_tree(self.portage, self.cache_dir),
+                         overlay_index.scan_tree(self.portage))
+        self.assertRaises(IOError, overlay_index.load_tree,
+                          os.path.join(self.tempdir, "missing"), self.cache_dir)
+
+    def test_version_key(self):
+        versions = ["1.10", "1.9", "1.9a", "2", "1.9_rc1"]
+        self.assertEqual(sorted(versions, key=overlay_index.version_key),
+                         ["1.9", "1.9_rc1", "1.9a", "1.10", "2"])
+
+    def test_queries(self):
+        index = overlay_index.OverlayIndex([self.portage, self.overlay], self.cache_dir)
+        portage = os.path.realpath(self.portage)
+        overlay = os.path.realpath(self.overlay)
+        self.assertEqual(index.cpvs(self.portage),
+                         ["sys-apps/bar-2", "sys-apps/foo-1.9", "sys-apps/foo-1.10"])
+        self.assertEqual(index.duplicates(), {"sys-apps/foo": [portage, overlay]})
+        self.assertEqual(index.shadowed(),
+                         {"sys-apps/foo-1.10": (overlay, [portage])})
+        self.assertEqual(index.inherits("systemd"),
+                         ["coreos-base/baz-0.1", "sys-apps/foo-1.10", "sys-apps/foo-1.9"])
+        self.assertEqual(index.versions("sys-apps/foo"), [
+            (portage, {"1.9": ("amd64 ~arm64", "eutils systemd"),
+                       "1.10": ("amd64", "eutils")}),
+            (overlay, {"1.10": ("arm64", "systemd")}),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()